@@ -4,7 +4,9 @@ __author__ = 'Guilherme Castelao'
 __email__ = 'guilherme@castelao.net'
 
 from cotede import qc
-from cotede.qc import ProfileQC, ProfileQCed
+from cotede.qc import ProfileQC, ProfileQCed, compare_cfgs, reflag
+from cotede.batch import qc_many
+from cotede.plan import compile_cfg
 
 from pkg_resources import get_distribution, DistributionNotFound
 
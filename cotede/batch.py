@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""Quality Control of many profiles at once
+
+Reprocessing a full archive, like a day of Argo or a GTSPP collection,
+means tens of thousands of independent profiles. Instead of creating one
+ProfileQC at a time, qc_many() resolves the QC configuration only once and
+distributes the profiles over a pool of processes.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import logging
+import os
+
+import numpy as np
+from numpy import ma
+
+from cotede import qctests
+from cotede.qc import ProfileQC
+from cotede.plan import compile_cfg
+from cotede.scheduler import seed_timing, timing_stats
+
+module_logger = logging.getLogger(__name__)
+
+# QC plan already compiled, available for each worker
+_WORKER_PLAN = None
+
+
+def _init_worker(plan, timing=None):
+    """Prepare a worker process to QC profiles
+
+    Import the heavy modules once per worker, so that the first profile of
+    each worker doesn't pay for it, and keep the compiled plan at hand,
+    with the timing of the procedures known so far.
+    """
+    global _WORKER_PLAN
+    _WORKER_PLAN = plan
+    if timing:
+        seed_timing(timing)
+
+    import cotede.qctests  # noqa: F401
+
+    try:
+        import oceansdb  # noqa: F401
+    except ImportError:
+        module_logger.debug("OceansDB package is not available")
+    try:
+        import gsw  # noqa: F401
+    except ImportError:
+        module_logger.debug("GSW package is not available")
+
+
+# Features of the climatology comparisons, and how to estimate them for
+# many profiles at once
+_CLIMATOLOGIES = (
+    ("woa_normbias", ("woa_bias", "woa_normbias"), qctests.woa_normbias_many),
+    ("cars_normbias", ("cars_bias", "cars_normbias"), qctests.cars_normbias_many),
+)
+
+
+def _climatology_stores(profiles, plan):
+    """A FeatureStore for each profile, with the climatologies in bulk
+
+    The climatology comparisons required by the plan are estimated for all
+    the profiles at once, so that each climatology grid cell is read only
+    once. Whatever fails here is left to be estimated, or to fail, by each
+    profile as usual.
+    """
+    stores = [qctests.FeatureStore() for p in profiles]
+    for name, features, many in _CLIMATOLOGIES:
+        targets = {}
+        for n, p in enumerate(profiles):
+            for v, c in plan.bind(p.keys()):
+                for step in plan.steps(c):
+                    # A tile store is already cheap to read one at a time
+                    if step.cfg.get("backend", "oceansdb") != "oceansdb":
+                        continue
+                    required = tuple(step.Procedure.produces(step.cfg)) + tuple(
+                        step.Procedure.consumes(step.cfg)
+                    )
+                    if any(f in required for f in features):
+                        targets.setdefault(v, []).append(n)
+                        break
+        for v, idx in targets.items():
+            try:
+                output = many([profiles[n] for n in idx], v)
+            except Exception as err:
+                module_logger.debug(
+                    "Failed to estimate {} in bulk for {}: {}".format(name, v, err)
+                )
+                continue
+            for n, y in zip(idx, output):
+                if y is not None:
+                    stores[n].get(name, lambda: y, varname=v)
+    return stores
+
+
+def _qc_profile(profile, plan, saveauxiliary, budget=None, store=None):
+    """QC a single profile and return only what is needed to the output"""
+    # The profile is already a private copy, either from the caller or
+    # unpickled in a worker, so there is no reason to copy it again.
+    pqc = ProfileQC(
+        profile,
+        cfg=plan,
+        saveauxiliary=saveauxiliary,
+        verbose=False,
+        copy=False,
+        budget=budget,
+        store=store,
+    )
+    output = {"flags": pqc.flags, "skipped": pqc.skipped}
+    if saveauxiliary:
+        output["features"] = pqc.features
+    return output
+
+
+def _qc_chunk(chunk, saveauxiliary, budget=None, plan=None):
+    """QC a sequence of (index, profile), by default inside a worker"""
+    if plan is None:
+        plan = _WORKER_PLAN
+    stores = _climatology_stores([p for i, p in chunk], plan)
+    return [
+        (i, _qc_profile(p, plan, saveauxiliary, budget, store))
+        for (i, p), store in zip(chunk, stores)
+    ]
+
+
+def _chunks(profiles, chunksize):
+    chunk = []
+    for item in enumerate(profiles):
+        chunk.append(item)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _segment_size(group):
+    """Number of rows of one profile for a group of flags or features"""
+    return max([np.size(group[k]) for k in group], default=0)
+
+
+def _to_columns(results, saveauxiliary):
+    """Concatenate the per profile results into columns
+
+    For each group (each variable and "common") the rows of all profiles are
+    concatenated. A procedure that was not applied in a profile is filled
+    with flag 0 (not evaluated), or NaN for features.
+    """
+    sizes = {}
+    for n, r in enumerate(results):
+        for group in r["flags"]:
+            sizes.setdefault(group, {})[n] = _segment_size(r["flags"][group])
+
+    output = {"profile": {}, "flags": {}}
+    output["skipped"] = {
+        n: r["skipped"] for n, r in enumerate(results) if r["skipped"]
+    }
+    if saveauxiliary:
+        output["features"] = {}
+
+    for group in sizes:
+        profile = np.concatenate(
+            [np.full(sizes[group][n], n, dtype="i") for n in sorted(sizes[group])]
+        )
+        output["profile"][group] = profile
+
+        for kind, dtype, fill in [("flags", "i1", 0), ("features", "f8", np.nan)]:
+            if kind not in output:
+                continue
+            names = []
+            for n in sizes[group]:
+                for k in results[n].get(kind, {}).get(group, {}):
+                    if k not in names:
+                        names.append(k)
+
+            columns = {}
+            for k in names:
+                column = np.full(profile.size, fill, dtype=dtype)
+                start = 0
+                for n in sorted(sizes[group]):
+                    N = sizes[group][n]
+                    try:
+                        value = results[n][kind][group][k]
+                    except KeyError:
+                        start += N
+                        continue
+                    value = np.atleast_1d(value)
+                    if kind == "features":
+                        value = ma.filled(ma.masked_invalid(value).astype(dtype), fill)
+                    if value.size in (1, N):
+                        column[start : start + N] = value
+                    else:
+                        module_logger.debug(
+                            "Skipping {}/{} on profile {}, inconsistent size".format(
+                                group, k, n
+                            )
+                        )
+                    start += N
+                columns[k] = column
+            output[kind][group] = columns
+
+    return output
+
+
+def qc_many(
+    profiles,
+    cfg=None,
+    workers=None,
+    saveauxiliary=False,
+    chunksize=8,
+    budget=None,
+    timing=None,
+):
+    """Quality Control a collection of profiles in parallel
+
+    The QC configuration is compiled only once, and the profiles
+    are distributed over a pool of worker processes, each one with CoTeDe,
+    OceansDB and GSW already imported.
+
+    Parameters
+    ----------
+    profiles: iterable
+        A sequence of dict-like objects, each one as expected by ProfileQC.
+        Each profile must be pickable to be sent to the workers.
+    cfg: dict-like or str, optional
+        The QC configuration to be used in all profiles. Check load_cfg()
+        for the available options.
+    workers: int, optional
+        Number of worker processes. If not given, uses the number of CPUs.
+        With workers=1 everything runs in the current process.
+    saveauxiliary: bool, optional
+        Also return the features.
+    chunksize: int, optional
+        Number of profiles sent to a worker at once. The climatology
+        comparisons of a chunk are estimated together, so that larger
+        chunks read each climatology grid cell fewer times.
+    budget: float, optional
+        Latency budget, in seconds, for each profile. Check ProfileQC for
+        details.
+    timing: dict, optional
+        Time of each procedure from earlier runs, as given by
+        scheduler.timing_stats(), so that the budget is respected since
+        the first profile of each worker. By default, the timing known by
+        this process.
+
+    Returns
+    -------
+    output: dict
+        The results in columnar form, i.e. for each variable (and "common")
+        the rows of all profiles are concatenated in the input order:
+
+        - output["profile"][var]: index of the profile of each row.
+        - output["flags"][var][test]: flags of test for all rows.
+        - output["features"][var][feature]: only if saveauxiliary.
+        - output["skipped"][n]: the tests skipped, by variable, on the
+          profile n. Only profiles with something skipped are listed.
+
+    Examples
+    --------
+    >>> output = qc_many(profiles, cfg="argo", workers=4)
+    >>> idx = output["profile"]["TEMP"] == 0
+    >>> output["flags"]["TEMP"]["overall"][idx]
+    """
+    plan = compile_cfg(cfg)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    assert workers >= 1, "workers must be a positive integer"
+    assert chunksize >= 1, "chunksize must be a positive integer"
+
+    if timing is None:
+        timing = timing_stats()
+
+    results = {}
+    if workers == 1:
+        seed_timing(timing)
+        for chunk in _chunks(profiles, chunksize):
+            results.update(_qc_chunk(chunk, saveauxiliary, budget, plan))
+    else:
+        # Limit the number of pending chunks, so that a long generator of
+        # profiles isn't completely loaded in memory.
+        max_pending = 4 * workers
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(plan, timing),
+        ) as executor:
+            pending = set()
+            for chunk in _chunks(profiles, chunksize):
+                pending.add(executor.submit(_qc_chunk, chunk, saveauxiliary, budget))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results.update(future.result())
+            for future in pending:
+                results.update(future.result())
+
+    results = [results[i] for i in range(len(results))]
+    module_logger.debug("QCed {} profiles".format(len(results)))
+    return _to_columns(results, saveauxiliary)
@@ -1,4 +1,4 @@
 #!/usr/bin/env python
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 
-from .fuzzy_core import fuzzyfy, fuzzy_uncertainty
+from .fuzzy_core import DefuzzTable, defuzz_table, fuzzyfy, fuzzy_uncertainty
@@ -14,6 +14,100 @@
 
 import numpy as np
 
+
+def centroid(x, mfx, axis=-1):
+    """Centroid of the area of a piecewise linear membership function
+
+    Each interval between consecutive x is a trapezoid. Intervals without
+    area, like mfx equal to zero on both ends, don't contribute.
+
+    Parameters
+    ----------
+    x : 1d array, length N
+        Independent variable.
+    mfx : array
+        Fuzzy membership function, with length N along axis.
+    axis : int, optional
+        Axis of mfx along x.
+
+    Returns
+    -------
+    u : float or array
+        The centroid, NaN if the total area is zero.
+    """
+    mfx = np.moveaxis(np.asanyarray(mfx, dtype=float), axis, -1)
+    x = np.asanyarray(x, dtype=float).ravel()
+    if x.size == 1:
+        return x[0] * mfx[..., 0] / np.fmax(mfx[..., 0], np.finfo(float).eps)
+
+    dx = np.diff(x)
+    y1 = mfx[..., :-1]
+    y2 = mfx[..., 1:]
+    # Area of each trapezoid times the position of its centroid
+    area = 0.5 * dx * (y1 + y2)
+    moment = area * x[:-1] + dx ** 2 * (2 * y2 + y1) / 6.0
+
+    total = area.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u = np.where(total > 0, moment.sum(axis=-1) / total, np.nan)
+    return u[()]
+
+
+def defuzz_along_axis(x, mfx, mode, axis=-1):
+    """Defuzzification of many membership functions at once
+
+    Equivalent to defuzz() applied on each mfx along the given axis, but
+    without Python loops. For instance, mfx with shape (M, N) gives the M
+    defuzzified values at once.
+
+    Parameters
+    ----------
+    x : 1d array, length N
+        Independent variable.
+    mfx : array
+        Fuzzy membership functions, with length N along axis.
+    mode : string
+        Defuzzification method, check defuzz().
+    axis : int, optional
+        Axis of mfx along x.
+
+    Returns
+    -------
+    u : array
+        Defuzzified results, with the shape of mfx without axis. NaN if the
+        total area is zero, for centroid or bisector.
+    """
+    mode = mode.lower()
+    x = np.asanyarray(x).ravel()
+    mfx = np.moveaxis(np.asanyarray(mfx), axis, -1)
+    assert mfx.shape[-1] == len(x), \
+        "Length of x and fuzzy membership function must be identical."
+
+    if 'centroid' in mode:
+        return centroid(x, mfx)
+
+    elif 'bisector' in mode:
+        tot_area = mfx.sum(axis=-1)
+        # Same as the sequential accumulation of defuzz()
+        reached = np.cumsum(mfx, axis=-1) >= (tot_area / 2.)[..., None]
+        u = x[np.argmax(reached, axis=-1)].astype(float)
+        u[(tot_area == 0) | ~reached.any(axis=-1)] = np.nan
+        return u
+
+    is_max = mfx == mfx.max(axis=-1)[..., None]
+    if 'mom' in mode:
+        return (is_max * x).sum(axis=-1) / is_max.sum(axis=-1)
+
+    elif 'som' in mode:
+        return x[np.argmin(np.where(is_max, np.abs(x), np.inf), axis=-1)]
+
+    elif 'lom' in mode:
+        return x[np.argmax(np.where(is_max, np.abs(x), -np.inf), axis=-1)]
+
+    else:
+        raise ValueError('The input for `mode`, %s, was incorrect.' % (mode))
+
+
 def defuzz(x, mfx, mode):
     """
     Defuzzification of a membership function, returning a defuzzified value
@@ -9,11 +9,170 @@
 
 """
 
+import hashlib
+import json
+import logging
+
 import numpy as np
 from numpy import ma
 
+from ..utils.utils import LRUCache
 from .membership_functions import smf, zmf, trapmf, trimf
-from .defuzz import defuzz
+from .membership_functions import _s_shape, _trapezoid, _z_shape
+from .defuzz import defuzz_along_axis
+
+module_logger = logging.getLogger(__name__)
+
+# Number of values of the output range, where the uncertainty is evaluated
+N_OUT = 100
+
+# Lookup tables recently built in this process, by output cfg and resolution
+_TABLES = LRUCache(16)
+
+# Fuzzy rules recently compiled in this process, by features & output cfg
+_RULES = LRUCache(128)
+
+
+def _as_float(x):
+    if isinstance(x, ma.MaskedArray):
+        return ma.filled(x.astype(float), np.nan)
+    return np.asarray(x, dtype=float)
+
+
+class FuzzyRules(object):
+    """Membership functions and rules of a fuzzy cfg, compiled once
+
+    The parameters of all membership functions, of all features, are
+    organized by shape (trapezoid, S, or Z), so that the memberships of
+    all features are evaluated together, in a single array with shape
+    (levels, features, N). The rules are then applied along the features
+    axis: the mean for each level, except the maximum for "high".
+
+    Use compile_rules() to obtain the rules of a cfg instead of creating
+    one directly.
+    """
+
+    def __init__(self, features, output):
+        self.features = tuple(features)
+        self.levels = tuple(output)
+
+        mfuncs = {"smf": smf, "trimf": trimf, "trapmf": trapmf, "zmf": zmf}
+        groups = {_trapezoid: [], _s_shape: [], _z_shape: []}
+        # Degenerated memberships, like a step, evaluated one by one
+        self._single = []
+        for i, m in enumerate(self.levels):
+            for j, t in enumerate(self.features):
+                assert m in features[t], "Missing %s in %s" % (m, features[t])
+                f = mfuncs[features[t][m]["type"]]
+                p = list(features[t][m]["params"])
+                # Validate the parameters as the membership functions do
+                f(np.array([]), p)
+                if p[0] == p[-1]:
+                    self._single.append((i, j, f, p))
+                elif f is trimf:
+                    groups[_trapezoid].append((i, j, [p[0], p[1], p[1], p[2]]))
+                elif f is trapmf:
+                    groups[_trapezoid].append((i, j, p))
+                elif f is smf:
+                    groups[_s_shape].append((i, j, p))
+                elif f is zmf:
+                    groups[_z_shape].append((i, j, p))
+
+        # For each shape: level & feature indices, and a column per parameter
+        self._groups = []
+        for shape in groups:
+            if len(groups[shape]) > 0:
+                i, j, p = zip(*groups[shape])
+                params = np.array(p, dtype=float).T[:, :, None]
+                self._groups.append((shape, np.array(i), np.array(j), params))
+
+    def __repr__(self):
+        return "<FuzzyRules {} -> {}>".format(self.features, self.levels)
+
+    def memberships(self, data):
+        """Membership of each feature on each level
+
+        Returns
+        -------
+        membership: np.ndarray
+            Array with shape (levels, features, N). Masked or NaN inputs
+            result in NaN.
+        """
+        x = [_as_float(data[t]) for t in self.features]
+        N = max([np.size(v) for v in x])
+        X = np.empty((len(self.features), N))
+        for j, v in enumerate(x):
+            X[j] = v
+
+        membership = np.empty((len(self.levels), len(self.features), N))
+        for shape, i, j, params in self._groups:
+            membership[i, j] = shape(X[j], *params)
+        for i, j, f, p in self._single:
+            membership[i, j] = f(X[j], p)
+        return membership
+
+    def __call__(self, data, require="all"):
+        """Apply the rules on data
+
+        Parameters
+        ----------
+        data : dict-like
+            The features.
+        require : all or any, optional
+            With "all", any NaN feature results in NaN. With "any", NaN
+            features are ignored, resulting in NaN only if all are NaN.
+
+        Returns
+        -------
+        rules : dict
+            The activation of each output level.
+        """
+        membership = self.memberships(data)
+
+        rules = {}
+        if require == "any":
+            invalid = np.isnan(membership)
+            count = (~invalid).sum(axis=1)
+            total = np.where(invalid, 0, membership).sum(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                mean = total / count
+            high = np.fmax.reduce(membership, axis=1)
+        else:
+            mean = np.mean(membership, axis=1)
+            high = np.max(membership, axis=1)
+
+        # Low & medium: mean(S_l(spike), S_l(clim)...)
+        # High: max(S_l(spike), S_l(clim)...)
+        for n, m in enumerate(self.levels):
+            if m != "high":
+                rules[m] = mean[n]
+        if "high" in self.levels:
+            rules["high"] = high[self.levels.index("high")]
+
+        return rules
+
+
+def compile_rules(features, output):
+    """Fuzzy rules for a cfg, cached in this process
+
+    Parameters
+    ----------
+    features : dict
+        The membership functions of each feature, as in the fuzzylogic cfg.
+    output : dict
+        The output levels, as in the fuzzylogic cfg.
+
+    Returns
+    -------
+    rules : FuzzyRules
+    """
+    serial = json.dumps([features, list(output)], sort_keys=True, default=str)
+    key = hashlib.sha1(serial.encode("utf-8")).hexdigest()
+    rules = _RULES.get(key)
+    if rules is not None:
+        return rules
+    module_logger.debug("Compiling fuzzy rules for: {}".format(features))
+    return _RULES.setdefault(key, FuzzyRules(features, output))
 
 
 def fuzzyfy(data, features, output, require="all"):
@@ -22,52 +181,202 @@ def fuzzyfy(data, features, output, require="all"):
     -----
     In the generalize this once the membership combining rules are defined
     in the cfg, so I can decide to use mean or max.
-    """
-    features_list = list(features.keys())
 
-    N = max([len(data[f]) for f in features_list])
+    The cfg is compiled only once, see FuzzyRules.
+    """
+    return compile_rules(features, output)(data, require=require)
 
-    # The fuzzy set are usually: low, medium, high
-    # The membership of each fuzzy set are each feature scaled.
-    membership = {f: {} for f in output.keys()}
 
+def _output_memberships(output):
+    """Output range and the membership of each output level on it"""
+    output_range = np.linspace(0, 1, N_OUT)
     mfuncs = {"smf": smf, "trimf": trimf, "trapmf": trapmf, "zmf": zmf}
-    for t in features_list:
-        for m in membership:
-            assert m in features[t], "Missing %s in %s" % (m, features[t])
-            f = mfuncs[features[t][m]["type"]]
-            membership[m][t] = f(np.asanyarray(data[t]), features[t][m]["params"])
-
-    # Rule Set
-    rules = {}
-    # Low: u_low = mean(S_l(spike), S_l(clim)...)
-    # u_low = np.mean([weights['spike']['low'],
-    #    weights['woa_relbias']['low']], axis=0)
-    # Medium: u_medium = mean(S_l(spike), S_l(clim)...)
-    # u_medium = np.mean([weights['spike']['medium'],
-    #    weights['woa_relbias']['medium']], axis=0)
-
-    for m in [m for m in membership if m != "high"]:
-        tmp = np.vstack([membership[m][f] for f in membership[m]])
-        if require == "any":
-            rules[m] = np.nanmean(tmp, axis=0)
-        else:
-            rules[m] = np.mean(tmp, axis=0)
+    Q = {}
+    for m in output:
+        f = mfuncs[output[m]["type"]]
+        Q[m] = f(output_range, output[m]["params"])
+    return output_range, Q
+
 
-    # High: u_high = max(S_l(spike), S_l(clim)...)
-    # u_high = np.max([weights['spike']['high'],
-    #    weights['woa_relbias']['high']], axis=0)
+def _aggregate(activation, Q):
+    """Aggregated output membership for each row of activation
 
-    tmp = np.vstack([membership["high"][f] for f in membership["high"]])
-    if require == "any":
-        rules["high"] = np.nanmax(tmp, axis=0)
-    else:
-        rules["high"] = np.max(tmp, axis=0)
+    Each column of activation is the activation of one level of Q, in the
+    same order.
+    """
+    aggregated = np.zeros((activation.shape[0], N_OUT))
+    for n, m in enumerate(Q):
+        aggregated = np.fmax(aggregated, np.fmin(activation[:, n, None], Q[m]))
+    return aggregated
+
+
+def _defuzz_rules(activation, output_range, Q, chunksize=10000):
+    """Bisector of the aggregated output for each row of activation
+
+    NaN if the aggregated output has no area.
+    """
+    uncertainty = np.nan * np.ones(activation.shape[0])
+    for ini in range(0, activation.shape[0], chunksize):
+        aggregated = _aggregate(activation[ini : ini + chunksize], Q)
+        u = defuzz_along_axis(output_range, aggregated, "bisector")
+        positive = aggregated.sum(axis=-1) > 0
+        uncertainty[ini : ini + chunksize][positive] = u[positive]
+    return uncertainty
+
+
+def _first_reached(cumulative, target, output_range):
+    """First output value where cumulative reaches target, the last if never"""
+    reached = cumulative >= target[:, None]
+    k = np.argmax(reached, axis=-1)
+    k[~reached.any(axis=-1)] = output_range.size - 1
+    return output_range[k]
+
+
+class DefuzzTable(object):
+    """Precomputed defuzzification over the space of rule activations
+
+    The activation of each output level is in [0, 1], so that space is
+    divided in resolution cells per level, and the uncertainty is
+    evaluated once at the center of each cell. The uncertainty of a
+    measurement is then simply the value of its cell.
+
+    Since the aggregated output increases with each activation, the
+    aggregated output of any point in a cell is bounded by the ones at the
+    lower and upper corners of that cell, which bounds the bisector. The
+    error of each cell, i.e. the maximum difference from the exact
+    uncertainty for any point in that cell, is given by .error.
+
+    Use defuzz_table() to obtain a table instead of creating one directly,
+    so it is built only once per output cfg.
+
+    Attributes
+    ----------
+    levels: tuple
+        Output levels, in the order of the table dimensions.
+    resolution: int
+        Number of cells per level.
+    value: np.ndarray
+        Uncertainty at the center of each cell.
+    error: np.ndarray
+        Bound of the error of each cell.
+    """
+
+    def __init__(self, output, resolution=50, chunksize=10000):
+        assert resolution >= 1, "resolution must be a positive integer"
+        self.key = _table_key(output, resolution)
+        self.output_range, self.Q = _output_memberships(output)
+        self.levels = tuple(self.Q)
+        self.resolution = resolution
+
+        L = len(self.levels)
+        shape = (resolution,) * L
+        edges = np.linspace(0, 1, resolution + 1)
+        cells = np.indices(shape).reshape(L, -1).T
+
+        value = np.empty(cells.shape[0])
+        error = np.empty(cells.shape[0])
+        for ini in range(0, cells.shape[0], chunksize):
+            c = cells[ini : ini + chunksize]
+            center = 0.5 * (edges[c] + edges[c + 1])
+            value[ini : ini + chunksize] = _defuzz_rules(
+                center, self.output_range, self.Q, chunksize
+            )
+
+            lower = _aggregate(edges[c], self.Q)
+            upper = _aggregate(edges[c + 1], self.Q)
+            # The bisector can't be reached before the upper bound reaches
+            # half of the smallest area, and it is reached once the lower
+            # bound reaches half of the largest area.
+            first = _first_reached(
+                np.cumsum(upper, axis=-1), 0.5 * lower.sum(axis=-1), self.output_range
+            )
+            last = _first_reached(
+                np.cumsum(lower, axis=-1), 0.5 * upper.sum(axis=-1), self.output_range
+            )
+            error[ini : ini + chunksize] = last - first
+
+        self.value = value.reshape(shape)
+        self.error = error.reshape(shape)
+
+    def __repr__(self):
+        return "<DefuzzTable {} x {}>".format(self.levels, self.resolution)
 
-    return rules
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # A table sent to another process, like with a QCPlan, is reused
+        _TABLES.setdefault(self.key, self)
 
+    @property
+    def max_error(self):
+        """Largest error bound in the table"""
+        return self.error.max()
 
-def fuzzy_uncertainty(data, features, output, require="all"):
+    def lookup(self, activation):
+        """Uncertainty for each row of activation
+
+        Parameters
+        ----------
+        activation: np.ndarray
+            Activation of each output level, with shape (N, levels).
+
+        Returns
+        -------
+        uncertainty: np.ndarray
+            NaN if the aggregated output has no area.
+        error: np.ndarray
+            Bound of the error, infinite if out of the table, like an
+            invalid activation.
+        """
+        activation = np.asarray(activation, dtype=float)
+        inside = np.all((activation >= 0) & (activation <= 1), axis=-1)
+        cell = np.zeros(activation.shape, dtype="i")
+        cell[inside] = np.minimum(
+            np.floor(activation[inside] * self.resolution), self.resolution - 1
+        )
+        cell = tuple(cell.T)
+
+        uncertainty = self.value[cell]
+        error = np.where(inside, self.error[cell], np.inf)
+
+        # Same condition of the exact solution to have an area
+        active = np.array([self.Q[m].max() > 0 for m in self.levels])
+        uncertainty[~np.any((activation > 0) & active, axis=-1)] = np.nan
+        uncertainty[~inside] = np.nan
+        return uncertainty, error
+
+
+def _table_key(output, resolution):
+    serial = json.dumps([output, resolution], sort_keys=True, default=str)
+    return hashlib.sha1(serial.encode("utf-8")).hexdigest()
+
+
+def defuzz_table(output, resolution=50):
+    """Defuzzification table for an output cfg, cached in this process
+
+    Parameters
+    ----------
+    output: dict
+        The output membership functions, as in the fuzzylogic cfg.
+    resolution: int, optional
+        Number of cells per output level. The table has resolution**levels
+        cells.
+
+    Returns
+    -------
+    table: DefuzzTable
+    """
+    key = _table_key(output, resolution)
+    table = _TABLES.get(key)
+    if table is not None:
+        return table
+    module_logger.debug("Building defuzzification table for: {}".format(output))
+    return _TABLES.setdefault(key, DefuzzTable(output, resolution))
+
+
+def fuzzy_uncertainty(
+    data, features, output, require="all", chunksize=10000, tolerance=None,
+    resolution=50,
+):
     """Estimate the Fuzzy uncertainty of the given data
 
     Parameters
@@ -77,6 +386,19 @@ def fuzzy_uncertainty(data, features, output, require="all"):
     output :
     require : all or any, optional
         Require all or any of the features to estimate the uncertainty
+    chunksize : int, optional
+        Number of measurements aggregated at once. The aggregated output
+        membership of each measurement has 100 values, thus this limits the
+        memory used.
+    tolerance : float, optional
+        If given, use a precomputed table (see DefuzzTable) to define the
+        uncertainty, with an error of at most tolerance. Measurements
+        where the table can't guarantee that are defuzzified as usual.
+        Useful for very large datasets, since the table is built only
+        once per output cfg.
+    resolution : int, optional
+        Number of cells per output level of the table, used only with
+        tolerance.
     """
     # It's not clear at Morello 2014 what is the operator K()
     # Q is the uncertainty, hence Q_low is the low uncertainty
@@ -95,23 +417,22 @@ def fuzzy_uncertainty(data, features, output, require="all"):
 
     rules = fuzzyfy(data=data, features=features, output=output, require=require)
 
-    N_out = 100
-    output_range = np.linspace(0, 1, N_out)
-    Q = {}
-    mfuncs = {"smf": smf, "trimf": trimf, "trapmf": trapmf, "zmf": zmf}
-    for m in output:
-        f = mfuncs[output[m]["type"]]
-        Q[m] = f(output_range, output[m]["params"])
+    output_range, Q = _output_memberships(output)
+    activation = np.column_stack([np.asarray(rules[m], dtype=float) for m in Q])
 
-    idx = np.isfinite([rules[r] for r in rules])
     # This would be the regular fuzzy approach.
-    uncertainty = np.nan * np.ones(np.shape(idx)[1:])
-    valid = np.nonzero(idx.all(axis=0))[0]
-    for i in valid:
-        aggregated = np.zeros(N_out)
-        for m in rules:
-            aggregated = np.fmax(aggregated, np.fmin(rules[m][i], Q[m]))
-        if aggregated.sum() > 0:
-            uncertainty[i] = defuzz(output_range, aggregated, "bisector")
+    uncertainty = np.nan * np.ones(activation.shape[0])
+    valid = np.nonzero(np.isfinite(activation).all(axis=-1))[0]
+    if tolerance is None:
+        uncertainty[valid] = _defuzz_rules(
+            activation[valid], output_range, Q, chunksize
+        )
+        return uncertainty
+
+    table = defuzz_table(output, resolution)
+    u, error = table.lookup(activation[valid])
+    exact = ~(error <= tolerance)
+    u[exact] = _defuzz_rules(activation[valid][exact], output_range, Q, chunksize)
+    uncertainty[valid] = u
 
     return uncertainty
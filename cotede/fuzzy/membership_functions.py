@@ -128,8 +128,6 @@ def trimf(x, p):
         idx = np.nonzero(np.logical_and(p[0] < x, x < p[1]))
         y[idx] = (x[idx] - p[0]) / float(p[1] - p[0])
 
-    y[np.nonzero(x == p[1])] = 1
-
     # Right side
     if p[1] != p[2]:
         idx = np.nonzero(np.logical_and(p[1] < x, x < p[2]))
@@ -137,6 +135,9 @@ def trimf(x, p):
 
     y[np.nonzero(x >= p[2])] = 0
 
+    # The peak, even if p[1] == p[0] or p[1] == p[2]
+    y[np.nonzero(x == p[1])] = 1
+
     return y
 
 
@@ -179,3 +180,58 @@ def zmf(x, p):
     y[np.nonzero(x >= p[1])] = 0
 
     return y
+
+
+def _trapezoid(x, a, b, c, d):
+    """Trapezoidal membership, with parameters broadcast against x
+
+    Same as trapmf(), but for many membership functions at once, like x with
+    shape (K, N) and each parameter with shape (K, 1). A triangle is a
+    trapezoid with b == c. Requires a < d.
+    """
+    # abs() only to avoid a negative zero if a == b or c == d. In that case
+    # the ratio at x == b (or c) is NaN, thus fmin() to ignore it.
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        y = np.subtract(x, a)
+        np.divide(y, np.abs(b - a), out=y)
+        fall = np.subtract(d, x)
+        np.divide(fall, np.abs(d - c), out=fall)
+        np.fmin(y, fall, out=y)
+    np.clip(y, 0, 1, out=y)
+    return y
+
+
+def _square_ramp(x, a, b, origin, lower, upper, scale):
+    """scale * clip((x - origin) / (b - a), lower, upper) ** 2"""
+    y = np.subtract(x, origin)
+    np.divide(y, b - a, out=y)
+    np.clip(y, lower, upper, out=y)
+    np.square(y, out=y)
+    np.multiply(y, scale, out=y)
+    return y
+
+
+def _s_shape(x, a, b):
+    """S-function membership, with parameters broadcast against x
+
+    Same as smf(), but for many membership functions at once. Requires
+    a < b.
+    """
+    with np.errstate(invalid="ignore", over="ignore"):
+        y = _square_ramp(x, a, b, a, 0, 1, 2.0)
+        upper = _square_ramp(x, a, b, b, -1, 0, -2.0)
+        np.add(upper, 1, out=upper)
+    return np.where(x < (a + b) / 2.0, y, upper)
+
+
+def _z_shape(x, a, b):
+    """Z-function membership, with parameters broadcast against x
+
+    Same as zmf(), but for many membership functions at once. Requires
+    a < b.
+    """
+    with np.errstate(invalid="ignore", over="ignore"):
+        y = _square_ramp(x, a, b, a, 0, 1, -2.0)
+        np.add(y, 1, out=y)
+        upper = _square_ramp(x, a, b, b, -1, 0, 2.0)
+    return np.where(x < (a + b) / 2.0, y, upper)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""Compiled QC plan
+
+A QC configuration, as given by load_cfg(), is resolved into a plan only
+once: which cfg is bound to each input variable, which procedure is used by
+each test, with its parameters already validated, and the order of
+execution. The most recently used plans are cached by a hash of the cfg, so
+that QCing many short profiles with the same cfg doesn't pay for that every
+time.
+"""
+
+from collections import namedtuple, OrderedDict
+from copy import deepcopy
+import hashlib
+import json
+import logging
+import re
+
+import numpy as np
+
+from cotede import qctests
+from cotede.fuzzy import defuzz_table
+from cotede.utils import load_cfg
+from cotede.utils.utils import LRUCache
+
+module_logger = logging.getLogger(__name__)
+
+# OceanSITES vocabulary used in the input, and the respective CF names
+_ALIASES = {"TEMP": "sea_water_temperature", "PSAL": "sea_water_salinity"}
+
+# Plans recently compiled in this process, by cfg_hash(). Bounded, since a
+# sweep over cfg variants would otherwise keep every plan, each one with its
+# defuzzification tables.
+_PLANS = LRUCache(32)
+
+
+Step = namedtuple("Step", ["name", "Procedure", "cfg", "key"])
+Step.__doc__ = """One test of a plan
+
+name is the test name in the cfg, Procedure the QCCheck class to apply,
+cfg its parameters and key a serialized version of cfg.
+"""
+
+
+def cfg_hash(cfg):
+    """Hash of a QC configuration
+
+    The order of the items is preserved, since that defines the order of
+    execution.
+    """
+    serial = json.dumps(cfg, default=str)
+    return hashlib.sha1(serial.encode("utf-8")).hexdigest()
+
+
+def _validate(name, cfg):
+    """Validate the parameters of a test, common to all procedures"""
+    if "threshold" in cfg:
+        threshold = cfg["threshold"]
+        assert (
+            (np.size(threshold) == 1)
+            and (threshold is not None)
+            and (np.isfinite(threshold))
+        ), "{}: threshold must be a single finite number".format(name)
+
+    if ("minval" in cfg) or ("maxval" in cfg):
+        assert ("minval" in cfg) and (
+            "maxval" in cfg
+        ), "{}: missing limits, minval & maxval".format(name)
+        assert cfg["minval"] < cfg["maxval"], (
+            "{}: minval ({}) must be smaller than maxval ({})".format(
+                name, cfg["minval"], cfg["maxval"]
+            )
+        )
+
+
+def compile_steps(cfg):
+    """Sequence of Steps from the cfg of a single variable
+
+    Only the tests based on a procedure from the catalog are included, in
+    the same order of the cfg.
+    """
+    steps = []
+    for name in cfg:
+        if (
+            (cfg[name] is None)
+            or ("procedure" not in cfg[name])
+            or (cfg[name]["procedure"] not in qctests.QCTESTS)
+        ):
+            continue
+        _validate(name, cfg[name])
+        Procedure = qctests.catalog(cfg[name]["procedure"])
+        key = json.dumps(cfg[name], sort_keys=True, default=str)
+        steps.append(Step(name, Procedure, cfg[name], key))
+    return tuple(steps)
+
+
+class QCPlan(object):
+    """A QC configuration compiled to be applied on many profiles
+
+    Use compile_cfg() to obtain a plan instead of creating one directly.
+    The plan is shared by every profile QCed with the same cfg, thus it
+    should not be modified, and its cfg is only given as a copy.
+    """
+
+    def __init__(self, cfg, key=None):
+        self._cfg = cfg
+        self._key = key if key is not None else cfg_hash(cfg)
+
+        variables = cfg.get("variables", {})
+        self._steps = OrderedDict((c, compile_steps(variables[c])) for c in variables)
+        self._patterns = tuple((c, re.compile("(%s)2?$" % c)) for c in variables)
+        # Input keys already bound, since most profiles have the same ones
+        self._bindings = {}
+        # Defuzzification tables, built with the plan and sent with it to
+        # the workers of qc_many()
+        self._tables = tuple(
+            defuzz_table(step.cfg["output"], step.cfg.get("resolution", 50))
+            for c in self._steps
+            for step in self._steps[c]
+            if issubclass(step.Procedure, qctests.FuzzyLogic)
+            and (step.cfg.get("tolerance") is not None)
+        )
+
+    def __repr__(self):
+        return "<QCPlan {}>".format(self._key)
+
+    @property
+    def cfg(self):
+        """A copy of the resolved QC configuration, as given by load_cfg()"""
+        return deepcopy(self._cfg)
+
+    @property
+    def key(self):
+        """Hash of the cfg"""
+        return self._key
+
+    def steps(self, c):
+        """Steps to apply for the variable c of the cfg"""
+        return self._steps[c]
+
+    def bind(self, keys):
+        """Bind the variables of an input to the cfg
+
+        Parameters
+        ----------
+        keys: sequence
+            Variables available in the input, like ["PRES", "TEMP", "PSAL"]
+
+        Returns
+        -------
+        bindings: tuple
+            Pairs (input variable, cfg variable) in the order of keys. An
+            input variable not covered by the cfg is not included.
+        """
+        keys = tuple(keys)
+        try:
+            return self._bindings[keys]
+        except KeyError:
+            pass
+
+        bindings = []
+        for v in keys:
+            vv = _ALIASES.get(v, v)
+            for c, pattern in self._patterns:
+                if pattern.match(vv):
+                    bindings.append((v, c))
+                    break
+        self._bindings[keys] = tuple(bindings)
+        return self._bindings[keys]
+
+
+def compile_cfg(cfg=None):
+    """Compile a QC configuration into a QCPlan
+
+    The most recently used plans are cached by a hash of the given cfg,
+    thus the same cfg is loaded, validated, and compiled only once per
+    process. Note that a cfg
+    saved in the user's collection (see load_cfg()) is not reloaded if
+    modified after its first use.
+
+    Parameters
+    ----------
+    cfg: dict-like, str, or QCPlan, optional
+        The QC configuration. Check load_cfg() for the available options.
+        A QCPlan is returned as it is.
+
+    Returns
+    -------
+    plan: QCPlan
+    """
+    if isinstance(cfg, QCPlan):
+        return cfg
+
+    key = cfg_hash(cfg)
+    plan = _PLANS.get(key)
+    if plan is not None:
+        return plan
+    module_logger.debug("Compiling QC plan for: {}".format(cfg))
+
+    resolved = load_cfg(cfg)
+    plan = QCPlan(resolved, key=cfg_hash(resolved))
+    # Also by the resolved cfg, so it can be given back
+    plan = _PLANS.setdefault(plan.key, plan)
+    return _PLANS.setdefault(key, plan)
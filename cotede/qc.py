@@ -5,9 +5,10 @@ import pkg_resources
 from copy import deepcopy
 from datetime import datetime
 from os.path import basename
-import re
 import json
 import logging
+import threading
+import time
 from typing import Any, Dict
 
 import numpy as np
@@ -15,18 +16,68 @@ from numpy import ma
 
 from cotede import qctests
 from cotede.misc import combined_flag
-from cotede.utils import load_cfg
+from cotede.plan import compile_cfg, compile_steps
+from cotede.scheduler import build_dag, expected_time, is_optional, run_dag
 
 
 module_logger = logging.getLogger(__name__)
 
 
+def _readonly(x):
+    """Read-only view of an array, without copying it
+
+    Anything else than a numpy array, like a tuple or a pandas.Series, is
+    returned as it is.
+    """
+    if not isinstance(x, np.ndarray):
+        return x
+
+    y = x.view()
+    # A view of a masked array shares the mask, so it must be protected too
+    if isinstance(y, ma.MaskedArray) and (y._mask is not ma.nomask):
+        y._mask = y._mask.view()
+        y._mask.flags.writeable = False
+    y.flags.writeable = False
+    return y
+
+
+class _ReadOnlyInput(object):
+    """Read-only access to the input of ProfileQC without copying it
+
+    Each item is returned as a read-only view of the caller's array, so any
+    procedure trying to modify the input in place fails instead of silently
+    corrupting the caller's data. The attrs are a shallow copy, since
+    ProfileQC can overwrite those.
+    """
+
+    def __init__(self, input):
+        self._input = input
+        if hasattr(input, "attrs"):
+            self.attrs = dict(input.attrs)
+        # For legacy compatibility
+        elif hasattr(input, "attributes"):
+            self.attributes = dict(input.attributes)
+
+    def __getattr__(self, name):
+        return getattr(self._input, name)
+
+    def __getitem__(self, key):
+        return _readonly(self._input[key])
+
+    def __contains__(self, key):
+        return key in self._input.keys()
+
+    def keys(self):
+        return self._input.keys()
+
+
 class ProfileQC(object):
     """Quality Control a CTD profile
     """
 
     def __init__(self, input, cfg=None, saveauxiliary=True, verbose=True,
-            attributes=None):
+            attributes=None, copy=True, threads=1, shortcircuit=False,
+            budget=None, reuse=None, store=None):
         """A procedure to QC a hydrographic profile
 
         Parameters
@@ -39,10 +90,11 @@ class ProfileQC(object):
             the whole dataset. For instance, input.attrs['lat'] would give the
             nominal latitude of the dataset input.
 
-        cfg: dict-like or str
+        cfg: dict-like, str, or QCPlan
             The QC configuration to be used in the current profile. If a
             string, it should be the name of a JSON QC configuration. Check
-            the manual for the available options.
+            the manual for the available options. It is compiled only once
+            per process, see compile_cfg().
 
         saveauxiliary: bool
             Save features as .features
@@ -53,11 +105,48 @@ class ProfileQC(object):
         attributes: dict-like, optional
             If given, append/overwirte the input.attrs
 
+        copy: bool, optional
+            If True (default), evaluate a deep copy of the input. Otherwise,
+            keep only read-only views of the caller's arrays, which avoids
+            doubling the memory for long records. In that case the caller
+            should not modify its data while using this ProfileQC.
+
+        threads: int, optional
+            Number of threads to apply the independent procedures, including
+            the ones of different variables, in parallel. The default is to
+            apply one procedure at a time.
+
+        shortcircuit: bool, optional
+            If True, apply the cheapest procedures first, and skip the
+            remaining ones for a variable once all its measurements already
+            have the worst flag (4), since the overall flag can't change
+            anymore. The skipped tests are flagged 0 and listed in .skipped.
+            Only whole profiles are skipped. A procedure still evaluates
+            every measurement if any of them can change, since most of them,
+            like the spike or Tukey53H, depend on the neighboring values.
+
+        budget: float, optional
+            Latency budget, in seconds, to QC this profile. An optional
+            procedure (like the climatology comparisons) is skipped if,
+            based on its typical time so far, it wouldn't finish within the
+            budget. The skipped tests are flagged 0 and listed in .skipped.
+
+        reuse: tuple, optional
+            A pair (features, cfg) from an earlier QC of this same input,
+            where features is the .features of that ProfileQC. The tests
+            whose features weren't affected by the changes in the cfg, like
+            a different threshold, reuse those features. Check reflag().
+
+        store: FeatureStore, optional
+            Features already estimated for this same input, for instance by
+            a ProfileQC with another cfg. Check compare_cfgs().
+
         Methods
         -------
         keys(self): List of input contents
         """
         # self.logger = logging.getLogger(logger or 'cotede.ProfileQC')
+        self._start = time.perf_counter()
 
         try:
             self.name = input.filename
@@ -67,34 +156,63 @@ class ProfileQC(object):
 
         assert (hasattr(input, 'keys')) and (len(input.keys()) > 0)
 
-        self.cfg = load_cfg(cfg)
-        module_logger.debug("Using cfg: {}".format(self.cfg))
+        self.plan = compile_cfg(cfg)
+        # The plan's own cfg, shared with other profiles, is not exposed
+        cfg = self.plan._cfg
+        self._cfg = None
+        module_logger.debug("Using cfg: {}".format(cfg))
 
-        self.input = deepcopy(input)
+        if copy:
+            self.input = deepcopy(input)
+        else:
+            self.input = _ReadOnlyInput(input)
         self._set_attrs(attributes)
         self.flags = {}
+        # Features shared by all procedures, so each one is computed once
+        if store is None:
+            store = qctests.FeatureStore()
+        self.store = store
+        # Procedures already applied, by inputs & cfg, to reuse across variables
+        self._shared = {}
+        self.threads = threads
+        self.shortcircuit = shortcircuit
+        self.budget = budget
+        # Time, in seconds, spent on each test
+        self.timing = {}
+        # Tests not applied, for each variable
+        self.skipped = {}
+        # Tests that reused the features from an earlier run
+        self.reused = {}
+        self._previous = None
+        if reuse is not None:
+            self._previous = (reuse[0], compile_cfg(reuse[1]))
+        self._reusable = {}
         self.saveauxiliary = saveauxiliary
         if saveauxiliary:
             #self.auxiliary = {}
             # build_auxiliary is not exactly the best way to do it.
             self.build_features()
 
-        if 'common' in self.cfg:
-            self.evaluate_common(self.cfg)
+        if 'common' in cfg:
+            self.evaluate_common(cfg)
 
-        for v in self.input.keys():
-            if v == 'TEMP':
-                vv = 'sea_water_temperature'
-            elif v == 'PSAL':
-                vv = 'sea_water_salinity'
-            else:
-                vv = v
-            for c in self.cfg['variables']:
-                if re.match("(%s)2?$" % c, vv):
-                    module_logger.debug(" %s - evaluating: %s, as type: %s" %
-                                            (self.name, v, c))
-                    self.evaluate(v, self.cfg['variables'][c])
-                    break
+        targets = []
+        for v, c in self.plan.bind(self.input.keys()):
+            module_logger.debug(" %s - evaluating: %s, as type: %s" %
+                                    (self.name, v, c))
+            targets.append((v, cfg['variables'][c], self.plan.steps(c)))
+        self._evaluate(targets)
+
+    @property
+    def cfg(self):
+        """The QC configuration applied
+
+        A copy, so modifying it doesn't affect the plan, shared by all the
+        profiles QCed with the same cfg.
+        """
+        if self._cfg is None:
+            self._cfg = self.plan.cfg
+        return self._cfg
 
     def _set_attrs(self, attrs: Dict[str, Any]):
         """Define ProfileQC's attributes (attrs)
@@ -149,7 +267,7 @@ class ProfileQC(object):
     def evaluate_common(self, cfg):
         self.flags['common'] = {}
 
-        if 'valid_datetime' in self.cfg['common']:
+        if 'valid_datetime' in cfg['common']:
             if 'datetime' in self.attrs.keys() and \
                     type(self.attrs['datetime']) == datetime:
                 f = 1
@@ -157,19 +275,20 @@ class ProfileQC(object):
                 f = 3
             self.flags['common']['valid_datetime'] = f
 
-        if 'datetime_range' in self.cfg['common']:
+        if 'datetime_range' in cfg['common']:
             if 'datetime' in self.attrs.keys() and \
                     (self.attrs['datetime'] >=
-                            self.cfg['common']['datetime_range']['minval']) and \
+                            cfg['common']['datetime_range']['minval']) and \
                     (self.attrs['datetime'] <=
-                            self.cfg['common']['datetime_range']['maxval']):
+                            cfg['common']['datetime_range']['maxval']):
                 f = 1
             else:
                 f = 3
             self.flags['common']['datetime_range'] = f
 
-        if 'location_at_sea' in self.cfg['common']:
-            y = qctests.LocationAtSea(self.input, cfg['common']['location_at_sea'])
+        if 'location_at_sea' in cfg['common']:
+            y = qctests.LocationAtSea(
+                self.input, cfg['common']['location_at_sea'], store=self.store)
 
             if self.saveauxiliary:
                 for f in y.features.keys():
@@ -187,8 +306,203 @@ class ProfileQC(object):
         #     except:
         #         pass
 
-    def evaluate(self, v, cfg):
+    def _construct(self, Procedure, v, cfg, upstream=None, features=None):
+        """Apply a QC procedure on variable v"""
+        kwargs = {"autoflag": True}
+        if upstream:
+            kwargs["upstream"] = upstream
+        if features is not None:
+            kwargs["features"] = features
+        if issubclass(Procedure, qctests.QCCheckVar):
+            return Procedure(self.input, varname=v, cfg=cfg,
+                             store=self.store, **kwargs)
+        elif issubclass(Procedure, qctests.QCCheck):
+            return Procedure(self.input, cfg=cfg, store=self.store, **kwargs)
+        # Legacy procedures, not derived from QCCheck
+        return Procedure(self.input, v, cfg, **kwargs)
+
+    def _apply(self, Procedure, v, cfg):
+        """Apply a QC procedure on variable v
+
+        Procedures that depend on the same inputs, with the same cfg, give
+        the same result. For instance, a density inversion or a monotonic
+        pressure check is the same for all variables, thus those are
+        evaluated only once and reused.
+        """
+        try:
+            inputs = Procedure.inputs(v, cfg)
+        except AttributeError:
+            inputs = None
+        shared = inputs is not None
+        if shared:
+            key = (Procedure, json.dumps(cfg, sort_keys=True, default=str),
+                   inputs, np.shape(self.input[v]))
+            if key in self._shared:
+                module_logger.debug("Reusing {} for {}".format(
+                    Procedure.__name__, v))
+                return self._shared[key]
+
+        y = self._construct(Procedure, v, cfg)
+
+        if shared:
+            self._shared[key] = y
+        return y
+
+    def _run_node(self, node, upstream):
+        """Apply the procedure of a node from the scheduler"""
+        # Skipped procedures give no result
+        upstream = [y for y in upstream if y is not None]
+        consumes = node.Procedure.consumes(node.cfg) if upstream else ()
+        features = {}
+        for y in upstream:
+            for f in consumes:
+                if f in y.features:
+                    features[f] = y.features[f]
+        return self._construct(node.Procedure, node.varname, node.cfg,
+                               upstream=features,
+                               features=self._reusable.get(node.key))
+
+    def _find_reusable(self, nodes, index):
+        """Features from an earlier run still valid for the current cfg
+
+        A node can reuse the features if the earlier cfg used the same
+        procedure for that test, with the same feature parameters, and all
+        the features required were saved.
+        """
+        features, plan = self._previous
+        previous = {v: plan._cfg['variables'][c]
+                    for v, c in plan.bind(self.input.keys())}
+
+        reusable = {}
+        for (v, name), key in index.items():
+            if (key in reusable) or (v not in previous) or (v not in features):
+                continue
+            Procedure = nodes[key].Procedure
+            cfg = nodes[key].cfg
+            old = previous[v].get(name)
+            if (not isinstance(old, dict)) or \
+                    (qctests.catalog(old.get("procedure")) is not Procedure):
+                continue
+            if not issubclass(Procedure, qctests.QCCheck):
+                continue
+            if Procedure.feature_params(old) != Procedure.feature_params(cfg):
+                continue
+            names = set(Procedure.produces(cfg)) | set(Procedure.consumes(cfg))
+            if (len(names) == 0) and \
+                    (Procedure.set_features is not qctests.QCCheck.set_features):
+                # Has features, but doesn't declare those
+                continue
+            if all(f in features[v] for f in names):
+                reusable[key] = {f: features[v][f] for f in names}
+        return reusable
+
+    def evaluate(self, v, cfg, steps=None):
+        """Evaluate the variable v with the tests defined in cfg"""
+        if steps is None:
+            steps = compile_steps(cfg)
+        self._evaluate([(v, cfg, steps)])
+
+    def _evaluate(self, targets):
+        """Evaluate a sequence of (variable, cfg, steps)
+
+        The steps of all the variables are scheduled together, so that the
+        same procedure isn't repeated on different variables, and the
+        independent ones can run in parallel.
+        """
+        for v, cfg, steps in targets:
+            self._prepare(v, cfg)
+
+        nodes, index = build_dag([(v, steps) for v, cfg, steps in targets])
+        if self._previous is not None:
+            self._reusable = self._find_reusable(nodes, index)
+        if self.shortcircuit or (self.budget is not None):
+            results, timing = run_dag(
+                nodes,
+                self._guard(index),
+                threads=self.threads,
+                priority=self._priority)
+        else:
+            results, timing = run_dag(
+                nodes, self._run_node, threads=self.threads)
+
+        for v, cfg, steps in targets:
+            self.timing[v] = {}
+            for step in steps:
+                key = index[(v, step.name)]
+                y = results[key]
+                self.timing[v][step.name] = timing[key]
+
+                if y is None:
+                    self.skipped.setdefault(v, []).append(step.name)
+                    self.flags[v][step.name] = np.zeros(
+                        np.shape(self.input[v]), dtype='i1')
+                    continue
+                if key in self._reusable:
+                    self.reused.setdefault(v, []).append(step.name)
 
+                if self.saveauxiliary:
+                    for f in y.features.keys():
+                        self.features[v][f] = y.features[f]
+                for f in y.flags:
+                    self.flags[v][f] = y.flags[f]
+
+            self.flags[v]['overall'] = combined_flag(self.flags[v])
+
+    def _priority(self, node):
+        """Order to apply the nodes ready to run"""
+        optional = (self.budget is not None) and is_optional(node)
+        cost = getattr(node.Procedure, "cost", 1) if self.shortcircuit else 0
+        return (optional, cost)
+
+    def _guard(self, index):
+        """Wrap _run_node() to skip nodes, by shortcircuit or budget
+
+        On shortcircuit, keeps the combined flag of each variable while the
+        nodes are applied. A node is skipped, returning None, if all the
+        variables that it evaluates have only the worst flag. There is no
+        partial skip, restricting the input to the measurements not flagged
+        4 yet would change the features estimated over a window. With a budget,
+        an optional node is skipped if it is expected to run out of time.
+        """
+        variables = {}
+        for (v, name), key in index.items():
+            variables.setdefault(key, set()).add(v)
+
+        worst = {}
+        for v in set(v for v, name in index):
+            worst[v] = np.zeros(np.shape(self.input[v]), dtype='i1')
+            for f in self.flags[v]:
+                worst[v] = np.maximum(worst[v], self.flags[v][f])
+
+        lock = threading.Lock()
+
+        def apply(node, upstream):
+            if (self.budget is not None) and is_optional(node):
+                elapsed = time.perf_counter() - self._start
+                if elapsed + expected_time(node.Procedure) > self.budget:
+                    module_logger.warning(
+                        "Skipping {}, out of time budget".format(node))
+                    return None
+
+            if self.shortcircuit:
+                with lock:
+                    done = all(np.all(worst[v] >= 4)
+                               for v in variables[node.key])
+                if done:
+                    module_logger.debug("Skipping {}".format(node))
+                    return None
+
+            y = self._run_node(node, upstream)
+            with lock:
+                for v in variables[node.key]:
+                    for f in y.flags:
+                        worst[v] = np.maximum(worst[v], y.flags[f])
+            return y
+
+        return apply
+
+    def _prepare(self, v, cfg):
+        """Flags of variable v that don't come from the procedures catalog"""
         self.flags[v] = {}
 
         # Apply common flag for all points.
@@ -207,14 +521,17 @@ class ProfileQC(object):
                     "Sorry I'm not ready to evaluate platform_identification()")
 
         if 'valid_geolocation' in cfg:
-            y = ValidGeolocation(
-                    self.input, v, cfg['valid_geolocation'], autoflag=True)
+            y = self._apply(qctests.ValidGeolocation, v,
+                            cfg['valid_geolocation'])
 
             if self.saveauxiliary:
                 for f in y.features.keys():
                     self.features[v][f] = y.features[f]
+            # A single position is valid, or not, for the whole profile
+            N = np.shape(self.input[v])
             for f in y.flags:
-                self.flags[v][f] = y.flags[f]
+                self.flags[v][f] = np.broadcast_to(
+                    y.flags[f], N).astype('i1')
 
         if 'valid_speed' in cfg:
             # Think about. Argo also has a test valid_speed, but that is
@@ -239,96 +556,6 @@ class ProfileQC(object):
             module_logger.warning(
                     "Sorry I'm not ready to evaluate frozen_profile()")
 
-        criteria = (c for c in cfg if (cfg[c] is not None) and ("procedure" in cfg[c]) and (cfg[c]["procedure"] in qctests.QCTESTS))
-        for criterion in criteria:
-            Procedure = qctests.catalog(cfg[criterion]["procedure"])
-            if issubclass(Procedure, qctests.QCCheckVar):
-                y = Procedure(self.input, varname=v, cfg=cfg[criterion], autoflag=True)
-            elif issubclass(Procedure, qctests.QCCheck):
-                y = Procedure(self.input, cfg=cfg[criterion], autoflag=True)
-
-            if self.saveauxiliary:
-                for f in y.features.keys():
-                    self.features[v][f] = y.features[f]
-            for f in y.flags:
-                self.flags[v][f] = y.flags[f]
-        #if 'spike_depthsmooth' in cfg:
-        #    from maud.window_func import _weight_hann as wfunc
-        #    cfg_tmp = cfg['spike_depthsmooth']
-        #    cfg_tmp['dzwindow'] = 10
-        #    smooth = ma.masked_all(self.input[v].shape)
-        #    z = ped['pressure']
-        #    for i in range(len(self.input[v])):
-        #        ind = np.nonzero(ma.absolute(z-z[i]) < \
-        #                cfg_tmp['dzwindow'])[0]
-        #        ind = ind[ind != i]
-        #        w = wfunc(z[ind]-z[i], cfg_tmp['dzwindow'])
-        #        smooth[i] = (T[ind]*w).sum()/w.sum()
-
-
-        #if 'pstep' in cfg:
-        #    ind = np.isfinite(self.input[v])
-        #    ind = ma.getmaskarray(self.input[v])
-        #    if self.saveauxiliary:
-        #        self.features[v]['pstep'] = ma.concatenate(
-        #                [ma.masked_all(1),
-        #                    np.diff(self.input['PRES'][ind])])
-
-        # FIXME: the Anomaly Detection and Fuzzy require some features
-        #   to be estimated previously. Generalize this.
-        if 'anomaly_detection' in  cfg:
-            features = {}
-            for f in cfg['anomaly_detection']['features']:
-                try:
-                    features[f] = self.features[v][f]
-                except:
-                    if f == 'spike':
-                        features['spike'] = qctests.spike(self.input[v])
-                    elif f == 'gradient':
-                        features['gradient'] = qctests.gradient(self.input[v])
-                    elif f == 'constant_cluster_size':
-                        features['constant_cluster_size'] = \
-                                qctests.constant_cluster_size(self.input[v])
-                    elif f == 'tukey53H_norm':
-                        features['tukey53H_norm'] = qctests.tukey53H_norm(self.input[v])
-                    elif f == 'rate_of_change':
-                        features['rate_of_change'] = qctests.rate_of_change(self.input[v])
-                    elif (f == 'woa_normbias'):
-                        y = qctests.WOA_NormBias(self.input, v, {}, autoflag=False)
-                        features['woa_normbias'] = \
-                                np.abs(y.features['woa_normbias'])
-                    elif (f == 'cars_normbias'):
-                        y = qctests.CARS_NormBias(self.input, v, {}, autoflag=False)
-                        features['cars_normbias'] = \
-                                np.abs(y.features['cars_normbias'])
-                    else:
-                        module_logger.error(
-                                "Sorry, I can't evaluate anomaly_detection with: %s" % f)
-
-            prob, self.flags[v]['anomaly_detection'] = \
-                    qctests.anomaly_detection(features, cfg['anomaly_detection'])
-
-            if self.saveauxiliary:
-                self.features[v]['anomaly_detection'] = prob
-
-        if 'morello2014' in cfg:
-            y = qctests.Morello2014(self.input, v, cfg['morello2014'], autoflag=True)
-            if self.saveauxiliary:
-                for f in y.features.keys():
-                    self.features[v][f] = y.features[f]
-            for f in y.flags:
-                self.flags[v][f] = y.flags[f]
-
-        if "fuzzylogic" in  cfg:
-            y = qctests.FuzzyLogic(self.input, v, cfg["fuzzylogic"], autoflag=True)
-            if self.saveauxiliary:
-                for f in y.features.keys():
-                    self.features[v][f] = y.features[f]
-            for f in y.flags:
-                self.flags[v][f] = y.flags[f]
-
-        self.flags[v]['overall'] = combined_flag(self.flags[v])
-
     def build_features(self):
         if not hasattr(self, 'features'):
             self.features = {}
@@ -341,6 +568,79 @@ class ProfileQC(object):
         #     logging.warn("Failled to run descentPrate")
 
 
+def reflag(input, features, cfg, previous_cfg, **kwargs):
+    """Quality Control again, reusing the features from an earlier run
+
+    When tuning a QC procedure, usually only the thresholds change. Instead
+    of starting from scratch, reuse the features estimated before, so that
+    only the tests affected by changes in the feature parameters, like
+    Tukey53H's l or CumRateOfChange's memory, estimate their features
+    again. All the others only apply the new thresholds.
+
+    Parameters
+    ----------
+    input: dict-like
+        The same input used on the earlier run.
+    features: dict
+        The features from the earlier run, i.e. ProfileQC(...).features,
+        which requires saveauxiliary=True.
+    cfg: dict-like or str
+        The new QC configuration.
+    previous_cfg: dict-like or str
+        The QC configuration used on the earlier run.
+    **kwargs:
+        Passed to ProfileQC.
+
+    Returns
+    -------
+    pqc: ProfileQC
+        The tests that reused the features are listed in pqc.reused.
+
+    Examples
+    --------
+    >>> pqc = ProfileQC(profile, cfg="cotede")
+    >>> cfg = load_cfg("cotede")
+    >>> cfg["variables"]["sea_water_temperature"]["spike"]["threshold"] = 4
+    >>> pqc2 = reflag(profile, pqc.features, cfg, "cotede")
+    """
+    return ProfileQC(input, cfg=cfg, reuse=(features, previous_cfg), **kwargs)
+
+
+def compare_cfgs(input, cfgs, **kwargs):
+    """Quality Control one dataset with several QC configurations
+
+    All the configurations share the same features, thus a feature used
+    by several cfgs, like the spike or the WOA comparison, is estimated
+    only once. Comparing N configurations costs about one estimate of the
+    union of the features plus N thresholdings.
+
+    Parameters
+    ----------
+    input: dict-like
+        The dataset to QC, as expected by ProfileQC.
+    cfgs: sequence
+        The QC configurations, each one as expected by ProfileQC.
+    **kwargs:
+        Passed to ProfileQC.
+
+    Returns
+    -------
+    output: list
+        One ProfileQC for each cfg, in the same order. Note that the
+        features are shared by all of them, thus shouldn't be modified.
+
+    Examples
+    --------
+    >>> argo, gtspp = compare_cfgs(profile, ["argo", "gtspp"])
+    >>> (argo.flags["TEMP"]["overall"] != gtspp.flags["TEMP"]["overall"]).sum()
+    """
+    if kwargs.pop("copy", True):
+        input = deepcopy(input)
+    store = qctests.FeatureStore()
+    return [ProfileQC(input, cfg=cfg, copy=False, store=store, **kwargs)
+            for cfg in cfgs]
+
+
 class ProfileQCed(ProfileQC):
     """
     """
@@ -1,13 +1,13 @@
 #!/usr/bin/env python
 
 from .qctests import *
-from .core import QCCheck, QCCheckVar
+from .core import FeatureStore, QCCheck, QCCheckVar
 from .descentPrate import descentPrate
-from .anomaly_detection import anomaly_detection
+from .anomaly_detection import AnomalyDetection, anomaly_detection
 from .possible_speed import possible_speed
 
 from .bin_spike import Bin_Spike, bin_spike
-from .cars_normbias import CARS_NormBias, cars_normbias
+from .cars_normbias import CARS_NormBias, cars_normbias, cars_normbias_many
 from .constant_cluster_size import ConstantClusterSize, constant_cluster_size
 from .cum_rate_of_change import CumRateOfChange, cum_rate_of_change
 from .deepest_pressure import DeepestPressure
@@ -24,7 +24,7 @@ from .rate_of_change import RateOfChange, rate_of_change
 from .spike import Spike, spike
 from .spike_depthconditional import SpikeDepthConditional
 from .tukey53H import Tukey53H, tukey53H, tukey53H_norm
-from .woa_normbias import WOA_NormBias, woa_normbias
+from .woa_normbias import WOA_NormBias, woa_normbias, woa_normbias_many
 from .stuck_value import StuckValue
 from .valid_geolocation import ValidGeolocation
 
@@ -33,6 +33,7 @@ from .morello2014 import Morello2014, morello2014
 
 
 QCTESTS = {
+    "AnomalyDetection": AnomalyDetection,
     "Bin_Spike": Bin_Spike,
     "CARS_NormBias": CARS_NormBias,
     "ConstantClusterSize": ConstantClusterSize,
@@ -40,11 +41,13 @@ QCTESTS = {
     "DeepestPressure": DeepestPressure,
     "DensityInversion": DensityInversion,
     "DigitRollOver": DigitRollOver,
+    "FuzzyLogic": FuzzyLogic,
     "GlobalRange": GlobalRange,
     "Gradient": Gradient,
     "GradientDepthConditional": GradientDepthConditional,
     "LocationAtSea": LocationAtSea,
     "MonotonicZ": MonotonicZ,
+    "Morello2014": Morello2014,
     "ProfileEnvelop": ProfileEnvelop,
     "RateOfChange": RateOfChange,
     "RegionalRange": RegionalRange,
@@ -9,6 +9,14 @@ import logging
 import numpy as np
 #from numpy import ma
 from cotede.anomaly_detection import estimate_anomaly
+from .core import QCCheckVar
+from .cars_normbias import cars_normbias
+from .constant_cluster_size import constant_cluster_size
+from .gradient import gradient
+from .rate_of_change import rate_of_change
+from .spike import spike
+from .tukey53H import tukey53H_norm
+from .woa_normbias import backend_params, woa_normbias
 
 
 module_logger = logging.getLogger(__name__)
@@ -27,3 +35,76 @@ def anomaly_detection(features, cfg):
     flag[np.nonzero(prob < cfg['threshold'])] = 4
 
     return prob, flag
+
+
+class AnomalyDetection(QCCheckVar):
+    """Anomaly detection based on the features of other procedures
+
+    Features already estimated by the upstream procedures are used as they
+    are, while the missing ones are estimated with the default parameters,
+    and the climatologies read with the backend given in the cfg, if any.
+    """
+
+    cost = 20
+    optional = True
+
+    @classmethod
+    def consumes(cls, cfg=None):
+        return tuple(cfg["features"])
+
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("anomaly_detection",)
+
+    def set_features(self):
+        x = self.data[self.varname]
+        kernels = {
+            "spike": lambda: spike(x),
+            "gradient": lambda: gradient(x),
+            "constant_cluster_size": lambda: constant_cluster_size(x),
+            "tukey53H_norm": lambda: tukey53H_norm(x),
+            "rate_of_change": lambda: rate_of_change(x),
+        }
+        backend = self.cfg.get("backend", "oceansdb")
+        features = {}
+        for f in self.cfg["features"]:
+            if f in self.upstream:
+                features[f] = self.upstream[f]
+            elif f in kernels:
+                features[f] = self._feature(f, kernels[f])
+            elif f == "woa_normbias":
+                y = self._feature(
+                    "woa_normbias",
+                    lambda: woa_normbias(
+                        self.data, self.varname, self.attrs, backend=backend
+                    ),
+                    **backend_params(backend)
+                )
+                features[f] = np.abs(y["woa_normbias"])
+            elif f == "cars_normbias":
+                y = self._feature(
+                    "cars_normbias",
+                    lambda: cars_normbias(
+                        self.data, self.varname, self.attrs, backend=backend
+                    ),
+                    **backend_params(backend)
+                )
+                features[f] = np.abs(y["cars_normbias"])
+            else:
+                module_logger.error(
+                    "Sorry, I can't evaluate anomaly_detection with: %s" % f
+                )
+
+        self.features = {
+            "anomaly_detection": estimate_anomaly(features, params=self.cfg["features"])
+        }
+
+    def test(self):
+        self.flags = {}
+        prob = self.features["anomaly_detection"]
+
+        flag = np.zeros(prob.shape, dtype="i1")
+        flag[np.nonzero(prob >= self.cfg["threshold"])] = 1
+        flag[np.nonzero(prob < self.cfg["threshold"])] = 4
+
+        self.flags["anomaly_detection"] = flag
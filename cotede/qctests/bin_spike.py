@@ -6,83 +6,115 @@
 
 """
 
+import logging
+
 import numpy as np
 from numpy import ma
 
+from .core import nan_filled
+from .qctests import QCCheckVar
+from .rolling import Rolling
 
-def bin_spike(x, l):
+module_logger = logging.getLogger(__name__)
+
+
+def _window_std(x, half_window):
+    """Std of the l neighbors of each x[i], i.e. excluding x[i] itself
+
+    Combining the moments of the l/2 values before, x[i-l/2:i], with the
+    l/2 values after, x[i+1:i+l/2+1].
     """
+    N = len(x)
+    r = Rolling(x, half_window, center=False, min_periods=1)
+    n = r.count()
+    mean = np.nan_to_num(r.mean())
+    ss = n * np.nan_to_num(r.std(ddof=0)) ** 2
+
+    def shift(z, k):
+        """z[i + k] at the position i"""
+        y = np.zeros(N)
+        # Nothing to shift in if the profile is shorter than the window
+        k = max(-N, min(N, k))
+        y[max(0, -k) : N - max(0, k)] = z[max(0, k) : N - max(0, -k)]
+        return y
+
+    nl, ml, ssl = (shift(v, -1) for v in (n, mean, ss))
+    nr, mr, ssr = (shift(v, half_window) for v in (n, mean, ss))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = nl + nr
+        ss = ssl + ssr + nl * nr / n * (ml - mr) ** 2
+        return np.sqrt(ss / n)
+
+
+def bin_spike(x, l):
+    """Spike measured as the anomaly from the median of a bin
+
+        The anomaly of each measurement from the median of the l
+          surrounding values, x[i-l/2:i+l/2], normalized by the standard
+          deviation of its l neighbors, x[i-l/2:i] and x[i+1:i+l/2+1].
 
         l is the number of points used for comparison, thus l=2 means that each
           point will be compared only against the previous and following
           measurements. l=2 is is probably not a good choice, too small.
 
-        Maybe use pstsd instead?
-
-        Dummy way to avoid warnings when x[ini:fin] are all masked.
-        Improve this in the future.
+        Invalid values, masked or NaN, are ignored, and at least 3 valid
+          values are required in the bin. The first and last l/2
+          measurements are not evaluated.
     """
-    assert x.ndim == 1, "I'm not ready to deal with multidimensional x"
+    assert np.ndim(x) == 1, "I'm not ready to deal with multidimensional x"
+
+    assert l % 2 == 0, "l must be an even integer"
 
-    assert l%2 == 0, "l must be an even integer"
+    x = nan_filled(x)
+    x = np.asarray(x, dtype="f8")
 
     N = len(x)
-    bin = ma.masked_all(N)
-    # bin_std = ma.masked_all(N)
-    half_window = int(l/2)
-    idx = (i for i in range(half_window, N - half_window) if np.isfinite(x[i]))
-    for i in idx:
-        ini = max(0, i - half_window)
-        fin = min(N, i + half_window)
-        # At least 3 valid points
-        if ma.compressed(x[ini:fin]).size >= 3:
-            bin[i] = x[i] - ma.median(x[ini:fin])
-            # bin_std[i] = (np.append(x[ini:i], x[i+1:fin+1])).std()
-            bin[i] /= (np.append(x[ini:i], x[i+1:fin+1])).std()
-
-    return bin
-
-
-class Bin_Spike(object):
-    def __init__(self, data, varname, cfg, autoflag=True):
-        self.data = data
-        self.varname = varname
-        self.cfg = cfg
-
-        self.set_features()
-        if autoflag:
-            self.test()
-
-    def keys(self):
-        return self.features.keys() + \
-            ["flag_%s" % f for f in self.flags.keys()]
+    half_window = l // 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        anomaly = x - Rolling(x, l, min_periods=3).median()
+        # A constant bin has no spike, not an undefined one
+        bin = np.where(anomaly == 0, 0.0, anomaly / _window_std(x, half_window))
+    bin[: min(N, half_window)] = np.nan
+    bin[max(0, N - half_window) :] = np.nan
+
+    return ma.masked_where(np.isnan(bin), bin)
+
+
+class Bin_Spike(QCCheckVar):
+    flag_bad = 3
+    cost = 5
+
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("bin_spike",)
 
     def set_features(self):
-        self.features = {'bin_spike': bin_spike(self.data[self.varname],
-            self.cfg['l'])}
+        l = self.cfg["l"]
+        self.features = {
+            "bin_spike": self._feature(
+                "bin_spike", lambda: bin_spike(self.data[self.varname], l), l=l
+            )
+        }
 
     def test(self):
         self.flags = {}
         try:
-            threshold = self.cfg['threshold']
-        except:
+            threshold = self.cfg["threshold"]
+        except KeyError:
             print("Deprecated cfg format. It should contain a threshold item.")
             threshold = self.cfg
 
-        try:
-            flag_good = self.cfg['flag_good']
-            flag_bad = self.cfg['flag_bad']
-        except:
-            print("Deprecated cfg format. It should contain flag_good & flag_bad.")
-            flag_good = 1
-            flag_bad = 3
-
-        assert (np.size(threshold) == 1) and \
-                (threshold is not None) and \
-                (np.isfinite(threshold))   
-
-        flag = np.zeros(self.data[self.varname].shape, dtype='i1')
-        flag[np.nonzero(self.features['bin_spike'] > threshold)] = flag_bad
-        flag[np.nonzero(self.features['bin_spike'] <= threshold)] = flag_good
-        flag[ma.getmaskarray(self.data[self.varname])] = 9
-        self.flags['bin_spike'] = flag
+        assert (
+            (np.size(threshold) == 1)
+            and (threshold is not None)
+            and (np.isfinite(threshold))
+        )
+
+        flag = np.zeros(np.shape(self.data[self.varname]), dtype="i1")
+        feature = ma.filled(self.features["bin_spike"], np.nan)
+        flag[feature > threshold] = self.flag_bad
+        flag[feature <= threshold] = self.flag_good
+        x = np.atleast_1d(self.data[self.varname])
+        flag[ma.getmaskarray(x) | ~np.isfinite(x)] = 9
+        self.flags["bin_spike"] = flag
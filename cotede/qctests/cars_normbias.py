@@ -8,129 +8,52 @@ import logging
 
 import numpy as np
 from numpy import ma
-from oceansdb import CARS
 
 from . import QCCheckVar
-from ..utils import extract_coordinates, extract_time, day_of_year, extract_depth
+from .woa_normbias import (
+    backend_params,
+    _climatology,
+    _climatology_request,
+    _extract,
+    _prefetchable,
+    _requests,
+    _standard_error_bias,
+)
+from ..utils import netcdf_lock
 
 
 module_logger = logging.getLogger(__name__)
 
 
-def cars_normbias(data, varname, attrs=None, use_standard_error=False):
-    """
-
-    Notes
-    -----
-    - Include arguments to overwrite target variable (timename=None, latname=None, lonname=None)
+CARS_VARS = [
+    "mean",
+    # "standard_deviation",
+    "std_dev",
+    # "number_of_observations",
+]
 
-    """
-    try:
-        doy = day_of_year(extract_time(data, attrs))
-    except LookupError as err:
-        module_logger.error("Missing time")
-        raise
-
-    try:
-        # Note that QCCheck fallback to self.data.attrs if attrs not given
-        lat, lon = extract_coordinates(data, attrs)
-    except LookupError:
-        module_logger.error("Missing geolocation (lat/lon)")
-        raise
-
-    kwargs = {"lat": lat, "lon": lon}
-
-    if (np.size(lat) > 1) | (np.size(lon) > 1):
-        dLmax = max(np.max(lat) - np.min(lat), np.max(lon) - np.min(lon))
-        if dLmax >= 0.01:
-            mode = "track"
-            # kwargs["alongtrack_axis"] = ['lat', 'lon']
-        else:
-            mode = "profile"
-            kwargs = {
-                "lat": np.mean(lat),
-                "lon": np.mean(lon),
-            }
-            module_logger.warning(
-                "Multiple lat/lon positions but too close to each other so it will be considered a single position for the WOA comparison. lat: {}, lon: {}".format(
-                    kwargs["lat"], kwargs["lon"]
-                )
-            )
-    else:
-        mode = "profile"
-
-    depth = extract_depth(data)
-
-    db = CARS()
-    # This must go away. This was a trick to handle Seabird CTDs, but
-    # now that seabird is a different package it should be handled there.
-    if isinstance(varname, str) and (varname[-1] == "2"):
-        vtype = varname[:-1]
-    else:
-        vtype = varname
-
-    cars_vars = [
-        "mean",
-        # "standard_deviation",
-        "std_dev",
-        # "number_of_observations",
-    ]
-
-    # Eventually the case of some invalid depth levels will be handled by
-    # OceansDB and the following steps will be simplified.
-    valid_depth = depth
-    if np.size(depth) > 0:
-        idx = ~ma.getmaskarray(depth) & (np.array(depth) >= 0) & np.isfinite(depth)
-        if not idx.any():
-            module_logger.error(
-                "Invalid depth(s) for CARS comparison: {}".format(depth)
-            )
-            raise IndexError
-        elif not idx.all():
-            valid_depth = depth[idx]
-    if mode == "track":
-        cars = db[vtype].track(var=cars_vars, doy=doy, depth=valid_depth, **kwargs)
-    else:
-        cars = db[vtype].extract(var=cars_vars, doy=doy, depth=valid_depth, **kwargs)
-
-    if not np.all(depth == valid_depth):
-        for v in cars.keys():
-            tmp = ma.masked_all(depth.shape, dtype=cars[v].dtype)
-            tmp[idx] = cars[v]
-            cars[v] = tmp
 
+def _cars_features(x, cars, use_standard_error=False):
+    """Comparison of the measurements x with the extracted CARS"""
     features = {
         "cars_mean": cars["mean"],
         "cars_std": cars["std_dev"],
         # "cars_nsamples": cars["number_of_observations"],
     }
 
-    features["cars_bias"] = data[varname] - features["cars_mean"]
+    features["cars_bias"] = x - features["cars_mean"]
 
+    # New arrays, so the climatology extracted by OceansDB is never modified
     for v in features:
-        idx = ma.getmaskarray(features[v])
-        if idx.any():
-            if v == "cars_nsamples":
-                missing_value = -1
-            else:
-                missing_value = np.nan
-            features[v][idx] = missing_value
-        features[v] = np.array(features[v])
+        missing_value = -1 if v == "cars_nsamples" else np.nan
+        features[v] = np.array(ma.filled(features[v], missing_value))
 
     # if use_standard_error = True, the comparison with the climatology
     #   considers the standard error, i.e. the bias will be only the
     #   ammount above the standard error range.
     if use_standard_error is True:
-        standard_error = features["cars_std"]
-        idx = features["cars_nsamples"] > 0
-        standard_error[~idx] = np.nan
-        standard_error[idx] /= features["cars_nsamples"][idx] ** 0.5
-
-        idx = np.absolute(features["cars_bias"]) <= standard_error
-        features["cars_bias"][idx] = 0
-        idx = np.absolute(features["cars_bias"]) > standard_error
-        features["cars_bias"][idx] -= (
-            np.sign(features["cars_bias"][idx]) * standard_error[idx]
+        features["cars_bias"] = _standard_error_bias(
+            features["cars_bias"], features["cars_std"], features["cars_nsamples"]
         )
 
     features["cars_normbias"] = features["cars_bias"] / features["cars_std"]
@@ -138,6 +61,54 @@ def cars_normbias(data, varname, attrs=None, use_standard_error=False):
     return features
 
 
+def cars_normbias(
+    data, varname, attrs=None, use_standard_error=False, backend="oceansdb"
+):
+    """
+
+    Notes
+    -----
+    - Include arguments to overwrite target variable (timename=None, latname=None, lonname=None)
+
+    """
+    request = _climatology_request(data, attrs, "CARS")
+    cars = _extract(_climatology("CARS", varname, backend), request, CARS_VARS)
+    return _cars_features(data[varname], cars, use_standard_error)
+
+
+def cars_normbias_many(
+    profiles, varname, attrs=None, use_standard_error=False, backend="oceansdb"
+):
+    """CARS comparison of many profiles at once
+
+    Equivalent to woa_normbias_many(), but since CARS is reconstructed for
+    each day of year, each block read covers a grid cell for all the days
+    of its profiles.
+
+    Returns
+    -------
+    list
+        The features, as given by cars_normbias(), of each profile. None if
+        the profile could not be compared.
+    """
+    profiles = list(profiles)
+    requests = _requests(profiles, attrs, "CARS")
+
+    db = _climatology("CARS", varname, backend)
+    if backend == "oceansdb":
+        with netcdf_lock:
+            db.crop.prefetch([r[1] for r in requests if _prefetchable(r)], CARS_VARS)
+
+    return [
+        None
+        if r is None
+        else _cars_features(
+            data[varname], _extract(db, r, CARS_VARS), use_standard_error
+        )
+        for data, r in zip(profiles, requests)
+    ]
+
+
 class CARS_NormBias(QCCheckVar):
     """Compares measuremnts with CARS climatology
 
@@ -150,11 +121,16 @@ class CARS_NormBias(QCCheckVar):
     """
 
     flag_bad = 3
+    cost = 100
+    optional = True
+    test_params = QCCheckVar.test_params + ("min_samples",)
     use_standard_error = False
     # 3 is the possible minimum to estimate the std, but I shold use higher.
     min_samples = 3
+    # Read the climatology with OceansDB, or from a tile store ("tiles")
+    backend = "oceansdb"
 
-    def __init__(self, data, varname, cfg=None, autoflag=True):
+    def __init__(self, data, varname, cfg=None, autoflag=True, store=None, **kwargs):
         try:
             self.use_standard_error = cfg["use_standard_error"]
         except (KeyError, TypeError):
@@ -163,12 +139,31 @@ class CARS_NormBias(QCCheckVar):
             self.min_samples = cfg["min_samples"]
         except (KeyError, TypeError):
             module_logger.debug("min_samples undefined. Using default value")
+        try:
+            self.backend = cfg["backend"]
+        except (KeyError, TypeError):
+            module_logger.debug("backend undefined. Using default value")
 
-        super().__init__(data, varname, cfg, autoflag)
+        super().__init__(data, varname, cfg, autoflag, store=store, **kwargs)
+
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("cars_mean", "cars_std", "cars_bias", "cars_normbias")
+
+    def _backend_params(self):
+        return backend_params(self.backend)
 
     def set_features(self):
         try:
-            self.features = cars_normbias(self.data, self.varname, self.attrs)
+            self.features = dict(
+                self._feature(
+                    "cars_normbias",
+                    lambda: cars_normbias(
+                        self.data, self.varname, self.attrs, backend=self.backend
+                    ),
+                    **self._backend_params()
+                )
+            )
         except LookupError:
             self.features = {}
 
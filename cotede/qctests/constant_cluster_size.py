@@ -1,47 +1,124 @@
 # -*- coding: utf-8 -*-
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 
+from bisect import bisect_left
+
 import numpy as np
 from numpy import ma
 
 from .qctests import QCCheckVar
 
 
-def constant_cluster_size(x, tol=0):
-    """Estimate the cluster size with (nearly) constant value
+def _extent(y, tol):
+    """Number of following values within tol of each value of y
 
-       Returns how many consecutive neighbor values are within a given
-         tolerance range. Note that invalid values, like NaN, are ignored.
+    For each y[i], how many of y[i+1], y[i+2], ... in sequence are within
+    tol from y[i], stopping at the first one that is not.
+
+    With tol=0 it is a single vectorized pass, O(n). With tol > 0 it is
+    O(n log n), a Python loop over the values with a binary search each,
+    which takes a few seconds per million values.
+    """
+    n = y.size
+    if tol == 0:
+        # Plain run-length: only identical values are in the same cluster
+        start = np.nonzero(np.concatenate([[True], y[1:] != y[:-1]]))[0]
+        stop = np.append(start[1:], n)
+        return np.repeat(stop, stop - start) - np.arange(n) - 1
+
+    # First following value beyond y[i] + tol (or below y[i] - tol) from the
+    # chain of prefix maxima (or minima) of y[i+1:], which is monotonic.
+    # O(n log n) from the binary search, instead of comparing all pairs.
+    # Plain Python floats are much faster than NumPy scalars in this loop.
+    first = [n] * n
+    for z in (y.tolist(), (-y).tolist()):
+        chain = []
+        values = []
+        for i in range(n - 1, -1, -1):
+            m = bisect_left(values, -(z[i] + tol))
+            if (m > 0) and (chain[m - 1] < first[i]):
+                first[i] = chain[m - 1]
+            while values and (-values[-1] <= z[i]):
+                chain.pop()
+                values.pop()
+            chain.append(i)
+            values.append(-z[i])
+    return np.array(first, dtype="i") - np.arange(n) - 1
+
+
+def constant_cluster(x, tol=0):
+    """Cluster of (nearly) constant values around each measurement
+
+    Parameters
+    ----------
+    x: array_like
+        A 1D sequence of measurements.
+    tol: float, optional
+        Tolerance to consider two values equivalent. Default is 0, i.e.
+        only identical values, which is O(n), while any tol > 0 is
+        O(n log n) and much slower on long records.
+
+    Returns
+    -------
+    cluster_size: np.ndarray
+        How many consecutive neighbor values are within tol, excluding the
+        value itself. Invalid values, like NaN, are ignored, thus a cluster
+        can be interrupted by invalid measurements.
+    start, end: np.ndarray
+        Index of the first and last value of each cluster, both inclusive,
+        or -1 for the invalid values.
     """
-    assert np.ndim(x) == 1, 'Not ready for more than 1 dimension'
+    assert np.ndim(x) == 1, "Not ready for more than 1 dimension"
 
     # Adding a tolerance to handle roundings due to different numeric types.
     tol = tol + 1e-5 * tol
 
-    ivalid = np.nonzero(~ma.getmaskarray(ma.fix_invalid(x)))[0]
-    dx = np.diff(np.atleast_1d(x)[ivalid])
+    x = ma.fix_invalid(np.atleast_1d(x))
+    ivalid = np.nonzero(~ma.getmaskarray(x))[0]
+    y = np.asarray(x.data[ivalid], dtype="f8")
 
-    cluster_size = np.zeros(np.shape(x), dtype='i')
-    for i, iv in enumerate(ivalid):
-        idx = np.absolute(dx[i:].cumsum()) > tol
-        if True in idx:
-            cluster_size[iv] += np.nonzero(idx)[0].min()
-        else:
-            cluster_size[iv] += idx.size
-        idx = np.absolute(dx[0:i][::-1].cumsum()) > tol
-        if True in idx:
-            cluster_size[iv] += np.nonzero(idx)[0].min()
-        else:
-            cluster_size[iv] += idx.size
-    return cluster_size
+    forward = _extent(y, tol)
+    backward = _extent(y[::-1], tol)[::-1]
+
+    cluster_size = np.zeros(x.shape, dtype="i")
+    cluster_size[ivalid] = forward + backward
+
+    start = np.full(x.shape, -1, dtype="i")
+    end = np.full(x.shape, -1, dtype="i")
+    position = np.arange(ivalid.size)
+    start[ivalid] = ivalid[position - backward]
+    end[ivalid] = ivalid[position + forward]
+
+    return cluster_size, start, end
+
+
+def constant_cluster_size(x, tol=0):
+    """Estimate the cluster size with (nearly) constant value
+
+       Returns how many consecutive neighbor values are within a given
+         tolerance range. Note that invalid values, like NaN, are ignored.
+
+       Check constant_cluster() to also obtain where each cluster starts
+         and ends.
+    """
+    return constant_cluster(x, tol=tol)[0]
 
 
 class ConstantClusterSize(QCCheckVar):
     """
        Need to implement a check on time. TSG specifies constant value during 6 hrs.
     """
+    cost = 5
+
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("constant_cluster_size", "constant_cluster_fraction")
+
     def set_features(self):
-        cluster_size = constant_cluster_size(self.data[self.varname])
+        cluster_size = self._feature(
+            "constant_cluster_size",
+            lambda: constant_cluster_size(self.data[self.varname]),
+        )
         N = ma.compressed(self.data[self.varname]).size
         cluster_fraction = cluster_size / N
 
@@ -5,6 +5,7 @@
 """
 
 import logging
+import threading
 
 import numpy as np
 from numpy import ma
@@ -12,14 +13,110 @@ from numpy import ma
 module_logger = logging.getLogger(__name__)
 
 
+def nan_filled(x):
+    """Values of x with NaN where masked, without modifying x
+
+    Instead of writing NaN into the caller's masked array, the masked
+    values are replaced on a new array, which is floating point even if x
+    is an integer array. Anything else than a masked array is returned as
+    it is, so a read-only input is never written.
+    """
+    if isinstance(x, ma.MaskedArray):
+        return np.where(ma.getmaskarray(x), np.nan, x.data)
+    return x
+
+
+class FeatureStore(object):
+    """Features of one dataset, each one computed only once
+
+    Several procedures share the same features. For instance, Spike and
+    SpikeDepthConditional both use spike(), while WOA_NormBias, FuzzyLogic
+    and Morello2014 all use the same climatology comparison. A FeatureStore
+    is shared by all the procedures applied on a dataset, so that each
+    feature is computed by the first procedure that requires it, and only
+    reused by the following ones.
+
+    A feature is identified by the variable it was estimated from, its name,
+    and the parameters used to compute it. It is safe to share a store among
+    threads, a feature requested by two threads is still computed only once.
+    """
+
+    def __init__(self):
+        self._features = {}
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def __getstate__(self):
+        return {"_features": self._features}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self._features.update(state["_features"])
+
+    def __contains__(self, key):
+        return key in self._features
+
+    def __len__(self):
+        return len(self._features)
+
+    @staticmethod
+    def key(name, varname=None, **params):
+        return (varname, name, tuple(sorted(params.items())))
+
+    def get(self, name, compute, varname=None, **params):
+        """Return a feature, computing it only if not available yet
+
+        Parameters
+        ----------
+        name: str
+            Name of the feature.
+        compute: callable
+            A function without arguments that returns the feature.
+        varname: str, optional
+            The variable used to estimate the feature. None for features
+            that are not specific to a variable.
+        **params:
+            Parameters used to compute the feature.
+        """
+        key = self.key(name, varname, **params)
+        try:
+            return self._features[key]
+        except KeyError:
+            pass
+
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._features:
+                module_logger.debug("Computing feature: {}".format(key))
+                self._features[key] = compute()
+        return self._features[key]
+
+
 class QCCheck(object):
     """Basic template for a QC check
     """
 
     flag_good = 1
     flag_bad = 4
-
-    def __init__(self, data, *, cfg=None, autoflag=True, attrs=None):
+    # Relative cost to apply this procedure, the cheapest ones go first
+    cost = 1
+    # Can be skipped if running out of time
+    optional = False
+    # Items of the cfg used only by test(), i.e. not by set_features()
+    test_params = ("procedure", "threshold", "flag_good", "flag_bad", "optional")
+
+    def __init__(
+        self,
+        data,
+        *,
+        cfg=None,
+        autoflag=True,
+        attrs=None,
+        store=None,
+        upstream=None,
+        features=None,
+    ):
         self.data = data
         if (cfg is not None):
             self.cfg = cfg
@@ -29,8 +126,18 @@ class QCCheck(object):
         if attrs is not None:
             self._attrs = attrs
 
+        if store is None:
+            store = FeatureStore()
+        self.store = store
+        # Features already estimated by the procedures that this one consumes
+        self.upstream = upstream if upstream is not None else {}
+
         self.set_flags()
-        self.set_features()
+        if features is None:
+            self.set_features()
+        else:
+            # Features from an earlier run, see cotede.reflag()
+            self.features = features
         if autoflag:
             self.test()
 
@@ -43,9 +150,47 @@ class QCCheck(object):
             return self._attrs
         return self.data.attrs
 
+    @classmethod
+    def inputs(cls, varname=None, cfg=None):
+        """Input variables that this procedure depends on
+
+        The coordinates and time, common to the whole dataset, are not
+        listed. Two applications with the same inputs and cfg give the same
+        result. None means that the dependencies are unknown, thus the
+        procedure is assumed to depend on everything.
+        """
+        return None
+
+    @classmethod
+    def feature_params(cls, cfg=None):
+        """Items of the cfg that affect the features
+
+        If only the other items of a cfg change, like the threshold, there
+        is no need to estimate the features again, only to run test().
+        """
+        if not isinstance(cfg, dict):
+            return {}
+        return {k: cfg[k] for k in cfg if k not in cls.test_params}
+
+    @classmethod
+    def consumes(cls, cfg=None):
+        """Features, produced by other procedures, used by this one"""
+        return ()
+
+    @classmethod
+    def produces(cls, cfg=None):
+        """Features estimated by this procedure"""
+        return ()
+
     def set_features(self):
         self.features = {}
 
+    def _feature(self, name, compute, **params):
+        """Feature from the shared store, only computed if not there yet"""
+        return self.store.get(
+            name, compute, varname=getattr(self, "varname", None), **params
+        )
+
     def set_flags(self):
         try:
             self.flag_good = self.cfg["flag_good"]
@@ -70,6 +215,21 @@ class QCCheckVar(QCCheck):
     """Template for a QC check of a specific variable
     """
 
-    def __init__(self, data, varname, cfg=None, autoflag=True, attrs=None):
+    def __init__(
+        self, data, varname, cfg=None, autoflag=True, attrs=None, store=None,
+        upstream=None, features=None,
+    ):
         self.varname = varname
-        super().__init__(data=data, cfg=cfg, autoflag=autoflag, attrs=attrs)
+        super().__init__(
+            data=data,
+            cfg=cfg,
+            autoflag=autoflag,
+            attrs=attrs,
+            store=store,
+            upstream=upstream,
+            features=features,
+        )
+
+    @classmethod
+    def inputs(cls, varname=None, cfg=None):
+        return (varname,)
@@ -27,33 +27,100 @@ import numpy as np
 from numpy import ma
 import logging
 
+from .core import nan_filled
 from .qctests import QCCheckVar
 
 module_logger = logging.getLogger(__name__)
 
-def cum_rate_of_change(x, memory):
+def _memory_recurrence(d, memory, initial=np.nan):
+    """Apply the memory of the cumulative rate of change
+
+    y[i] = (1 - memory) * d[i] + memory * y[i - 1] if d[i] < y[i - 1],
+    otherwise y[i] = d[i], with y[-1] = initial.
+
+    Iterating over Python floats instead of NumPy scalars is several
+    times faster, while keeping exactly the same arithmetic, thus the same
+    result if processed at once or in chunks.
+
+    Returns
+    -------
+    y: np.ndarray
+    final: float
+        Last value of y, the initial state for a following chunk.
+    """
+    y = d.tolist()
+    previous = float(initial)
+    k = 1 - memory
+    for i, value in enumerate(y):
+        if value < previous:
+            previous = k * value + memory * previous
+            y[i] = previous
+        else:
+            previous = value
+    return np.array(y, dtype="f8"), previous
+
+
+def cum_rate_of_change(x, memory, state=None, return_state=False):
     """Cummulative rate of change
+
+    Parameters
+    ----------
+    x: array_like
+        Measurements.
+    memory: float
+        Weight, between 0 and 1, of the previous cumulative rate of change.
+    state: tuple, optional
+        State at the end of the previous chunk of the same series, as
+        returned with return_state. Without it, x is the beginning of the
+        series and the first value is undefined.
+    return_state: bool, optional
+        Also return the state at the end of x.
+
+    Returns
+    -------
+    y: np.ndarray
+        The cumulative rate of change.
+    state: tuple
+        Only if return_state. The last measurement and the last y.
+
+    Examples
+    --------
+    A long record can be processed in chunks, with the same result of a
+    single pass:
+
+    >>> y1, state = cum_rate_of_change(x[:1000], 0.8, return_state=True)
+    >>> y2, state = cum_rate_of_change(x[1000:], 0.8, state, True)
     """
-    if isinstance(x, ma.MaskedArray):
-        x[x.mask] = np.nan
-        x = x.data
+    x = nan_filled(x)
+    x = np.atleast_1d(np.asarray(x, dtype="f8"))
 
-    y = np.nan * np.ones_like(x)
-    y[1:] = np.absolute(np.diff(x))
+    if state is None:
+        state = (np.nan, np.nan)
+    last_x, last_y = state
 
-    for i in range(2, y.size):
-        if y[i] < y[i - 1]:
-            y[i] = (1 - memory) * y[i] + memory * y[i - 1]
+    d = np.absolute(np.diff(x, prepend=last_x))
+    y, last_y = _memory_recurrence(d, memory, last_y)
 
+    if return_state:
+        if x.size > 0:
+            last_x = x[-1]
+        return y, (last_x, last_y)
     return y
 
 
 class CumRateOfChange(QCCheckVar):
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("cum_rate_of_change",)
+
     def set_features(self):
         module_logger.debug("Feature: cummulative rate of change")
+        memory = self.cfg["memory"]
         self.features = {
-            "cum_rate_of_change": cum_rate_of_change(
-                self.data[self.varname], self.cfg["memory"]
+            "cum_rate_of_change": self._feature(
+                "cum_rate_of_change",
+                lambda: cum_rate_of_change(self.data[self.varname], memory),
+                memory=memory,
             )
         }
 
@@ -26,6 +26,11 @@ class DeepestPressure(QCCheckVar):
     """
     flag_bad = 3
 
+    @classmethod
+    def inputs(cls, varname=None, cfg=None):
+        # varname defines which measurements are missing, i.e. flag 9
+        return ("PRES", varname)
+
     def test(self, tol_frac=0.1):
         """Apply test to define flags
 
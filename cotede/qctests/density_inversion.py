@@ -49,12 +49,24 @@ def densitystep(SA, t, p, auto_rotate=False):
 
 
 class DensityInversion(QCCheck):
-    def __init__(self, data, cfg, autoflag=True):
+    cost = 5
+
+    def __init__(self, data, cfg, autoflag=True, store=None, **kwargs):
         assert "TEMP" in data.keys(), "Missing TEMP"
         assert "PSAL" in data.keys(), "Missing PSAL"
         assert "PRES" in data.keys(), "Missing PRES"
 
-        super().__init__(data=data, cfg=cfg, autoflag=autoflag)
+        super().__init__(
+            data=data, cfg=cfg, autoflag=autoflag, store=store, **kwargs
+        )
+
+    @classmethod
+    def inputs(cls, varname=None, cfg=None):
+        return ("TEMP", "PSAL", "PRES")
+
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("densitystep",)
 
     def set_features(self):
         if not GSW_AVAILABLE:
@@ -63,8 +75,11 @@ class DensityInversion(QCCheck):
             return
 
         self.features = {
-            "densitystep": densitystep(
-                self.data["PSAL"], self.data["TEMP"], self.data["PRES"]
+            "densitystep": self._feature(
+                "densitystep",
+                lambda: densitystep(
+                    self.data["PSAL"], self.data["TEMP"], self.data["PRES"]
+                ),
             )
         }
 
@@ -20,8 +20,16 @@ module_logger = logging.getLogger(__name__)
 
 
 class DigitRollOver(QCCheckVar):
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("rate_of_change",)
+
     def set_features(self):
-        self.features = {"rate_of_change": rate_of_change(self.data[self.varname])}
+        self.features = {
+            "rate_of_change": self._feature(
+                "rate_of_change", lambda: rate_of_change(self.data[self.varname])
+            )
+        }
 
     def test(self):
         self.flags = {}
@@ -12,7 +12,7 @@ import numpy as np
 from .core import QCCheckVar
 from .gradient import gradient
 from .spike import spike
-from .woa_normbias import woa_normbias
+from .woa_normbias import backend_params, woa_normbias
 from cotede.fuzzy import fuzzy_uncertainty
 
 module_logger = logging.getLogger(__name__)
@@ -36,27 +36,50 @@ def fuzzylogic(features, cfg, require="all"):
         )
         raise KeyError
 
+    # With a tolerance, the defuzzification uses a precomputed table
     uncertainty = fuzzy_uncertainty(
-        data=features, features=cfg["features"], output=cfg["output"], require=require
+        data=features,
+        features=cfg["features"],
+        output=cfg["output"],
+        require=require,
+        tolerance=cfg.get("tolerance"),
+        resolution=cfg.get("resolution", 50),
     )
 
     return uncertainty
 
 
 class FuzzyLogic(QCCheckVar):
+    cost = 50
+    optional = True
+
+    @classmethod
+    def consumes(cls, cfg=None):
+        return tuple(cfg["features"])
+
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("fuzzylogic",)
+
     def set_features(self):
         self.features = {}
+        x = self.data[self.varname]
+        # Same climatology backend, and features, of WOA_NormBias
+        backend = self.cfg.get("backend", "oceansdb")
         for v in [f for f in self.cfg["features"] if f not in self.features]:
-            if v == "woa_bias":
-                woa_comparison = woa_normbias(self.data, self.varname, self.attrs)
-                self.features[v] = woa_comparison["woa_bias"]
-            elif v == "woa_normbias":
-                woa_comparison = woa_normbias(self.data, self.varname, self.attrs)
-                self.features[v] = woa_comparison["woa_normbias"]
+            if v in ("woa_bias", "woa_normbias"):
+                woa_comparison = self._feature(
+                    "woa_normbias",
+                    lambda: woa_normbias(
+                        self.data, self.varname, self.attrs, backend=backend
+                    ),
+                    **backend_params(backend)
+                )
+                self.features[v] = woa_comparison[v]
             elif v == "spike":
-                self.features[v] = spike(self.data[self.varname])
+                self.features[v] = self._feature("spike", lambda: spike(x))
             elif v == "gradient":
-                self.features[v] = gradient(self.data[self.varname])
+                self.features[v] = self._feature("gradient", lambda: gradient(x))
 
         self.features["fuzzylogic"] = fuzzylogic(self.features, self.cfg)
 
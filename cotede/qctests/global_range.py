@@ -15,6 +15,7 @@ import logging
 import numpy as np
 from numpy import ma
 
+from .core import nan_filled
 from .qctests import QCCheckVar
 
 
@@ -22,6 +23,8 @@ module_logger = logging.getLogger(__name__)
 
 
 class GlobalRange(QCCheckVar):
+    test_params = QCCheckVar.test_params + ("minval", "maxval")
+
     def test(self):
         self.flags = {}
         assert ("minval" in self.cfg) and (
@@ -37,10 +40,7 @@ class GlobalRange(QCCheckVar):
         minval = self.cfg["minval"]
         maxval = self.cfg["maxval"]
 
-        feature = np.atleast_1d(self.data[self.varname])
-        if isinstance(feature, ma.MaskedArray):
-            feature[feature.mask] = np.nan
-            feature = feature.data
+        feature = np.atleast_1d(nan_filled(self.data[self.varname]))
 
         flag = np.zeros(np.shape(feature), dtype="i1")
         flag[feature < minval] = self.flag_bad
@@ -12,6 +12,7 @@ import numpy as np
 from numpy import ma
 
 from cotede.qctests import QCCheckVar
+from .core import nan_filled
 
 try:
     import pandas as pd
@@ -37,9 +38,7 @@ def _curvature_pandas(x):
     ----
     - In the future this will be useful to handle specific window widths.
     """
-    if isinstance(x, ma.MaskedArray):
-        x[x.mask] = np.nan
-        x = x.data
+    x = nan_filled(x)
 
     if not PANDAS_AVAILABLE:
         return curvature(x)
@@ -68,9 +67,7 @@ def curvature(x):
     - Pandas.Series operates with indexes, so it should be done different. In
       that case, call for _curvature_pandas.
     """
-    if isinstance(x, ma.MaskedArray):
-        x[x.mask] = np.nan
-        x = x.data
+    x = nan_filled(x)
 
     if PANDAS_AVAILABLE and isinstance(x, pd.Series):
         return _curvature_pandas(x)
@@ -82,8 +79,16 @@ def curvature(x):
 
 
 class Gradient(QCCheckVar):
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("gradient",)
+
     def set_features(self):
-        self.features = {"gradient": curvature(self.data[self.varname])}
+        self.features = {
+            "gradient": self._feature(
+                "gradient", lambda: curvature(self.data[self.varname])
+            )
+        }
 
     def test(self):
         self.flags = {}
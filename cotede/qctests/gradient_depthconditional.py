@@ -18,8 +18,22 @@ module_logger = logging.getLogger(__name__)
 
 
 class GradientDepthConditional(QCCheckVar):
+    test_params = QCCheckVar.test_params + (
+        "pressure_threshold",
+        "shallow_max",
+        "deep_max",
+    )
+
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("gradient",)
+
     def set_features(self):
-        self.features = {"gradient": curvature(self.data[self.varname])}
+        self.features = {
+            "gradient": self._feature(
+                "gradient", lambda: curvature(self.data[self.varname])
+            )
+        }
 
     def test(self):
         self.flags = {}
@@ -13,7 +13,8 @@ import numpy as np
 from numpy import ma
 
 from .qctests import QCCheck
-from ..utils import extract_coordinates
+from ..utils import extract_coordinates, netcdf_lock
+from ..utils.climatology import get_db, track
 
 module_logger = logging.getLogger(__name__)
 
@@ -52,40 +53,32 @@ def location_at_sea(data, cfg=None):
 
     assert hasattr(data, "attrs"), "Missing attributes"
 
-    # Temporary solution while migrating to OceanSites variables syntax
+    # Temporary solution while migrating to OceanSites variables syntax.
+    # The attrs are only read, the caller's data is never modified.
+    lat = data.attrs.get("LATITUDE")
     if ("LATITUDE" not in data.attrs) and ("latitude" in data.attrs):
         module_logger.debug(
             "Deprecated. In the future it will not accept latitude anymore. It'll must be LATITUDE"
         )
-        data.attrs["LATITUDE"] = data.attrs["latitude"]
+        lat = data.attrs["latitude"]
+    lon = data.attrs.get("LONGITUDE")
     if ("LONGITUDE" not in data.attrs) and ("longitude" in data.attrs):
         module_logger.debug(
             "Deprecated. In the future it will not accept longitude anymore. It'll must be LONGITUDE"
         )
-        data.attrs["LONGITUDE"] = data.attrs["longitude"]
-
-    if (
-        ("LATITUDE" not in data.attrs)
-        or (data.attrs["LATITUDE"] == None)
-        or ("LONGITUDE" not in data.attrs)
-        or (data.attrs["LONGITUDE"] == None)
-    ):
+        lon = data.attrs["longitude"]
+
+    if (lat is None) or (lon is None):
         module_logger.debug("Missing geolocation (lat/lon)")
         return 0
 
-    if (
-        (data.attrs["LATITUDE"] > 90)
-        or (data.attrs["LATITUDE"] < -90)
-        or (data.attrs["LONGITUDE"] > 360)
-        or (data.attrs["LONGITUDE"] < -180)
-    ):
+    if (lat > 90) or (lat < -90) or (lon > 360) or (lon < -180):
         return flag_bad
 
     try:
-        ETOPO = oceansdb.ETOPO()
-        etopo = ETOPO["topography"].extract(
-            var="height", lat=data.attrs["LATITUDE"], lon=data.attrs["LONGITUDE"]
-        )
+        ETOPO = get_db("ETOPO")
+        with netcdf_lock:
+            etopo = ETOPO["topography"].extract(var="height", lat=lat, lon=lon)
         h = etopo["height"]
 
         flag = np.zeros(h.shape, dtype="i1")
@@ -101,13 +94,15 @@ def location_at_sea(data, cfg=None):
 def get_bathymetry(lat, lon, resolution="5min"):
     """Interpolate bathymetry from ETOPO
 
-       For a given (lat, lon), interpolates the bathymetry from ETOPO
+       For a given (lat, lon), interpolates the bathymetry from ETOPO. Along
+       a track, each grid cell of ETOPO is read only once.
     """
     assert np.shape(lat) == np.shape(lon), "Lat & Lon shape mismatch"
 
-    db = oceansdb.ETOPO(resolution=resolution)
+    db = get_db("ETOPO", resolution=resolution)
 
-    etopo = db["topography"].track(var="height", lat=lat, lon=lon)
+    with netcdf_lock:
+        etopo = track(db["topography"], "height", lat=lat, lon=lon)
     return {"bathymetry": -etopo["height"].astype("i")}
 
 
@@ -116,16 +111,21 @@ class LocationAtSea(QCCheck):
     resolution = "5min"
     threshold = 0
 
-    def __init__(self, data, cfg=None, attrs=None):
-        if cfg is None:
-            cfg = {}
+    def __init__(self, data, cfg=None, attrs=None, store=None):
+        # The cfg might be shared, like in a compiled plan
+        cfg = {} if cfg is None else dict(cfg)
 
         if "threshold" not in cfg:
             cfg["threshold"] = self.threshold
         if "resolution" not in cfg:
             cfg["resolution"] = self.resolution
 
-        super().__init__(data, cfg=cfg, attrs=attrs)
+        super().__init__(data, cfg=cfg, attrs=attrs, store=store)
+
+    @classmethod
+    def inputs(cls, varname=None, cfg=None):
+        # Only the coordinates
+        return ()
 
     def set_features(self):
         if not OCEANSDB_AVAILABLE:
@@ -140,7 +140,9 @@ class LocationAtSea(QCCheck):
             return
 
         try:
-            self.features = get_bathymetry(lat=lat, lon=lon)
+            self.features = dict(
+                self._feature("bathymetry", lambda: get_bathymetry(lat=lat, lon=lon))
+            )
             # idx = np.isfinite(lat) & np.isfinite(lon)
             # self.features = get_bathymetry(lat=lat[idx], lon=lon[idx])
         except:
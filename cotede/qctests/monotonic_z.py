@@ -33,39 +33,48 @@ class MonotonicZ(QCCheckVar):
     """
 
     coord = "depth"
+    test_params = QCCheckVar.test_params + ("coord", "tolerance", "flag_name")
+
+    @classmethod
+    def inputs(cls, varname=None, cfg=None):
+        try:
+            return (cfg["coord"],)
+        except (KeyError, TypeError):
+            return (cls.coord,)
 
     def test(self):
         """
 
            coord = depth
            tolerance = 0.0
+
+           A measurement is good only if deeper than all the previous ones,
+           or at most tolerance shallower than the deepest previous one.
+           Invalid measurements of z are ignored.
         """
         self.flags = {}
 
         if "coord" in self.cfg:
             self.coord = self.cfg["coord"]
+        tolerance = self.cfg.get("tolerance", 0.0)
+        assert tolerance >= 0, "tolerance can't be negative"
 
         z = self[self.coord]
         assert np.shape(self[self.varname]) == np.shape(z)
 
-        flag = np.zeros(self[self.varname].shape, dtype="i1")
+        flag = np.zeros(np.shape(z), dtype="i1")
 
-        dz = np.diff(z)
-        if np.all(dz > 0):
-            flag[:] = self.flag_good
-        else:
-            flag[0] = self.flag_good
-            zmax = z[0]
-            for i, zn in enumerate(z[1:], 1):
-                if zn > zmax:
-                    zmax = zn
-                    flag[i] = self.flag_good
-                else:
-                    flag[i] = self.flag_bad
+        zz = ma.filled(ma.fix_invalid(np.atleast_1d(z)).astype("f8"), -np.inf)
+        # Deepest valid measurement before each one
+        zmax = np.full(zz.shape, -np.inf)
+        zmax[1:] = np.maximum.accumulate(zz[:-1])
+        good = zz > zmax - tolerance
+        flag[good] = self.flag_good
+        flag[~good] = self.flag_bad
         flag[ma.getmaskarray(z)] = 9
 
         if "flag_name" in self.cfg:
             flag_name = self.cfg["flag_name"]
         else:
-            flag_name = "monotonic_{}".format(self.cfg["coord"].lower())
+            flag_name = "monotonic_{}".format(self.coord.lower())
         self.flags[flag_name] = flag
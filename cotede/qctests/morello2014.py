@@ -19,7 +19,7 @@ from ..fuzzy import fuzzyfy
 from .core import QCCheckVar
 from .gradient import gradient
 from .spike import spike
-from .woa_normbias import woa_normbias
+from .woa_normbias import backend_params, woa_normbias
 
 module_logger = logging.getLogger(__name__)
 
@@ -58,19 +58,36 @@ def morello2014(features, cfg=None):
 
 
 class Morello2014(QCCheckVar):
+    cost = 50
+    optional = True
+    # The fuzzy classification itself is done by test()
+    test_params = QCCheckVar.test_params + ("output", "features")
+
+    @classmethod
+    def consumes(cls, cfg=None):
+        if (cfg is None) or ("features" not in cfg):
+            return ("spike", "woa_normbias", "gradient")
+        return tuple(cfg["features"])
+
     def set_features(self):
         self.features = {}
+        x = self.data[self.varname]
+        # Same climatology backend, and features, of WOA_NormBias
+        backend = self.cfg.get("backend", "oceansdb")
         for v in [f for f in self.cfg["features"] if f not in self.features]:
-            if v == "woa_bias":
-                woa_comparison = woa_normbias(self.data, self.varname, self.attrs)
-                self.features[v] = woa_comparison["woa_bias"]
-            elif v == "woa_normbias":
-                woa_comparison = woa_normbias(self.data, self.varname, self.attrs)
-                self.features[v] = woa_comparison["woa_normbias"]
+            if v in ("woa_bias", "woa_normbias"):
+                woa_comparison = self._feature(
+                    "woa_normbias",
+                    lambda: woa_normbias(
+                        self.data, self.varname, self.attrs, backend=backend
+                    ),
+                    **backend_params(backend)
+                )
+                self.features[v] = woa_comparison[v]
             elif v == "spike":
-                self.features[v] = spike(self.data[self.varname])
+                self.features[v] = self._feature("spike", lambda: spike(x))
             elif v == "gradient":
-                self.features[v] = gradient(self.data[self.varname])
+                self.features[v] = self._feature("gradient", lambda: gradient(x))
 
 
     def test(self):
@@ -13,29 +13,20 @@ import logging
 import numpy as np
 from numpy import ma
 
+from .core import nan_filled
 from .qctests import QCCheckVar
 
 module_logger = logging.getLogger(__name__)
 
 
 class ProfileEnvelop(QCCheckVar):
+    test_params = QCCheckVar.test_params + ("layers",)
+
     def test(self):
         self.flags = {}
 
-        x = self.data[self.varname]
-        if isinstance(x, ma.MaskedArray):
-            x[x.mask] = np.nan
-            x = x.data
-        x = np.atleast_1d(x)
-
-        z = self.data["PRES"]
-        if isinstance(z, ma.MaskedArray):
-            if z.mask.any():
-                mask = np.ones_like(z, dtype="float32")
-                mask[z.mask] = np.nan
-                z = z * mask
-            z = z.data
-        z = np.atleast_1d(z)
+        x = np.atleast_1d(nan_filled(self.data[self.varname]))
+        z = np.atleast_1d(nan_filled(self.data["PRES"]))
 
         assert np.shape(z) == np.shape(x)
 
@@ -15,6 +15,7 @@ import logging
 import numpy as np
 from numpy import ma
 
+from .core import nan_filled
 from .qctests import QCCheckVar
 
 
@@ -22,9 +23,7 @@ module_logger = logging.getLogger(__name__)
 
 
 def rate_of_change(x):
-    if isinstance(x, ma.MaskedArray):
-        x[x.mask] = np.nan
-        x = x.data
+    x = nan_filled(x)
 
     y = np.nan * np.atleast_1d(x)
     y[1:] = np.diff(x)
@@ -33,8 +32,16 @@ def rate_of_change(x):
 
 
 class RateOfChange(QCCheckVar):
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("rate_of_change",)
+
     def set_features(self):
-        self.features = {"rate_of_change": rate_of_change(self.data[self.varname])}
+        self.features = {
+            "rate_of_change": self._feature(
+                "rate_of_change", lambda: rate_of_change(self.data[self.varname])
+            )
+        }
 
     def test(self):
         self.flags = {}
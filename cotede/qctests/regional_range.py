@@ -34,6 +34,9 @@ class RegionalRange(QCCheckVar):
 
     """
 
+    cost = 10
+    test_params = QCCheckVar.test_params + ("regions",)
+
     def test(self):
         self.flags = {}
 
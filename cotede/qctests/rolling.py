@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""Rolling window statistics shared by the QC procedures
+
+Several features are some statistic of a moving window, like the running
+medians of Tukey53H or the median and standard deviation of the bin of
+Bin_Spike. Rolling provides those statistics for windows defined by a number
+of samples or by a coordinate, like time or depth, always ignoring invalid
+values (masked or NaN) and never modifying the input.
+
+Example
+-------
+>>> r = Rolling(x, 5)
+>>> r.median() + r.std()
+
+>>> r = Rolling(temp, 10, t=depth, min_periods=3)
+>>> anomaly = (temp - r.median()) / r.mad()
+"""
+
+from bisect import bisect_left, insort
+import logging
+
+import numpy as np
+
+try:
+    import pandas as pd
+
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+from .core import nan_filled
+
+module_logger = logging.getLogger(__name__)
+
+# Fixed windows up to this size are sorted at once with NumPy
+MAX_VECTORIZED_WINDOW = 16
+
+
+def _median3(a, b, c):
+    """Element-wise median of three arrays"""
+    return np.maximum(np.minimum(a, b), np.minimum(np.maximum(a, b), c))
+
+
+def _median5(a, b, c, d, e):
+    """Element-wise median of five arrays with a median network
+
+    Sorting each pair (a, b) and (c, d), the larger of the two minima and
+    the smaller of the two maxima are the two central values among those
+    four. The median of the five is the median of e and those two.
+    """
+    return _median3(
+        e,
+        np.maximum(np.minimum(a, b), np.minimum(c, d)),
+        np.minimum(np.maximum(a, b), np.maximum(c, d)),
+    )
+
+
+def _sorted_median(s):
+    n = len(s)
+    k = n // 2
+    if n % 2 == 1:
+        return s[k]
+    return (s[k - 1] + s[k]) / 2.0
+
+
+def _sorted_quantile(s, q):
+    """Quantile of sorted values with linear interpolation, as np.quantile"""
+    position = q * (len(s) - 1)
+    k = int(position)
+    if k + 1 >= len(s):
+        return s[-1]
+    return s[k] + (s[k + 1] - s[k]) * (position - k)
+
+
+def _take_quantile(s, n, q):
+    """Quantile of each row of s, sorted with its n valid values first"""
+    position = q * (n - 1)
+    k = np.floor(position).astype("i")
+    lower = np.take_along_axis(s, k, axis=-1)
+    upper = np.take_along_axis(s, np.minimum(k + 1, n - 1), axis=-1)
+    if q == 0.5:
+        y = np.where(n % 2 == 1, lower, (lower + upper) / 2.0)
+    else:
+        y = lower + (upper - lower) * (position - k)
+    return y[:, 0]
+
+
+def _kth_deviation(s, m, p, k):
+    """k-th smallest |s - m|, for s sorted and s[:p] < m <= s[p:]
+
+    The deviations below m, read backwards from p, and the ones above m are
+    two sorted sequences, so the k-th smallest of both together is found by
+    bisection in O(log n) instead of sorting the deviations.
+    """
+    n_low, n_high = p, len(s) - p
+    # Number of elements taken from the low side
+    lo, hi = max(0, k + 1 - n_high), min(k + 1, n_low)
+    while lo < hi:
+        i = (lo + hi) // 2
+        j = k - i
+        # Is the (i+1)-th lower deviation smaller than the j-th upper?
+        if (j >= 0) and (j < n_high) and (m - s[p - 1 - i] < s[p + j] - m):
+            lo = i + 1
+        else:
+            hi = i
+    i, j = lo, k - lo
+    candidates = []
+    if i > 0:
+        candidates.append(m - s[p - i])
+    if j >= 0:
+        candidates.append(s[p + j] - m)
+    return max(candidates)
+
+
+def _sorted_mad(s):
+    m = _sorted_median(s)
+    p = bisect_left(s, m)
+    n = len(s)
+    if n % 2 == 1:
+        return _kth_deviation(s, m, p, n // 2)
+    return (
+        _kth_deviation(s, m, p, n // 2 - 1) + _kth_deviation(s, m, p, n // 2)
+    ) / 2.0
+
+
+class Rolling(object):
+    """Moving window over a 1-D sequence
+
+    Parameters
+    ----------
+    x : array_like
+        Sequence of measurements. Masked or NaN values are ignored.
+    window : int or float or timedelta
+        Without t, the number of samples in each window. With t, the width
+        of the window in the same units of t, like meters of depth or a
+        np.timedelta64 for time.
+    t : array_like, optional
+        Coordinate of each measurement, like time or depth. It must be
+        sorted in ascending order.
+    center : bool, optional
+        If True (default), each window is centered at its measurement. For
+        a window of samples, an even window of size l includes l/2 samples
+        before and l/2 - 1 after, like pandas. For a window in units of t,
+        it includes everything within window/2. If False, the window
+        trails, i.e. ends at the measurement, and is open on the left side.
+    min_periods : int, optional
+        Minimum number of valid values required in a window, otherwise the
+        statistic is NaN. By default the full window for windows of samples,
+        thus any invalid value results in NaN, and 1 for windows in units
+        of t.
+
+    Notes
+    -----
+    Sums, means and standard deviations use cumulative sums, thus are O(n)
+    regardless of the size of the window. Medians, quantiles and the MAD of
+    windows up to MAX_VECTORIZED_WINDOW samples are evaluated all at once
+    with NumPy. Longer windows are kept sorted as they move, i.e. O(log w)
+    to find the position of each new and old value, plus a memmove to
+    insert it, or with pandas when available for windows of samples.
+    """
+
+    def __init__(self, x, window, t=None, center=True, min_periods=None):
+        assert np.ndim(x) == 1, "Rolling is only available for 1-D sequences"
+
+        self.x = np.asarray(nan_filled(x), dtype="f8")
+        self.valid = np.isfinite(self.x)
+        self.window = window
+        self.center = center
+
+        N = len(self.x)
+        idx = np.arange(N)
+        if t is None:
+            assert window == int(window) and window >= 1, "Invalid window size"
+            self.window = window = int(window)
+            if min_periods is None:
+                min_periods = window
+            start = idx - window // 2 if center else idx - window + 1
+            self.start = np.clip(start, 0, N)
+            self.end = np.clip(start + window, 0, N)
+        else:
+            assert np.shape(t) == (N,), "t must have the same size of x"
+            t = np.asarray(t)
+            assert np.all(t[1:] >= t[:-1]), "t must be sorted in ascending order"
+            if min_periods is None:
+                min_periods = 1
+            if center:
+                self.start = np.searchsorted(t, t - window / 2, side="left")
+                self.end = np.searchsorted(t, t + window / 2, side="right")
+            else:
+                self.start = np.searchsorted(t, t - window, side="right")
+                self.end = np.searchsorted(t, t, side="right")
+        self.t = t
+        self.min_periods = min_periods
+        # Largest number of samples in a window
+        self.width = (self.end - self.start).max() if N > 0 else 0
+
+    def __repr__(self):
+        return "<Rolling window={}, center={}, min_periods={}>".format(
+            self.window, self.center, self.min_periods
+        )
+
+    @property
+    def _fixed(self):
+        """Window of samples that does not skip invalid values"""
+        return (self.t is None) and (self.min_periods >= self.window)
+
+    @property
+    def _short(self):
+        """Windows of few samples, evaluated all at once"""
+        return self.width <= MAX_VECTORIZED_WINDOW
+
+    def _windows(self, idx):
+        """Windows at positions idx as rows of self.width, padded with NaN"""
+        i = self.start[idx, None] + np.arange(self.width)
+        inside = i < self.end[idx, None]
+        return np.where(inside, self.x[np.minimum(i, len(self.x) - 1)], np.nan)
+
+    def _window_sum(self, z):
+        c = np.concatenate([[0], np.cumsum(z)])
+        return c[self.end] - c[self.start]
+
+    def _enough(self, n):
+        return (n >= self.min_periods) & (n > 0)
+
+    def count(self):
+        """Number of valid values in each window"""
+        return self._window_sum(self.valid.astype("f8"))
+
+    def sum(self):
+        n = self.count()
+        y = self._window_sum(np.where(self.valid, self.x, 0.0))
+        y[~self._enough(n)] = np.nan
+        return y
+
+    def _moments(self):
+        """Count, mean and sum of squared anomalies of each window"""
+        n = self.count()
+        enough = self._enough(n)
+        # Reduce round-off errors of the cumulative sums
+        offset = np.mean(self.x[self.valid]) if self.valid.any() else 0.0
+        y = np.where(self.valid, self.x - offset, 0.0)
+        c2 = np.concatenate([[0], np.cumsum(y ** 2)])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self._window_sum(y) / n
+            ss = np.maximum(c2[self.end] - c2[self.start] - n * mean ** 2, 0)
+        mean[~enough] = np.nan
+
+        # Nearly constant windows are lost in the round-off errors of the
+        # cumulative sums, so those are evaluated one by one.
+        idx = np.nonzero(enough & (ss <= 1e-10 * c2[self.end]))[0]
+        if idx.size > 0:
+            w = self._windows(idx) - offset
+            valid = np.isfinite(w)
+            mean[idx] = np.where(valid, w, 0).sum(axis=-1) / n[idx]
+            ss[idx] = (np.where(valid, w - mean[idx, None], 0) ** 2).sum(axis=-1)
+        return n, mean + offset, ss
+
+    def mean(self):
+        return self._moments()[1]
+
+    def std(self, ddof=1):
+        """Standard deviation of each window
+
+        Windows with no more than ddof valid values are NaN.
+        """
+        n, mean, ss = self._moments()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            y = np.sqrt(ss / (n - ddof))
+        y[np.isnan(mean) | (n <= ddof)] = np.nan
+        return y
+
+    def median(self):
+        if self._fixed and (self.window in (3, 5)):
+            N = len(self.x)
+            n = self.window
+            y = np.full(N, np.nan)
+            if N >= n:
+                network = _median5 if n == 5 else _median3
+                # min/max propagate NaN, as required by a fixed window
+                first = n // 2 if self.center else n - 1
+                y[first : first + N - n + 1] = network(
+                    *[self.x[i : N - n + 1 + i] for i in range(n)]
+                )
+            return y
+        return self.quantile(0.5)
+
+    def quantile(self, q):
+        """q-th quantile of each window, with linear interpolation
+
+        Parameters
+        ----------
+        q : float or sequence of floats
+            Quantile(s) between 0 and 1. For a sequence, the output has one
+            row per quantile.
+        """
+        qs = np.atleast_1d(q).astype("f8")
+        assert np.all((qs >= 0) & (qs <= 1)), "Quantiles must be in [0, 1]"
+
+        if not self._enough(self.count()).any():
+            y = np.full((len(qs), len(self.x)), np.nan)
+        elif self._short:
+            y = self._vectorized(
+                lambda s, n: np.array([_take_quantile(s, n, v) for v in qs]),
+                len(qs),
+            )
+        elif (self.t is None) and PANDAS_AVAILABLE:
+            rolling = pd.Series(self.x).rolling(
+                self.window, center=self.center, min_periods=max(1, self.min_periods)
+            )
+            y = np.array(
+                [
+                    rolling.median().to_numpy()
+                    if v == 0.5
+                    else rolling.quantile(v).to_numpy()
+                    for v in qs
+                ]
+            )
+        else:
+            y = self._by_sorting(
+                lambda s: [
+                    _sorted_median(s) if v == 0.5 else _sorted_quantile(s, v)
+                    for v in qs
+                ],
+                len(qs),
+            )
+
+        return y if np.ndim(q) > 0 else y[0]
+
+    def mad(self):
+        """Median absolute deviation from the median of each window
+
+        Not scaled, thus 1.4826 * mad() estimates the standard deviation of
+        normally distributed values.
+        """
+        if self._short:
+
+            def mad(s, n):
+                deviation = np.sort(np.abs(s - _take_quantile(s, n, 0.5)[:, None]))
+                return _take_quantile(deviation, n, 0.5)[None]
+
+            return self._vectorized(mad, 1)[0]
+        return self._by_sorting(lambda s: [_sorted_mad(s)], 1)[0]
+
+    def _vectorized(self, statistic, nout):
+        """Apply statistic on all windows at once
+
+        Each window is sorted, with invalid values at the end, so that
+        statistic(s, n) receives the sorted windows and their number of
+        valid values.
+        """
+        output = np.full((nout, len(self.x)), np.nan)
+        n = self.count()
+        idx = np.nonzero(self._enough(n))[0]
+        if idx.size > 0:
+            s = np.sort(self._windows(idx), axis=-1)
+            output[:, idx] = statistic(s, n[idx].astype("i")[:, None])
+        return output
+
+    def _by_sorting(self, statistic, nout):
+        """Apply statistic on each window kept sorted while moving"""
+        x = self.x.tolist()
+        valid = self.valid.tolist()
+        output = np.full((nout, len(x)), np.nan)
+        window = []
+        ini = fin = 0
+        for i, (start, end) in enumerate(zip(self.start.tolist(), self.end.tolist())):
+            while fin < end:
+                if valid[fin]:
+                    insort(window, x[fin])
+                fin += 1
+            while ini < start:
+                if valid[ini]:
+                    del window[bisect_left(window, x[ini])]
+                ini += 1
+            if (len(window) > 0) and (len(window) >= self.min_periods):
+                output[:, i] = statistic(window)
+        return output
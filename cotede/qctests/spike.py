@@ -16,6 +16,7 @@ import logging
 import numpy as np
 from numpy import ma
 
+from .core import nan_filled
 from .qctests import QCCheckVar
 
 
@@ -25,19 +26,21 @@ module_logger = logging.getLogger(__name__)
 def spike(x):
     """ Spike
     """
-    if isinstance(x, ma.MaskedArray):
-        x[x.mask] = np.nan
-        x = x.data
-
-    x = np.atleast_1d(x)
+    x = np.atleast_1d(nan_filled(x))
     y = np.nan * x
     y[1:-1] = np.abs(x[1:-1] - (x[:-2] + x[2:]) / 2.0) - np.abs((x[2:] - x[:-2]) / 2.0)
     return y
 
 
 class Spike(QCCheckVar):
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("spike",)
+
     def set_features(self):
-        self.features = {"spike": spike(self.data[self.varname])}
+        self.features = {
+            "spike": self._feature("spike", lambda: spike(self.data[self.varname]))
+        }
 
     def test(self):
         self.flags = {}
@@ -19,8 +19,20 @@ module_logger = logging.getLogger(__name__)
 
 
 class SpikeDepthConditional(QCCheckVar):
+    test_params = QCCheckVar.test_params + (
+        "pressure_threshold",
+        "shallow_max",
+        "deep_max",
+    )
+
+    @classmethod
+    def produces(cls, cfg=None):
+        return ("spike",)
+
     def set_features(self):
-        self.features = {"spike": spike(self.data[self.varname])}
+        self.features = {
+            "spike": self._feature("spike", lambda: spike(self.data[self.varname]))
+        }
 
     def test(self):
         self.flags = {}
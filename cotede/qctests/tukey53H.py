@@ -25,13 +25,8 @@ import numpy as np
 from numpy import ma
 
 from cotede.qctests import QCCheckVar
-
-try:
-    import pandas as pd
-
-    PANDAS_AVAILABLE = True
-except ImportError:
-    PANDAS_AVAILABLE = False
+from .core import nan_filled
+from .rolling import Rolling
 
 
 module_logger = logging.getLogger(__name__)
@@ -46,66 +41,34 @@ def tukey53H(x, normalize=False):
         An array with the same shape of input x of the difference between x
         and a smoothed x.
     """
-    if isinstance(x, ma.MaskedArray):
-        x[x.mask] = np.nan
-        x = x.data
-
-    if not PANDAS_AVAILABLE:
-        return _tukey53H_numpy(x, normalize=normalize)
-
-    if hasattr(x, "to_series"):
-        x = x.to_series()
-    elif not isinstance(x, pd.Series):
-        x = pd.Series(x)
-
-    u1 = x.reset_index(drop=True).rolling(5, center=True).median()
-    u2 = u1.rolling(3, center=True).median()
-    u3 = 0.25 * (u2.shift(-1) + 2 * u2 + u2.shift(1))
-
-    delta = x - u3
-
-    if not normalize:
-        return np.array(delta)
-
-    sigma = u1.dropna().std(ddof=1)
-    return np.array(delta / sigma)
+    return _tukey53H_numpy(x, normalize=normalize)
 
 
 def _tukey53H_numpy(x, normalize=False):
-    """Equivalent to tukey53H but without using pandas
+    """Vectorized Tukey 53H, without Python loops nor pandas
 
-    Note
-    ----
-    - For larger datasets (>1k) like timeseries the pandas alternative can be
-      significantly faster.
+    The running medians of 5 and 3 samples are complete windows, thus
+    estimated by Rolling with median networks, and any window with a NaN
+    results in NaN.
     """
-    if isinstance(x, ma.MaskedArray):
-        x[x.mask] = np.nan
-        x = x.data
+    x = nan_filled(x)
+    x = np.asarray(x, dtype="f8")
 
     N = len(x)
 
-    u1 = np.nan * np.ones(N)
-    for n in range(N - 4):
-        u1[n + 2] = np.median(x[n : n + 5])
-
-    u2 = np.nan * np.ones(N)
-    for n in range(N - 2):
-        u2[n + 1] = np.median(u1[n : n + 3])
+    u1 = Rolling(x, 5).median()
+    u2 = Rolling(u1, 3).median()
 
-    u3 = np.nan * np.ones(N)
-    u3[1:-1] = 0.25 * (u2[:-2] + 2 * u2[1:-1] + u2[2:])
-
-    delta = np.nan * np.ones(N)
-    delta[1:-1] = x[1:-1] - u3[1:-1]
+    delta = np.full(N, np.nan)
+    delta[1:-1] = x[1:-1] - 0.25 * (u2[:-2] + 2 * u2[1:-1] + u2[2:])
 
     if not normalize:
         return delta
 
-    idx = ~np.isnan(u1)
-    if idx.all():
+    u1 = u1[~np.isnan(u1)]
+    if u1.size < 2:
         return np.nan * delta
-    sigma = np.std(u1[idx], ddof=1)
+    sigma = np.std(u1, ddof=1)
     return delta / sigma
 
 
@@ -122,10 +85,28 @@ def tukey53H_norm(x, l=12):
 
 
 class Tukey53H(QCCheckVar):
+    cost = 10
+    optional = True
+
+    @classmethod
+    def produces(cls, cfg=None):
+        if (cfg is not None) and ("l" in cfg):
+            return ("tukey53H", "tukey53H_norm")
+        return ("tukey53H",)
+
     def set_features(self):
-        self.features = {"tukey53H": tukey53H(self.data[self.varname])}
+        self.features = {
+            "tukey53H": self._feature(
+                "tukey53H", lambda: tukey53H(self.data[self.varname])
+            )
+        }
         if "l" in self.cfg:
-            self.features["tukey53H_norm"] = tukey53H_norm(self.data[self.varname], l=self.cfg["l"])
+            l = self.cfg["l"]
+            self.features["tukey53H_norm"] = self._feature(
+                "tukey53H_norm",
+                lambda: tukey53H_norm(self.data[self.varname], l=l),
+                l=l,
+            )
 
 
     def test(self):
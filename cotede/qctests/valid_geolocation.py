@@ -31,6 +31,11 @@ def valid_geolocation(lat, lon):
 class ValidGeolocation(QCCheck):
     flag_bad = 3
 
+    @classmethod
+    def inputs(cls, varname=None, cfg=None):
+        # Only the coordinates
+        return ()
+
     def test(self):
         self.flags = {}
 
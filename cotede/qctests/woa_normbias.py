@@ -23,21 +23,76 @@ import logging
 
 import numpy as np
 from numpy import ma
-from oceansdb import WOA
 
 from .qctests import QCCheckVar
 from ..utils import extract_coordinates, extract_time, day_of_year, extract_depth
+from ..utils import netcdf_lock
+from ..utils.utils import LRUCache, array_digest
+from ..utils.climatology import get_db, track
+from ..utils.tilestore import TileStore, get_tilestore
 
 module_logger = logging.getLogger(__name__)
 
+WOA_VARS = [
+    "mean",
+    "standard_deviation",
+    "standard_error",
+    "number_of_observations",
+]
 
-def woa_normbias(data, varname, attrs=None, use_standard_error=False):
+
+def _standard_error_bias(bias, std, nsamples):
+    """Bias beyond the standard error of the climatology
+
+    Any bias within the standard error, std / sqrt(nsamples), is
+    considered null, otherwise it is reduced by the standard error. Where
+    the standard error is undefined, like without samples, the bias is kept.
     """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        standard_error = np.where(nsamples > 0, std / np.sqrt(nsamples), np.nan)
+        excess = np.absolute(bias) - standard_error
+        return np.where(
+            excess > 0, np.sign(bias) * excess, np.where(excess <= 0, 0, bias)
+        )
+
+
+# Longer level vectors, like a track, are validated without the cache
+MAX_CACHED_LEVELS = 2048
+_invalid_levels_cache = LRUCache(1024)
 
-    Notes
-    -----
-    - Include arguments to overwrite target variable (timename=None, latname=None, lonname=None)
 
+def _invalid_levels(depth):
+    """Positions of the invalid depth levels, negative, masked or NaN
+
+    Cached by a digest of the levels, since many profiles share the same
+    ones, holding only the positions of the invalid ones, usually none.
+    """
+    levels = ma.filled(ma.asanyarray(depth, dtype="f8"), np.nan).ravel()
+    if levels.size <= MAX_CACHED_LEVELS:
+        key = array_digest(levels)
+        invalid = _invalid_levels_cache.get(key)
+        if invalid is not None:
+            return invalid
+
+    with np.errstate(invalid="ignore"):
+        invalid = np.flatnonzero(~((levels >= 0) & np.isfinite(levels)))
+    invalid.flags.writeable = False
+    if levels.size <= MAX_CACHED_LEVELS:
+        invalid = _invalid_levels_cache.setdefault(key, invalid)
+    return invalid
+
+
+def _climatology_request(data, attrs=None, dbname="WOA"):
+    """Coordinates to extract the climatology for a dataset
+
+    Returns
+    -------
+    mode : str
+        Either 'profile', for a single position, or 'track'.
+    kwargs : dict
+        The doy, lat, lon, and the valid depths, as expected by OceansDB.
+    idx : array_like or None
+        The valid depths, if not all depths are valid.
     """
     try:
         doy = day_of_year(extract_time(data, attrs))
@@ -65,48 +120,114 @@ def woa_normbias(data, varname, attrs=None, use_standard_error=False):
                 "lat": np.mean(lat),
                 "lon": np.mean(lon),
             }
-            module_logger.warning("Multiple lat/lon positions but too close to each other so it will be considered a single position for the WOA comparison. lat: {}, lon: {}".format(kwargs["lat"], kwargs["lon"]))
+            module_logger.warning("Multiple lat/lon positions but too close to each other so it will be considered a single position for the {} comparison. lat: {}, lon: {}".format(dbname, kwargs["lat"], kwargs["lon"]))
     else:
         mode = "profile"
 
     depth = extract_depth(data)
 
-    db = WOA()
-    # This must go away. This was a trick to handle Seabird CTDs, but
-    # now that seabird is a different package it should be handled there.
-    if isinstance(varname, str) and (varname[-1] == "2"):
-        vtype = varname[:-1]
-    else:
-        vtype = varname
-
-    woa_vars = [
-        "mean",
-        "standard_deviation",
-        "standard_error",
-        "number_of_observations",
-    ]
-
     # Eventually the case of some invalid depth levels will be handled by
     # OceansDB and the following steps will be simplified.
     valid_depth = depth
+    idx = None
     if (np.size(depth) > 0):
-        idx = ~ma.getmaskarray(depth) & (np.array(depth) >= 0) & np.isfinite(depth)
-        if not idx.any():
-            module_logger.error("Invalid depth(s) for WOA comparison: {}".format(depth))
+        invalid = _invalid_levels(depth)
+        if invalid.size == np.size(depth):
+            module_logger.error("Invalid depth(s) for {} comparison: {}".format(dbname, depth))
             raise IndexError
-        elif not idx.all():
+        elif invalid.size > 0:
+            idx = np.ones(np.size(depth), dtype=bool)
+            idx[invalid] = False
+            idx = idx.reshape(np.shape(depth))
             valid_depth = depth[idx]
-    if mode == "track":
-        woa = db[vtype].track(var=woa_vars, doy=doy, depth=valid_depth, **kwargs)
+
+    kwargs["doy"] = doy
+    kwargs["depth"] = valid_depth
+    if (mode == "track") and (idx is not None):
+        # Along a track, the coordinates of the invalid depths are dropped too
+        for k in ("doy", "lat", "lon"):
+            if np.size(kwargs[k]) == idx.size:
+                kwargs[k] = np.asanyarray(kwargs[k])[idx]
+    return mode, kwargs, idx
+
+
+def _requests(profiles, attrs=None, dbname="WOA"):
+    """Climatology request of each profile, None if not possible"""
+    requests = []
+    for data in profiles:
+        try:
+            requests.append(_climatology_request(data, attrs, dbname))
+        except LookupError:
+            requests.append(None)
+    return requests
+
+
+def _prefetchable(request):
+    """A single position with depths, can be read in block"""
+    return (
+        (request is not None)
+        and (request[0] == "profile")
+        and (np.size(request[1]["depth"]) > 0)
+    )
+
+
+def _vtype(varname):
+    # This must go away. This was a trick to handle Seabird CTDs, but
+    # now that seabird is a different package it should be handled there.
+    if isinstance(varname, str) and (varname[-1] == "2"):
+        return varname[:-1]
+    return varname
+
+
+def backend_params(backend="oceansdb"):
+    """Feature parameters of a climatology backend
+
+    The default backend is left out, so that its features are shared by
+    every procedure, like WOA_NormBias and FuzzyLogic, reading from it.
+    """
+    if backend == "oceansdb":
+        return {}
+    return {"backend": backend}
+
+
+def _climatology(dbname, varname, backend="oceansdb"):
+    """The climatology of a variable from the chosen backend
+
+    Either 'oceansdb', reading the netCDF files through OceansDB, or
+    'tiles', a memory-mapped tile store built with build_tilestore().
+    """
+    if backend == "tiles":
+        return get_tilestore(dbname, _vtype(varname))
+    assert backend == "oceansdb", "Unknown climatology backend: {}".format(backend)
+    with netcdf_lock:
+        return get_db(dbname)[_vtype(varname)]
+
+
+def _extract(db, request, var):
+    """Extract the climatology of a request on its valid depths
+
+    Where the depth is invalid the values are masked.
+    """
+    mode, kwargs, idx = request
+    if isinstance(db, TileStore):
+        values = db.interpolate(var, **kwargs)
     else:
-        woa = db[vtype].extract(var=woa_vars, doy=doy, depth=valid_depth, **kwargs)
+        with netcdf_lock:
+            if mode == "track":
+                values = track(db, var, **kwargs)
+            else:
+                values = db.extract(var=var, **kwargs)
 
-    if not np.all(depth == valid_depth):
-        for v in woa.keys():
-            tmp = ma.masked_all(depth.shape, dtype=woa[v].dtype)
-            tmp[idx] = woa[v]
-            woa[v] = tmp
+    if idx is not None:
+        for v in values.keys():
+            tmp = ma.masked_all(idx.shape, dtype=values[v].dtype)
+            tmp[idx] = values[v]
+            values[v] = tmp
+    return values
 
+
+def _woa_features(x, woa, use_standard_error=False):
+    """Comparison of the measurements x with the extracted WOA"""
     features = {
         "woa_mean": woa["mean"],
         "woa_std": woa["standard_deviation"],
@@ -114,32 +235,19 @@ def woa_normbias(data, varname, attrs=None, use_standard_error=False):
         "woa_se": woa["standard_error"],
     }
 
-    features["woa_bias"] = data[varname] - features["woa_mean"]
+    features["woa_bias"] = x - features["woa_mean"]
 
+    # New arrays, so the climatology extracted by OceansDB is never modified
     for v in features:
-        idx = ma.getmaskarray(features[v])
-        if idx.any():
-            if v == "woa_nsamples":
-                missing_value = -1
-            else:
-                missing_value = np.nan
-            features[v][idx] = missing_value
-        features[v] = np.array(features[v])
+        missing_value = -1 if v == "woa_nsamples" else np.nan
+        features[v] = np.array(ma.filled(features[v], missing_value))
 
     # if use_standard_error = True, the comparison with the climatology
     #   considers the standard error, i.e. the bias will be only the
     #   ammount above the standard error range.
     if use_standard_error is True:
-        standard_error = features["woa_std"]
-        idx = features["woa_nsamples"] > 0
-        standard_error[~idx] = np.nan
-        standard_error[idx] /= features["woa_nsamples"][idx] ** 0.5
-
-        idx = np.absolute(features["woa_bias"]) <= standard_error
-        features["woa_bias"][idx] = 0
-        idx = np.absolute(features["woa_bias"]) > standard_error
-        features["woa_bias"][idx] -= (
-            np.sign(features["woa_bias"][idx]) * standard_error[idx]
+        features["woa_bias"] = _standard_error_bias(
+            features["woa_bias"], features["woa_std"], features["woa_nsamples"]
         )
 
     features["woa_normbias"] = features["woa_bias"] / features["woa_std"]
@@ -147,6 +255,71 @@ def woa_normbias(data, varname, attrs=None, use_standard_error=False):
     return features
 
 
+def woa_normbias(
+    data, varname, attrs=None, use_standard_error=False, backend="oceansdb"
+):
+    """
+
+    Notes
+    -----
+    - Include arguments to overwrite target variable (timename=None, latname=None, lonname=None)
+    - The climatology is read with OceansDB, or with backend='tiles' from
+      a memory-mapped copy, check build_tilestore().
+
+    """
+    request = _climatology_request(data, attrs, "WOA")
+    woa = _extract(_climatology("WOA", varname, backend), request, WOA_VARS)
+    return _woa_features(data[varname], woa, use_standard_error)
+
+
+def woa_normbias_many(
+    profiles, varname, attrs=None, use_standard_error=False, backend="oceansdb"
+):
+    """WOA comparison of many profiles at once
+
+    The profiles are grouped by the climatology grid cell and time bin, and
+    each group is read from WOA at once, covering all the depths of its
+    profiles. Each profile is then interpolated from that block, thus the
+    cost in reading WOA is proportional to the number of distinct cells
+    instead of the number of profiles. Tracks are extracted as usual.
+
+    Parameters
+    ----------
+    profiles : sequence
+        The datasets, each one as expected by woa_normbias().
+    varname : str
+        The variable to compare.
+    attrs : dict-like, optional
+        Used for all profiles, otherwise each profile uses its own attrs.
+    use_standard_error : bool, optional
+    backend : str, optional
+        Either 'oceansdb' or 'tiles'. A tile store is already
+        memory-mapped, thus there is nothing to group.
+
+    Returns
+    -------
+    list
+        The features, as given by woa_normbias(), of each profile. None if
+        the profile could not be compared, like missing time or position.
+    """
+    profiles = list(profiles)
+    requests = _requests(profiles, attrs, "WOA")
+
+    db = _climatology("WOA", varname, backend)
+    if backend == "oceansdb":
+        with netcdf_lock:
+            db.crop.prefetch([r[1] for r in requests if _prefetchable(r)], WOA_VARS)
+
+    return [
+        None
+        if r is None
+        else _woa_features(
+            data[varname], _extract(db, r, WOA_VARS), use_standard_error
+        )
+        for data, r in zip(profiles, requests)
+    ]
+
+
 class WOA_NormBias(QCCheckVar):
     """Compares measurements with WOA climatology
 
@@ -164,11 +337,16 @@ class WOA_NormBias(QCCheckVar):
     """
 
     flag_bad = 3
+    cost = 100
+    optional = True
+    test_params = QCCheckVar.test_params + ("min_samples",)
     use_standard_error = False
     # 3 is the possible minimum to estimate the std, but I shold use higher.
     min_samples = 3
+    # Read the climatology with OceansDB, or from a tile store ("tiles")
+    backend = "oceansdb"
 
-    def __init__(self, data, varname, cfg=None, autoflag=True):
+    def __init__(self, data, varname, cfg=None, autoflag=True, store=None, **kwargs):
         try:
             self.use_standard_error = cfg["use_standard_error"]
         except (KeyError, TypeError):
@@ -177,11 +355,37 @@ class WOA_NormBias(QCCheckVar):
             self.min_samples = cfg["min_samples"]
         except (KeyError, TypeError):
             module_logger.debug("min_samples undefined. Using default value")
-        super().__init__(data, varname, cfg, autoflag)
+        try:
+            self.backend = cfg["backend"]
+        except (KeyError, TypeError):
+            module_logger.debug("backend undefined. Using default value")
+        super().__init__(data, varname, cfg, autoflag, store=store, **kwargs)
+
+    @classmethod
+    def produces(cls, cfg=None):
+        return (
+            "woa_mean",
+            "woa_std",
+            "woa_nsamples",
+            "woa_se",
+            "woa_bias",
+            "woa_normbias",
+        )
+
+    def _backend_params(self):
+        return backend_params(self.backend)
 
     def set_features(self):
         try:
-            self.features = woa_normbias(self.data, self.varname, self.attrs)
+            self.features = dict(
+                self._feature(
+                    "woa_normbias",
+                    lambda: woa_normbias(
+                        self.data, self.varname, self.attrs, backend=self.backend
+                    ),
+                    **self._backend_params()
+                )
+            )
         except LookupError:
             self.features = {}
 
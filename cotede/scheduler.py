@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""Schedule the QC procedures of a dataset
+
+Each procedure declares the features that it produces, and the ones that it
+consumes from other procedures. From that, the QC of a dataset is organized
+as a graph (DAG) of nodes, where each node is one procedure applied with one
+cfg. A procedure that gives the same result for several variables, like a
+density inversion, is a single node. Nodes without pending dependencies are
+independent and can run in parallel threads, since most of the heavy work
+(NumPy, GSW) releases the GIL.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import threading
+import time
+
+module_logger = logging.getLogger(__name__)
+
+# Number of runs and mean time, in seconds, of each procedure in this process
+_TIMING = {}
+_timing_lock = threading.Lock()
+
+# Seconds for each unit of a procedure's cost, to guess how long it takes
+# before it has ever run in this process
+SECONDS_PER_COST = 1e-3
+
+
+class Node(object):
+    """One procedure, with one cfg, to be applied on a dataset
+
+    Attributes
+    ----------
+    key: tuple
+        Unique identification of this node in the graph.
+    Procedure: class
+        The QC procedure.
+    varname: str
+        The variable to evaluate. For a node shared by several variables,
+        the first one.
+    cfg: dict
+        The parameters for the procedure.
+    requires: set
+        Keys of the nodes that must run before this one.
+    """
+
+    __slots__ = ("key", "Procedure", "varname", "cfg", "requires")
+
+    def __init__(self, key, Procedure, varname, cfg):
+        self.key = key
+        self.Procedure = Procedure
+        self.varname = varname
+        self.cfg = cfg
+        self.requires = set()
+
+    def __repr__(self):
+        return "<Node {} on {}>".format(self.Procedure.__name__, self.varname)
+
+
+def _declared(Procedure, method, *args):
+    """Declaration from a procedure, None if it doesn't declare that
+
+    Legacy procedures, not derived from QCCheck, don't declare anything.
+    """
+    try:
+        return getattr(Procedure, method)(*args)
+    except AttributeError:
+        return None
+
+
+def is_optional(node):
+    """Can this node be skipped if running out of time?
+
+    Defined by the procedure, but the cfg of a test can overwrite it, like
+    {"woa_normbias": {"threshold": 10, "optional": false}}.
+    """
+    try:
+        return node.cfg["optional"]
+    except (KeyError, TypeError):
+        return getattr(node.Procedure, "optional", False)
+
+
+def expected_time(Procedure):
+    """Mean time, in seconds, to apply a procedure
+
+    Before it runs for the first time in this process, it is guessed from
+    the relative cost of the procedure, SECONDS_PER_COST for each unit, so
+    that the budget also holds for the first profile of a process.
+    """
+    try:
+        return _TIMING[Procedure][1]
+    except KeyError:
+        return getattr(Procedure, "cost", 1) * SECONDS_PER_COST
+
+
+def _record_timing(Procedure, seconds):
+    with _timing_lock:
+        n, mean = _TIMING.get(Procedure, (0, 0.0))
+        _TIMING[Procedure] = (n + 1, mean + (seconds - mean) / (n + 1))
+
+
+def timing_stats():
+    """Number of runs and mean time, in seconds, of each procedure
+
+    Returns
+    -------
+    dict
+        A pair (runs, mean time) for each procedure applied in this
+        process, which can be given to seed_timing() of another one.
+    """
+    with _timing_lock:
+        return dict(_TIMING)
+
+
+def seed_timing(stats):
+    """Start from timing known from earlier runs, like timing_stats()
+
+    The procedures already timed in this process keep their own.
+    """
+    with _timing_lock:
+        for Procedure, (n, mean) in stats.items():
+            _TIMING.setdefault(Procedure, (n, mean))
+
+
+def build_dag(bindings):
+    """Build the graph of procedures to apply on a dataset
+
+    Parameters
+    ----------
+    bindings: sequence
+        Pairs of (variable, steps), with the steps as given by
+        QCPlan.steps().
+
+    Returns
+    -------
+    nodes: OrderedDict
+        The nodes, by key, in the order of the given steps.
+    index: dict
+        The node key for each (variable, step name).
+    """
+    nodes = OrderedDict()
+    index = {}
+    for v, steps in bindings:
+        for step in steps:
+            inputs = _declared(step.Procedure, "inputs", v, step.cfg)
+            if inputs is None:
+                key = (v, step.name)
+            else:
+                # Same procedure, cfg and inputs is a duplicate node
+                key = (step.Procedure, step.key, inputs)
+            if key not in nodes:
+                nodes[key] = Node(key, step.Procedure, v, step.cfg)
+            index[(v, step.name)] = key
+
+    producers = {}
+    for (v, name), key in index.items():
+        for f in _declared(nodes[key].Procedure, "produces", nodes[key].cfg) or ():
+            producers.setdefault((v, f), []).append(key)
+
+    for (v, name), key in index.items():
+        for f in _declared(nodes[key].Procedure, "consumes", nodes[key].cfg) or ():
+            nodes[key].requires.update(
+                k for k in producers.get((v, f), []) if k != key
+            )
+
+    return nodes, index
+
+
+def run_dag(nodes, apply, threads=1, priority=None):
+    """Run all the nodes of a graph respecting their dependencies
+
+    Parameters
+    ----------
+    nodes: OrderedDict
+        The graph, as given by build_dag().
+    apply: callable
+        Function apply(node, upstream) to run a node, where upstream is the
+        list of results of the nodes required by that one.
+    threads: int, optional
+        Number of threads. With threads=1 (default) the nodes run one after
+        another in the current thread, in the order of the graph whenever
+        possible.
+    priority: callable, optional
+        Key function, priority(node), to sort the nodes ready to run. For
+        instance, to apply the cheapest procedures first.
+
+    Returns
+    -------
+    results: dict
+        The output of apply() for each node.
+    timing: dict
+        Time, in seconds, spent on each node.
+
+    Nodes where apply() returns None are considered skipped. The time of
+    the others is also kept by procedure, see expected_time().
+    """
+    assert threads >= 1, "threads must be a positive integer"
+
+    pending = OrderedDict((k, set(nodes[k].requires)) for k in nodes)
+    dependents = {k: [] for k in nodes}
+    for k in nodes:
+        for r in nodes[k].requires:
+            dependents[r].append(k)
+
+    results = {}
+    timing = {}
+
+    def execute(key):
+        upstream = [results[r] for r in nodes[key].requires]
+        start = time.perf_counter()
+        output = apply(nodes[key], upstream)
+        seconds = time.perf_counter() - start
+        if output is not None:
+            _record_timing(nodes[key].Procedure, seconds)
+        return output, seconds
+
+    def release():
+        """Remove from pending the nodes ready to run"""
+        ready = [k for k in pending if len(pending[k]) == 0]
+        if priority is not None:
+            ready.sort(key=lambda k: priority(nodes[k]))
+        for k in ready:
+            del pending[k]
+        return ready
+
+    circular = "Circular dependency among: {}"
+
+    if threads == 1:
+        while pending:
+            ready = release()
+            assert len(ready) > 0, circular.format(list(pending))
+            for key in ready:
+                results[key], timing[key] = execute(key)
+                for d in dependents[key]:
+                    pending[d].discard(key)
+        return results, timing
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        running = {}
+        while pending or running:
+            for key in release():
+                running[executor.submit(execute, key)] = key
+            assert len(running) > 0, circular.format(list(pending))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                results[key], timing[key] = future.result()
+                for d in dependents[key]:
+                    pending[d].discard(key)
+
+    return results, timing
@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+
+"""Shared access to the climatologies and bathymetry
+
+Opening a climatology with OceansDB is expensive, and the same few grid
+cells are read again and again while evaluating consecutive profiles from
+a float or stations from a cruise. Here each database is opened only once
+per process, and the crops read by OceansDB are kept in a
+least-recently-used cache, so that neighboring profiles re-use it.
+
+The cache holds up to COTEDE_CLIMATOLOGY_CACHE_MB megabytes, 256 by
+default, which can be changed at runtime with set_cache_limit().
+"""
+
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+import numpy as np
+from numpy import ma
+
+module_logger = logging.getLogger(__name__)
+
+
+class CropCache(object):
+    """Least-recently-used cache of climatology crops limited by size
+
+    Each entry is a pair (subset, dims) as returned by the crop() method of
+    the OceansDB variables, and its size is the memory used by the arrays.
+    A copy is returned on every hit, since OceansDB modifies in place the
+    subset while interpolating.
+
+    Parameters
+    ----------
+    maxbytes : int
+        Memory limit, in bytes, of the cached arrays. Zero disables it.
+    """
+
+    def __init__(self, maxbytes):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.maxbytes = int(maxbytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Copy of the cached entry, or None if not available"""
+        with self._lock:
+            try:
+                entry = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        subset, dims, _ = entry
+        return _copy(subset), dict(dims)
+
+    def put(self, key, subset, dims):
+        nbytes = _nbytes(subset) + _nbytes(dims)
+        if nbytes > self.maxbytes:
+            return
+        entry = (_copy(subset), dict(dims), nbytes)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[-1]
+            self._entries[key] = entry
+            self.nbytes += nbytes
+            self._shrink()
+
+    def _shrink(self):
+        while self.nbytes > self.maxbytes:
+            self.nbytes -= self._entries.popitem(last=False)[1][-1]
+            self.evictions += 1
+
+    def resize(self, maxbytes):
+        with self._lock:
+            self.maxbytes = int(maxbytes)
+            self._shrink()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "maxbytes": self.maxbytes,
+        }
+
+
+def _copy(subset):
+    return {v: subset[v].copy() for v in subset}
+
+
+def _nbytes(arrays):
+    nbytes = 0
+    for v in arrays.values():
+        nbytes += np.asanyarray(v).nbytes
+        if ma.isMaskedArray(v) and (v.mask is not ma.nomask):
+            nbytes += v.mask.nbytes
+    return nbytes
+
+
+_cache = CropCache(
+    float(os.getenv("COTEDE_CLIMATOLOGY_CACHE_MB", 256)) * 2 ** 20
+)
+_pool = {}
+_pool_lock = threading.Lock()
+_pool_pid = os.getpid()
+
+
+def cache_info():
+    """Counters and memory usage of the climatology cache
+
+    Returns
+    -------
+    dict
+        Number of hits, misses and evictions, with the number of entries
+        and bytes held, and the limit in bytes.
+    """
+    return _cache.info()
+
+
+def clear_cache():
+    """Drop all cached climatology and reset the counters"""
+    _cache.clear()
+
+
+def set_cache_limit(maxbytes):
+    """Memory limit, in bytes, of the climatology cache
+
+    Entries are evicted, least recently used first, to fit in the new
+    limit. A limit of zero disables the cache.
+    """
+    _cache.resize(maxbytes)
+
+
+def _check_pid():
+    """Reset the pool in a forked process
+
+    A netCDF handle inherited through fork() can't be safely shared, so a
+    child process opens its own.
+    """
+    global _pool_pid
+
+    if os.getpid() != _pool_pid:
+        with _pool_lock:
+            if os.getpid() != _pool_pid:
+                _pool.clear()
+                _cache.clear()
+                _pool_pid = os.getpid()
+
+
+def get_db(dbname, **kwargs):
+    """Process-wide instance of an OceansDB database
+
+    Parameters
+    ----------
+    dbname : str
+        One of 'WOA', 'CARS', or 'ETOPO'.
+    kwargs : optional
+        Passed to the database, like the resolution for ETOPO. Each
+        combination is a different instance.
+
+    Returns
+    -------
+    ClimatologyDB
+        Opened only once per process, with the crops of its variables
+        cached.
+
+    Examples
+    --------
+    >>> db = get_db('ETOPO', resolution='5min')
+    >>> get_db('ETOPO', resolution='5min') is db
+    True
+    """
+    _check_pid()
+    key = (dbname,) + tuple(sorted(kwargs.items()))
+    with _pool_lock:
+        if key not in _pool:
+            import oceansdb
+
+            module_logger.debug("Opening climatology {}".format(key))
+            _pool[key] = ClimatologyDB(key, getattr(oceansdb, dbname)(**kwargs))
+        return _pool[key]
+
+
+class ClimatologyDB(object):
+    """An OceansDB database with the crops of each variable cached
+
+    Behaves like the database itself, but the variables returned, like
+    db['sea_water_temperature'], have their crop() replaced by a cached
+    equivalent, so that extract() and track() read only the grid cells
+    not recently used.
+    """
+
+    def __init__(self, key, db):
+        self.key = key
+        self.db = db
+
+    def __getitem__(self, item):
+        var_nc = self.db[item]
+        if "crop" not in vars(var_nc):
+            var_nc.crop = _CachedCrop(self.key + (item,), var_nc)
+        return var_nc
+
+    def keys(self):
+        return self.db.keys()
+
+
+class _CachedCrop(object):
+    """Replaces the crop() of an OceansDB variable
+
+    The key of each crop is the dataset and variable, the grid cells
+    around the requested lat/lon/depth, and the time bins. The CARS
+    climatology is reconstructed for each day of year from its harmonics,
+    thus for it the time bin is the day of year itself.
+    """
+
+    def __init__(self, key, var_nc):
+        self.key = key
+        self.var_nc = var_nc
+        # Bound before replacing it at the instance
+        self.crop = var_nc.crop
+        self.time_binned = np.size(var_nc.dims.get("time", [])) > 0
+
+    def indices(self, lat, lon, depth=None, doy=None):
+        """Grid cells, time bins, and depth range of a crop
+
+        Returns
+        -------
+        group : tuple
+            The grid cells and time bins, but not the depth range.
+        zn : tuple
+            The range of depth levels, if depth is given.
+        dims : dict
+            The coordinates of the crop, as cropped by OceansDB.
+        """
+        from oceansdb.common import cropIndices
+
+        if self.time_binned:
+            dims, idx = cropIndices(self.var_nc.dims, lat, lon, depth, doy)
+            group = (tuple(idx["tn"]),)
+        else:
+            dims, idx = cropIndices(self.var_nc.dims, lat, lon, depth)
+            group = ()
+        group += (idx["yn"].start, idx["yn"].stop, tuple(idx["xn"]))
+        # Same cells on a different longitude or day of year reference
+        group += tuple(
+            np.asarray(dims[d]).tobytes() for d in ("lon", "time") if d in dims
+        )
+        zn = (idx["zn"].start, idx["zn"].stop) if "zn" in idx else ()
+        return group, zn, dims
+
+    def _key(self, var, group, zn=(), doy=None):
+        key = self.key + (tuple(var),) + group + zn
+        if (doy is not None) and not self.time_binned:
+            key += (tuple(np.atleast_1d(doy).tolist()),)
+        return key
+
+    def __call__(self, *args, **kwargs):
+        if len(args) + len(kwargs) == 3:
+            # ETOPO: crop(lat, lon, var)
+            names = ("lat", "lon", "var")
+        else:
+            names = ("doy", "depth", "lat", "lon", "var")
+        kwargs.update(zip(names, args))
+
+        var = kwargs.pop("var")
+        if _cache.maxbytes <= 0:
+            return self.crop(var=var, **kwargs)
+
+        group, zn, dims = self.indices(**kwargs)
+        key = self._key(var, group, zn, kwargs.get("doy"))
+        output = _cache.get(key)
+        if output is None:
+            output = self._from_block(var, group, dims, kwargs.get("doy"))
+            if output is None:
+                output = self.crop(var=var, **kwargs)
+            _cache.put(key, *output)
+        return output
+
+    def prefetch(self, requests, var):
+        """Read at once the crops of many requests
+
+        The requests are grouped by grid cells and time bins, and for each
+        group a single block, covering the depths of all its requests, is
+        read and cached. A following crop of any of those requests is
+        sliced from that block.
+
+        Parameters
+        ----------
+        requests : sequence
+            Each one a dict with doy, depth, lat and lon of a profile.
+        var : sequence
+            The variables to read.
+
+        Returns
+        -------
+        int
+            Number of blocks read.
+        """
+        if _cache.maxbytes <= 0:
+            return 0
+
+        groups = OrderedDict()
+        for r in requests:
+            r = {k: np.atleast_1d(r[k]) for k in ("doy", "depth", "lat", "lon")}
+            group = self.indices(r["lat"], r["lon"], r["depth"], r["doy"])[0]
+            groups.setdefault(group, []).append(r)
+
+        for group, members in groups.items():
+            block = {
+                k: np.unique(np.concatenate([r[k] for r in members]))
+                for k in ("doy", "depth", "lat", "lon")
+            }
+            subset, dims = self.crop(var=var, **block)
+            _cache.put(("block",) + self._key(var, group), subset, dims)
+        module_logger.debug(
+            "Read {} blocks for {} requests".format(len(groups), len(requests))
+        )
+        return len(groups)
+
+    def _from_block(self, var, group, dims, doy=None):
+        """Slice a crop from a block already read, if available"""
+        key = ("block",) + self._key(var, group)
+        if ("depth" not in dims) or (key not in _cache):
+            return None
+        output = _cache.get(key)
+        if output is None:
+            return None
+        subset, block = output
+
+        z0 = np.searchsorted(block["depth"], dims["depth"][0])
+        zn = slice(z0, z0 + dims["depth"].size)
+        if not np.array_equal(block["depth"][zn], dims["depth"]):
+            return None
+        if self.time_binned:
+            tn = slice(None)
+        else:
+            # CARS, the block is rebuilt for each day of year requested
+            doy = np.atleast_1d(doy)
+            tn = [np.nonzero(block["time"] == d)[0] for d in doy]
+            if not all(t.size > 0 for t in tn):
+                return None
+            tn = [t[0] for t in tn]
+            dims["time"] = doy
+        return {v: subset[v][tn][:, zn] for v in subset}, dims
+
+
+def track(var_nc, var, lat, lon, doy=None, depth=None):
+    """Extract a variable along a track, reading each grid cell only once
+
+    A thermosalinograph or a drifter can have thousands of consecutive
+    measurements inside the same grid cell of a climatology. Instead of
+    extracting one position at a time, the positions are snapped to the
+    grid cells, time bins, and depth levels, and for each distinct one the
+    crop is read only once, and interpolated at all of its positions at
+    once. Thus the cost scales with the distance covered instead of the
+    sampling rate.
+
+    Parameters
+    ----------
+    var_nc : object
+        A variable of an OceansDB database, like get_db('WOA')['TEMP'], or
+        get_db('ETOPO')['topography'], without doy and depth.
+    var : sequence
+        The items to extract, like ['mean', 'standard_deviation'].
+    lat, lon, doy, depth : array_like
+        Coordinates of each measurement, broadcasted against each other.
+        Either both doy and depth, or none of them like for ETOPO.
+
+    Returns
+    -------
+    dict
+        A masked array for each var, at least 1D. Linear interpolation on
+        time, depth, and bilinear on the valid grid points around each
+        position.
+    """
+    from .tilestore import _axis_weights, _interpolate, depth_weights
+
+    assert (doy is None) == (depth is None), "Requires both doy and depth"
+    var = [str(v) for v in np.atleast_1d(var)]
+    coords = {"lat": lat, "lon": lon}
+    if doy is not None:
+        coords["doy"] = doy
+    if depth is not None:
+        coords["depth"] = ma.filled(ma.asanyarray(depth, dtype="f8"), np.nan)
+    names = list(coords)
+    arrays = np.broadcast_arrays(*[np.asarray(coords[k], dtype="f8") for k in names])
+    shape = arrays[0].shape
+    coords = {k: a.ravel() for k, a in zip(names, arrays)}
+
+    dims = var_nc.dims
+    # A single longitude reference, so a cell is the same on any of them
+    lon0 = dims["lon"][0]
+    coords["lon"] = lon0 + np.mod(coords["lon"] - lon0, 360)
+
+    valid = np.all([np.isfinite(coords[k]) for k in coords], axis=0)
+    cell = [
+        np.searchsorted(dims["lat"], coords["lat"]),
+        np.searchsorted(dims["lon"], coords["lon"]),
+    ]
+    if "depth" in coords:
+        cell.append(np.searchsorted(dims["depth"], coords["depth"]))
+    if ("doy" in coords) and (np.size(dims.get("time", [])) > 0):
+        cell.append(np.searchsorted(dims["time"], coords["doy"]))
+    cell = np.stack(cell, axis=-1)[valid]
+    positions = np.nonzero(valid)[0]
+
+    N = valid.size
+    output = {v: np.full(N, np.nan) for v in var}
+    dtypes = {}
+    if positions.size > 0:
+        _, group = np.unique(cell, axis=0, return_inverse=True)
+        group = np.ravel(group)
+        order = np.argsort(group, kind="stable")
+        bounds = np.nonzero(np.diff(group[order]))[0] + 1
+        module_logger.debug(
+            "Track of {} positions on {} grid cells".format(N, bounds.size + 1)
+        )
+        for idx in np.split(positions[order], bounds):
+            c = {k: coords[k][idx] for k in coords}
+            if "doy" in c:
+                subset, cdims = var_nc.crop(
+                    np.unique(c["doy"]), np.unique(c["depth"]), c["lat"], c["lon"], var
+                )
+            else:
+                subset, cdims = var_nc.crop(c["lat"], c["lon"], var)
+
+            n = idx.size
+            constant = (np.zeros((n, 1), dtype="i"), np.ones((n, 1)))
+            weights = [
+                constant,
+                constant,
+                _axis_weights(cdims["lat"], c["lat"]),
+                _axis_weights(cdims["lon"], c["lon"]),
+            ]
+            if ("doy" in c) and (np.size(cdims["time"]) > 1):
+                weights[0] = _axis_weights(np.asarray(cdims["time"]), c["doy"])
+            if "depth" in c:
+                weights[1] = depth_weights(cdims["depth"], c["depth"])
+
+            for v in subset:
+                dtypes[v] = subset[v].dtype
+                field = ma.filled(ma.asanyarray(subset[v]).astype("f8"), np.nan)
+                field = field.reshape((1,) * (4 - field.ndim) + field.shape)
+                output[v][idx] = _interpolate(field, weights)
+
+    for v in output:
+        y = ma.masked_invalid(output[v])
+        if np.issubdtype(dtypes.get(v, "f8"), np.integer):
+            y = ma.masked_array(
+                np.round(ma.filled(y, 0)).astype(dtypes[v]), mask=ma.getmaskarray(y)
+            )
+        output[v] = np.atleast_1d(y.reshape(shape))
+    return output
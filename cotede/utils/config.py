@@ -141,7 +141,9 @@ def fix_config(cfg):
     """
     if "revision" not in cfg:
         cfg = convert_pre_to_021(cfg)
-    if cfg["revision"] < "0.22":
+    # convert_021_to_022() stores the revision as a float, so an already
+    # loaded cfg can be given back to load_cfg().
+    if float(cfg["revision"]) < 0.22:
         cfg = convert_021_to_022(cfg)
 
     return cfg
@@ -223,7 +225,7 @@ def convert_pre_to_021(cfg):
 
 def guess_procedure(name, cfg=None):
     catalog = {
-        "anomaly_detection": None,
+        "anomaly_detection": "AnomalyDetection",
         "bin_spike": "Bin_Spike",
         "cars_normbias": "CARS_NormBias",
         "constant_cluster_size": "ConstantClusterSize",
@@ -231,7 +233,7 @@ def guess_procedure(name, cfg=None):
         "deepest_pressure": "DeepestPressure",
         "density_inversion": "DensityInversion",
         "digit_roll_over": "DigitRollOver",
-        "fuzzylogic": None,
+        "fuzzylogic": "FuzzyLogic",
         "frozen_profile": None,
         "global_range": "GlobalRange",
         "gradient": "Gradient",
@@ -239,7 +241,7 @@ def guess_procedure(name, cfg=None):
         "grey_list": None,
         "gross_sensor_drift": None,
         "monotonic_z": "MonotonicZ",
-        "morello2014": None,
+        "morello2014": "Morello2014",
         "platform_identification": None,
         "pressure_increasing": None,
         "profile_envelop": "ProfileEnvelop",
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+"""Climatologies as memory-mapped arrays
+
+Reading the climatologies through netCDF means decoding, and copying to the
+heap of each process, the same few grid cells over and over. Instead, the
+fields used by the climatology comparisons can be converted only once into
+plain arrays, indexed by (time bin, depth level, lat, lon), and saved at
+cotederc('climatology'). Those are memory-mapped, so all the processes on a
+host share the same pages, and interpolated by direct indexing.
+
+The conversion requires OceansDB and its data, like::
+
+    >>> build_tilestore('WOA', 'TEMP')
+
+after which the comparisons can use it, as in
+woa_normbias(data, 'TEMP', backend='tiles').
+"""
+
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from numpy import ma
+
+from .utils import LRUCache, array_digest, cotederc, netcdf_lock
+
+module_logger = logging.getLogger(__name__)
+
+# Variables of each climatology used by the comparisons
+FIELDS = {
+    "WOA": (
+        "mean",
+        "standard_deviation",
+        "standard_error",
+        "number_of_observations",
+    ),
+    "CARS": ("mean", "std_dev"),
+}
+
+# OceanSITES vocabulary, as accepted by OceansDB
+_ALIASES = {
+    "TEMP": "sea_water_temperature",
+    "temperature": "sea_water_temperature",
+    "PSAL": "sea_water_salinity",
+    "salinity": "sea_water_salinity",
+    "DOXY": "dissolved_oxygen",
+}
+
+# Length, in days, of the climatological year, as used by OceansDB
+YEAR = 365.25
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def tilestore_path(dbname, vtype, path=None):
+    """Directory of a tile store
+
+    By default at cotederc('climatology'), like
+    ~/.config/cotederc/climatology/WOA/sea_water_temperature
+    """
+    if path is None:
+        path = cotederc("climatology")
+    return os.path.join(path, dbname, _ALIASES.get(vtype, vtype))
+
+
+def write_tilestore(path, dims, fields):
+    """Save a tile store
+
+    Parameters
+    ----------
+    path : str
+        Directory to save it, created if necessary.
+    dims : dict
+        Coordinates 'depth', 'lat' and 'lon', and optionally 'time', the
+        day of year of each time bin. Without time bins, the fields are
+        the same for the whole year.
+    fields : dict
+        For each variable, either an array (time, depth, lat, lon), or a
+        function f(tn, zn) that returns the (lat, lon) slice at time bin tn
+        and depth level zn. Missing values are NaN or masked.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    time = np.atleast_1d(dims.get("time", []))
+    shape = (
+        max(1, time.size),
+        np.size(dims["depth"]),
+        np.size(dims["lat"]),
+        np.size(dims["lon"]),
+    )
+    for v, field in fields.items():
+        # A .npy is aligned and can be memory-mapped with np.load()
+        output = np.lib.format.open_memmap(
+            os.path.join(path, "{}.npy".format(v)),
+            mode="w+",
+            dtype="f4",
+            shape=shape,
+        )
+        for tn in range(shape[0]):
+            for zn in range(shape[1]):
+                if callable(field):
+                    value = field(tn, zn)
+                else:
+                    value = field[tn, zn]
+                value = ma.masked_invalid(value).astype("f4")
+                output[tn, zn] = ma.filled(value, np.nan)
+        output.flush()
+        del output
+
+    metadata = {
+        "time": time.tolist(),
+        "depth": np.asarray(dims["depth"], dtype="f8").tolist(),
+        "lat": np.asarray(dims["lat"], dtype="f8").tolist(),
+        "lon": np.asarray(dims["lon"], dtype="f8").tolist(),
+        "fields": list(fields),
+    }
+    with open(os.path.join(path, "dims.json"), "w") as f:
+        json.dump(metadata, f)
+    return path
+
+
+def build_tilestore(dbname, vtype, path=None):
+    """Convert a climatology from OceansDB into a tile store
+
+    Parameters
+    ----------
+    dbname : str
+        Either 'WOA' or 'CARS'.
+    vtype : str
+        Variable, like 'TEMP' or 'sea_water_salinity'.
+    path : str, optional
+        Base directory, by default cotederc('climatology').
+
+    Returns
+    -------
+    str
+        The directory of the tile store.
+    """
+    import oceansdb
+
+    var_nc = getattr(oceansdb, dbname)()[vtype]
+    dims = {d: np.array(var_nc.dims[d]) for d in ("depth", "lat", "lon")}
+    if np.size(var_nc.dims.get("time", [])) > 0:
+        dims["time"] = np.array(var_nc.dims["time"])
+
+    def field(v):
+        def read(tn, zn):
+            with netcdf_lock:
+                if "time" in dims:
+                    return var_nc.ncs[tn][v][0, zn]
+                # CARS' fields used by cars_normbias are the same all year
+                return var_nc[v][zn]
+
+        return read
+
+    path = tilestore_path(dbname, vtype, path)
+    module_logger.info(
+        "Building tile store of {} {} at {}".format(dbname, vtype, path)
+    )
+    return write_tilestore(path, dims, {v: field(v) for v in FIELDS[dbname]})
+
+
+def _axis_weights(c, x):
+    """Linear interpolation on the axis c, NaN weights outside it
+
+    Returns
+    -------
+    idx, w : array_like
+        For each x, the indices of the two surrounding points of c, and
+        the respective weights.
+    """
+    x = np.asarray(x, dtype="f8")
+    if c.size == 1:
+        w = np.where(x == c[0], 1.0, np.nan)
+        return np.zeros(x.shape + (2,), dtype="i"), np.stack(
+            [w, np.zeros_like(w)], axis=-1
+        )
+    k = np.clip(np.searchsorted(c, x, side="right") - 1, 0, c.size - 2)
+    w = (x - c[k]) / (c[k + 1] - c[k])
+    w[(x < c[0]) | (x > c[-1]) | ~np.isfinite(x)] = np.nan
+    return np.stack([k, k + 1], axis=-1), np.stack([1 - w, w], axis=-1)
+
+
+# Longer level vectors, like a track, are interpolated without the cache
+MAX_CACHED_LEVELS = 2048
+_weights_cache = LRUCache(256)
+
+
+def depth_weights(grid, depth):
+    """Vertical interpolation weights from the grid levels to depth
+
+    XBT, bottles, or binned CTD profiles often share the same standard
+    levels, thus the weights of each set of levels are cached, keyed by a
+    digest of the grid and of the levels, holding the weights of the
+    unique levels only.
+
+    Returns
+    -------
+    idx, w : array_like
+        Same as _axis_weights().
+    """
+    grid = np.asarray(grid, dtype="f8")
+    depth = np.asarray(depth, dtype="f8")
+    if depth.size > MAX_CACHED_LEVELS:
+        return _axis_weights(grid, depth)
+
+    key = (array_digest(grid), array_digest(depth))
+    entry = _weights_cache.get(key)
+    if entry is None:
+        levels, inverse = np.unique(depth, return_inverse=True)
+        k, w = _axis_weights(grid, levels)
+        inverse = np.reshape(inverse, depth.shape).astype("i4")
+        for a in (k, w, inverse):
+            a.flags.writeable = False
+        entry = _weights_cache.setdefault(key, (k, w, inverse))
+    k, w, inverse = entry
+    return k[inverse], w[inverse]
+
+
+def _interpolate(field, weights):
+    """Interpolate a (time, depth, lat, lon) field on N positions
+
+    Parameters
+    ----------
+    field : array_like
+        A 4D array, where NaN is a missing value.
+    weights : sequence
+        For each of the 4 axes, a pair (idx, w), each with shape (N, k),
+        with the indices of the k grid points around each position and
+        their weights.
+
+    Linear on time and depth, where a grid point with null weight can't
+    invalidate the result, while on the horizontal plane only the valid
+    grid points are used.
+    """
+    (tn, wt), (zn, wz), (yn, wy), (xn, wx) = weights
+    # Indices for (point, time, depth, lat, lon)
+    values = field[
+        tn[:, :, None, None, None],
+        zn[:, None, :, None, None],
+        yn[:, None, None, :, None],
+        xn[:, None, None, None, :],
+    ]
+    wh = wy[:, None, None, :, None] * wx[:, None, None, None, :]
+    valid = np.isfinite(values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        h = np.where(valid, wh * values, 0).sum(axis=(3, 4))
+        h /= np.where(valid, wh, 0).sum(axis=(3, 4))
+        h = np.where(wz[:, None, :] == 0, 0, wz[:, None, :] * h).sum(axis=2)
+        return np.where(wt == 0, 0, wt * h).sum(axis=1)
+
+
+def get_tilestore(dbname, vtype, path=None):
+    """Process-wide instance of a TileStore"""
+    path = tilestore_path(dbname, vtype, path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = TileStore(path)
+        return _stores[path]
+
+
+class TileStore(object):
+    """A climatology saved by write_tilestore(), memory-mapped
+
+    Parameters
+    ----------
+    path : str
+        Directory of the tile store.
+    """
+
+    def __init__(self, path):
+        try:
+            with open(os.path.join(path, "dims.json")) as f:
+                metadata = json.load(f)
+        except IOError:
+            module_logger.error("Missing tile store at: {}".format(path))
+            raise
+
+        self.path = path
+        self.dims = {
+            d: np.array(metadata[d], dtype="f8")
+            for d in ("time", "depth", "lat", "lon")
+        }
+        self.data = {
+            v: np.load(os.path.join(path, "{}.npy".format(v)), mmap_mode="r")
+            for v in metadata["fields"]
+        }
+
+    def keys(self):
+        return self.data.keys()
+
+    def _time_weights(self, doy):
+        """Linear interpolation in time, cycling over the year"""
+        t = self.dims["time"]
+        doy = np.asarray(doy, dtype="f8")
+        if t.size <= 1:
+            return np.zeros(doy.shape + (1,), dtype="i"), np.ones(doy.shape + (1,))
+
+        t_ext = np.concatenate([[t[-1] - YEAR], t, [t[0] + YEAR]])
+        k = np.clip(np.searchsorted(t_ext, doy, side="right") - 1, 0, t.size)
+        w = (doy - t_ext[k]) / (t_ext[k + 1] - t_ext[k])
+        idx = np.stack([(k - 1) % t.size, k % t.size], axis=-1)
+        return idx, np.stack([1 - w, w], axis=-1)
+
+    def _lon_weights(self, lon):
+        """Linear interpolation on longitude, cycling around the globe"""
+        c = self.dims["lon"]
+        lon = c[0] + np.mod(np.asarray(lon, dtype="f8") - c[0], 360)
+        c_ext = np.append(c, c[0] + 360)
+        k = np.clip(np.searchsorted(c_ext, lon, side="right") - 1, 0, c.size - 1)
+        w = (lon - c_ext[k]) / (c_ext[k + 1] - c_ext[k])
+        return np.stack([k, (k + 1) % c.size], axis=-1), np.stack([1 - w, w], axis=-1)
+
+    def interpolate(self, var, doy, depth, lat, lon):
+        """Interpolate each var at the given positions
+
+        All coordinates are broadcasted against each other, so a profile
+        is given by a single doy, lat and lon with a sequence of depths,
+        while a track has one of each for every measurement.
+
+        Linear on time, depth, and on the horizontal plane, where only the
+        valid grid points around the position are used. Outside the depth
+        range of the climatology the result is masked.
+
+        Returns
+        -------
+        dict
+            A masked array for each var, with the shape of the broadcasted
+            coordinates.
+        """
+        doy, depth, lat, lon = np.broadcast_arrays(
+            np.asarray(doy, dtype="f8"),
+            np.asarray(ma.filled(ma.asanyarray(depth, dtype="f8"), np.nan)),
+            np.asarray(lat, dtype="f8"),
+            np.asarray(lon, dtype="f8"),
+        )
+        shape = doy.shape
+        weights = (
+            self._time_weights(doy.ravel()),
+            depth_weights(self.dims["depth"], depth.ravel()),
+            _axis_weights(self.dims["lat"], lat.ravel()),
+            self._lon_weights(lon.ravel()),
+        )
+
+        output = {}
+        for v in np.atleast_1d(var):
+            h = _interpolate(self.data[v], weights)
+            if v == "number_of_observations":
+                h = np.round(h)
+            output[v] = ma.masked_invalid(h.reshape(shape))
+        return output
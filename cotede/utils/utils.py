@@ -5,7 +5,9 @@
 Miscelaneous resources to support CoTeDe.
 """
 
+from collections import OrderedDict
 from datetime import date, datetime
+import hashlib
 import json
 import logging
 import numpy as np
@@ -13,9 +15,94 @@ import os
 from os.path import expanduser
 import re
 import pkg_resources
+import threading
 
 module_logger = logging.getLogger(__name__)
 
+# HDF5, behind netCDF4, is not thread safe, thus any access to the
+# climatologies or bathymetry from procedures running in parallel threads
+# must hold this lock.
+netcdf_lock = threading.Lock()
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """Thread-safe mapping of the maxsize most recently used items
+
+    For the caches kept for the life of a process, like the compiled QC
+    plans, so that many distinct keys can't grow it without bound.
+
+    Parameters
+    ----------
+    maxsize : int
+        Number of items held, the least recently used is dropped first.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._entries[key]
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def setdefault(self, key, value):
+        """Value at key, inserting the given one if not there yet"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def cache_info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+def array_digest(x):
+    """Fixed-size key of an array, by its dtype, shape and content"""
+    x = np.ascontiguousarray(x)
+    return (x.dtype.str, x.shape, hashlib.sha1(x).digest())
+
 
 def cotederc(subdir=None):
     """Directory with custom configuration for CoTeDe
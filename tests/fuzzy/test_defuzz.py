@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+"""
+
+import numpy as np
+from numpy.testing import assert_allclose
+import pytest
+
+from cotede.fuzzy.defuzz import centroid, defuzz, defuzz_along_axis
+
+
+def memberships(n=40, N=100):
+    np.random.seed(42)
+    mfx = np.random.rand(n, N) * (np.random.rand(n, N) < 0.5)
+    # Force some ties on the maximum
+    mfx[:, ::9] = np.round(mfx[:, ::9], 1)
+    return mfx
+
+
+@pytest.mark.parametrize("mode", ["bisector", "mom", "som", "lom"])
+def test_along_axis(mode):
+    x = np.linspace(0, 1, 100)
+    mfx = memberships()
+
+    u = defuzz_along_axis(x, mfx, mode)
+    assert u.shape == (mfx.shape[0],)
+    assert np.all(u == [defuzz(x, m, mode) for m in mfx])
+
+    u = defuzz_along_axis(x, mfx.T, mode, axis=0)
+    assert np.all(u == [defuzz(x, m, mode) for m in mfx])
+
+
+def test_centroid():
+    x = np.linspace(0, 1, 101)
+    # Symmetric triangle
+    mfx = np.clip(1 - np.abs(x - 0.3) / 0.2, 0, 1)
+    assert_allclose(centroid(x, mfx), 0.3)
+    assert_allclose(defuzz(x, mfx, "centroid"), 0.3)
+
+    mfx = memberships(N=101)
+    assert_allclose(
+        defuzz_along_axis(x, mfx, "centroid"),
+        [defuzz(x, m, "centroid") for m in mfx],
+    )
+
+
+def test_zero_area():
+    x = np.linspace(0, 1, 100)
+    mfx = np.zeros((2, 100))
+    mfx[1, 10] = 1
+    u = defuzz_along_axis(x, mfx, "bisector")
+    assert np.isnan(u[0])
+    assert u[1] == x[10]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+"""
+"""
+
+import pickle
+
+import numpy as np
+
+from cotede.fuzzy import defuzz_table, DefuzzTable, fuzzy_uncertainty
+from cotede.fuzzy import fuzzy_core
+from cotede.plan import compile_cfg
+from .test_fuzzy_uncertainty import CFG
+
+
+def exact(activation):
+    output_range, Q = fuzzy_core._output_memberships(CFG["output"])
+    return fuzzy_core._defuzz_rules(activation, output_range, Q)
+
+
+def test_error_bound():
+    """The difference from the exact uncertainty is within the error"""
+    table = defuzz_table(CFG["output"], resolution=20)
+    assert table.value.shape == (20, 20, 20)
+    assert table.error.shape == (20, 20, 20)
+
+    np.random.seed(42)
+    activation = np.random.rand(5000, 3)
+    activation[:100] *= 0.05
+    u, error = table.lookup(activation)
+    answer = exact(activation)
+    assert np.all(np.isnan(u) == np.isnan(answer))
+    idx = np.isfinite(answer)
+    assert np.all(np.abs(u[idx] - answer[idx]) <= error[idx])
+
+
+def test_out_of_table():
+    table = defuzz_table(CFG["output"], resolution=20)
+    u, error = table.lookup([[0, 0, 0], [1.2, 0, 0], [0.5, 0.5, 0.5]])
+    assert np.isnan(u[:2]).all()
+    assert np.isinf(error[1])
+    assert np.isfinite(u[2])
+
+
+def test_cached():
+    table = defuzz_table(CFG["output"], resolution=20)
+    assert defuzz_table(CFG["output"], resolution=20) is table
+    assert defuzz_table(CFG["output"], resolution=21) is not table
+
+
+def test_tolerance():
+    np.random.seed(42)
+    features = {
+        "f1": 8 * np.random.rand(1000),
+        "f2": 8 * np.random.rand(1000),
+        "f3": 5 * np.random.rand(1000),
+    }
+    features["f2"][::7] = np.nan
+
+    answer = fuzzy_uncertainty(features, **CFG)
+    for tolerance in (0, 0.03, 0.1):
+        uncertainty = fuzzy_uncertainty(
+            features, **CFG, tolerance=tolerance, resolution=20
+        )
+        assert np.all(np.isnan(uncertainty) == np.isnan(answer))
+        idx = np.isfinite(answer)
+        assert np.all(np.abs(uncertainty[idx] - answer[idx]) <= tolerance + 1e-12)
+
+
+def test_sent_with_plan():
+    """A plan carries its tables, reused once unpickled"""
+    cfg = {
+        "sea_water_temperature": {
+            "fuzzylogic": dict(
+                procedure="FuzzyLogic", tolerance=0.05, resolution=17, **CFG
+            )
+        }
+    }
+    plan = compile_cfg(cfg)
+    table = defuzz_table(CFG["output"], resolution=17)
+    assert table in plan._tables
+
+    del fuzzy_core._TABLES[table.key]
+    pickle.loads(pickle.dumps(plan))
+    assert isinstance(fuzzy_core._TABLES[table.key], DefuzzTable)
@@ -83,3 +83,20 @@ def test_fuzzy_uncertainty_with_nan():
 def test_feature_input_types(data):
     data = {"f1": data[:, 0], "f2": data[:, 1], "f3": data[:, 2]}
     compare_compound_feature_input_types(fuzzy_uncertainty, data=data, **CFG)
+
+
+def test_chunksize():
+    """The result doesn't depend on how many are aggregated at once"""
+    np.random.seed(42)
+    features = {
+        "f1": 8 * np.random.rand(50),
+        "f2": 8 * np.random.rand(50),
+        "f3": 5 * np.random.rand(50),
+    }
+    features["f2"][::7] = np.nan
+
+    uncertainty = fuzzy_uncertainty(features, **CFG)
+    for chunksize in (1, 3, 49):
+        assert_allclose(
+            fuzzy_uncertainty(features, **CFG, chunksize=chunksize), uncertainty
+        )
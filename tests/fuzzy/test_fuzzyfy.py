@@ -7,7 +7,11 @@
 import numpy as np
 from numpy.testing import assert_allclose
 
+from numpy import ma
+
 from cotede.fuzzy import fuzzyfy
+from cotede.fuzzy.fuzzy_core import compile_rules
+from cotede.fuzzy.membership_functions import smf, trimf, trapmf, zmf
 
 
 CFG = {
@@ -79,6 +83,53 @@ def test_fuzzyfy_all_nan():
     assert_allclose(rules["high"], [np.nan])
 
 
+
+def test_compiled_rules():
+    """Compiled memberships are the same of each membership function"""
+    mfuncs = {"smf": smf, "trimf": trimf, "trapmf": trapmf, "zmf": zmf}
+    features = {k: CFG["features"][k] for k in CFG["features"]}
+    # A degenerated membership, a step, and a triangle equivalent to trapmf
+    features["f1"] = dict(features["f1"], high={"type": "smf", "params": [2, 2]})
+    features["f2"] = dict(features["f2"], low={"type": "trimf", "params": [3, 3, 4]})
+
+    np.random.seed(42)
+    data = {k: np.random.uniform(-1, 8, 500) for k in features}
+    data["f1"][::7] = np.nan
+    data["f2"][::11] = 3
+
+    rules = compile_rules(features, CFG["output"])
+    membership = rules.memberships(data)
+    for i, m in enumerate(rules.levels):
+        for j, t in enumerate(rules.features):
+            f = mfuncs[features[t][m]["type"]]
+            expected = f(data[t], features[t][m]["params"])
+            assert_allclose(membership[i, j], expected, rtol=0, atol=1e-15)
+
+
+def test_compile_rules_cache():
+    assert compile_rules(CFG["features"], CFG["output"]) is compile_rules(
+        CFG["features"], CFG["output"]
+    )
+
+
+def test_fuzzyfy_masked():
+    """Masked features are equivalent to NaN"""
+    features = {
+        "f1": ma.masked_array([1.0, 1.0], mask=[False, True]),
+        "f2": np.array([5.2, 5.2]),
+        "f3": np.array([0.9, 0.9]),
+    }
+    expected = fuzzyfy(
+        {"f1": np.array([1.0, np.nan]), "f2": features["f2"], "f3": features["f3"]},
+        **CFG,
+        require="any"
+    )
+
+    rules = fuzzyfy(features, **CFG, require="any")
+    for k in expected:
+        assert_allclose(rules[k], expected[k])
+
+
 """
 
     # FIXME: If there is only one feature, it will return 1 value
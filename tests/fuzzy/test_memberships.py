@@ -48,6 +48,13 @@ def test_trapmf():
     assert_allclose(test, expected)
 
 
+def test_peak():
+    """The plateau is 1, including when a side is vertical"""
+    assert_allclose(trimf([0, 1, 2], [0, 0, 2]), [1, 0.5, 0])
+    assert_allclose(trimf([0, 1, 2], [0, 2, 2]), [0, 0.5, 1])
+    assert_allclose(trapmf([-1, 0, 1, 2], [-1, 0, 1, 2]), [0, 1, 1, 0])
+
+
 @given(
     x=arrays(
         dtype=float,
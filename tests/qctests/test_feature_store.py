@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Check the features shared among procedures
+"""
+
+import sys
+
+import numpy as np
+
+from cotede.qc import ProfileQC
+from cotede.qctests import FeatureStore, Spike, SpikeDepthConditional, Tukey53H
+from ..data import DummyData
+
+
+def test_compute_once():
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.arange(3)
+
+    store = FeatureStore()
+    y = store.get("f", compute, varname="TEMP", a=1)
+    y2 = store.get("f", compute, varname="TEMP", a=1)
+    assert y is y2
+    assert len(calls) == 1
+
+    # Different parameters or variable are different features
+    store.get("f", compute, varname="TEMP", a=2)
+    store.get("f", compute, varname="PSAL", a=1)
+    assert len(calls) == 3
+    assert len(store) == 3
+    assert FeatureStore.key("f", "TEMP", a=1) in store
+
+
+def test_shared_store():
+    profile = DummyData()
+    store = FeatureStore()
+
+    y = Spike(profile, "TEMP", {"threshold": 2}, store=store)
+    y2 = SpikeDepthConditional(
+        profile,
+        "TEMP",
+        {"pressure_threshold": 500, "shallow_max": 6.0, "deep_max": 2.0},
+        store=store,
+    )
+    assert y.features["spike"] is y2.features["spike"]
+
+    # Feature parameters are part of the identity
+    Tukey53H(profile, "TEMP", {"threshold": 2, "l": 5}, store=store)
+    assert FeatureStore.key("tukey53H_norm", "TEMP", l=5) in store
+    assert FeatureStore.key("tukey53H_norm", "TEMP", l=7) not in store
+
+
+def test_profileqc_compute_once(monkeypatch):
+    """Spike and SpikeDepthConditional should share the same feature"""
+    calls = []
+    spike = sys.modules["cotede.qctests.spike"].spike
+
+    def counting_spike(x):
+        calls.append(1)
+        return spike(x)
+
+    for m in ("cotede.qctests.spike", "cotede.qctests.spike_depthconditional"):
+        monkeypatch.setattr(sys.modules[m], "spike", counting_spike)
+
+    cfg = {
+        "sea_water_temperature": {
+            "spike": {"threshold": 6.0},
+            "spike_depthconditional": {
+                "pressure_threshold": 500,
+                "shallow_max": 6.0,
+                "deep_max": 2.0,
+            },
+        }
+    }
+    pqc = ProfileQC(DummyData(), cfg=cfg)
+    assert len(calls) == 1
+    assert "spike" in pqc.flags["TEMP"]
+    assert "spike_depthconditional" in pqc.flags["TEMP"]
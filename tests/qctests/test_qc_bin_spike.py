@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Verify the Bin Spike QC test
+"""
+
+import numpy as np
+from numpy import ma
+
+from cotede.qctests import Bin_Spike, bin_spike
+from ..data import DummyData
+
+from .compare import compare_input_types
+
+
+def _reference(x, l):
+    """Bin spike evaluated window by window"""
+    x = np.asarray(x, dtype="f8")
+    N = len(x)
+    half_window = l // 2
+    output = np.nan * np.ones(N)
+    for i in range(half_window, N - half_window):
+        median_window = x[i - half_window : i + half_window]
+        neighbors = np.append(x[i - half_window : i], x[i + 1 : i + half_window + 1])
+        if np.isfinite(median_window).sum() >= 3:
+            output[i] = (x[i] - np.nanmedian(median_window)) / np.nanstd(neighbors)
+    return output
+
+
+def test_bin_spike():
+    np.random.seed(42)
+    x = np.random.randn(200).cumsum()
+    for l in (4, 6, 10):
+        y = bin_spike(x, l)
+        assert isinstance(y, ma.MaskedArray)
+        assert y.mask[: l // 2].all()
+        assert y.mask[-l // 2 :].all()
+        assert np.allclose(ma.filled(y, np.nan), _reference(x, l), equal_nan=True)
+
+
+def test_invalid_values_are_ignored():
+    """Masked and NaN are both ignored, and the input is not modified"""
+    np.random.seed(42)
+    x = np.random.randn(100).cumsum()
+    x[[10, 11, 50]] = np.nan
+    mx = ma.masked_invalid(x)
+    mx.mask[30] = True
+    expected = x.copy()
+    expected[30] = np.nan
+
+    y = bin_spike(mx, 6)
+    assert mx.mask[30] and np.isfinite(mx.data[30])
+    assert y.mask[[10, 11, 30, 50]].all()
+    assert np.allclose(ma.filled(y, np.nan), _reference(expected, 6), equal_nan=True)
+
+
+def test_short_window():
+    """l=2 is never enough to evaluate"""
+    y = bin_spike(np.arange(10.0), 2)
+    assert y.mask.all()
+
+
+def test_short_profile():
+    """A profile shorter than the window is not evaluated"""
+    for n in (2, 3, 4):
+        y = bin_spike(np.arange(1.0, n + 1), 10)
+        assert y.shape == (n,)
+        assert y.mask.all()
+
+    flag = Bin_Spike(
+        {"TEMP": np.array([1.0, 2, 3, 4])}, "TEMP", cfg={"l": 10, "threshold": 2}
+    ).flags
+    assert np.all(flag["bin_spike"] == 0)
+
+
+def test_constant_bin():
+    """A constant bin is not a spike, but a value away from it is"""
+    x = np.ones(21)
+    x[10] = 5
+    y = bin_spike(x, 4)
+    assert np.all(y[2:8] == 0)
+    assert y[10] == np.inf
+
+    flag = Bin_Spike({"TEMP": x}, "TEMP", cfg={"l": 4, "threshold": 2}).flags
+    assert flag["bin_spike"][10] == 3
+    assert np.all(flag["bin_spike"][2:8] == 1)
+
+
+def test_standard_dataset():
+    profile = DummyData()
+    y = Bin_Spike(profile, "TEMP", cfg={"l": 4, "threshold": 0.8})
+
+    assert "bin_spike" in y.features
+    flag = y.flags["bin_spike"]
+    feature = ma.filled(y.features["bin_spike"], np.nan)
+    assert np.all(flag[feature > 0.8] == 3)
+    assert np.all(flag[feature <= 0.8] == 1)
+    assert np.all(flag[~np.isfinite(feature)] != 1)
+
+
+def test_input_types():
+    cfg = {"l": 4, "threshold": 1}
+    compare_input_types(Bin_Spike, cfg)
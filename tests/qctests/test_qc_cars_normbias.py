@@ -7,7 +7,7 @@
 from datetime import datetime
 import numpy as np
 
-from cotede.qctests import CARS_NormBias, cars_normbias
+from cotede.qctests import CARS_NormBias, cars_normbias, cars_normbias_many
 from cotede.qc import ProfileQC
 from ..data import DummyData
 
@@ -119,3 +119,17 @@ def test_standard_error():
     # assert 'cars_normbias' in pqc.flags['TEMP']
     # assert pqc.flags['TEMP']['cars_normbias'].shape == profile.data['TEMP'].shape
     # assert (pqc.flags['TEMP']['cars_normbias'] == [1, 1, 1, 1, 1, 1, 3, 0]).all()
+
+
+def test_cars_normbias_many():
+    """Same as one profile at a time, including on different days"""
+    profiles = [DummyData() for i in range(3)]
+    profiles[1].attrs["datetime"] = datetime(2016, 6, 20)
+    profiles[2].attrs["LATITUDE"] += 0.1
+
+    output = cars_normbias_many(profiles, "TEMP")
+    assert len(output) == len(profiles)
+    for p, features in zip(profiles, output):
+        expected = cars_normbias(p, "TEMP")
+        for v in expected:
+            assert np.allclose(features[v], expected[v], equal_nan=True)
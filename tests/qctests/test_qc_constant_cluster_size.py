@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Verify the Constant Cluster Size QC test
+"""
+
+import numpy as np
+from numpy import ma
+
+from cotede.qctests import constant_cluster_size
+from cotede.qctests.constant_cluster_size import constant_cluster
+
+
+def _pairwise(x, tol=0):
+    """Cluster size comparing each valid value with its neighbors"""
+    y = ma.compressed(ma.fix_invalid(x))
+    tol = tol + 1e-5 * tol
+    output = []
+    for i in range(y.size):
+        n = 0
+        for j in range(i + 1, y.size):
+            if abs(y[j] - y[i]) > tol:
+                break
+            n += 1
+        for j in range(i - 1, -1, -1):
+            if abs(y[j] - y[i]) > tol:
+                break
+            n += 1
+        output.append(n)
+    return output
+
+
+def test_constant_cluster_size():
+    x = [1, 2, 2, 2, 3, np.nan, 3, 4, 4]
+    y = constant_cluster_size(x)
+
+    output = [0, 2, 2, 2, 1, 0, 1, 1, 1]
+    assert isinstance(y, np.ndarray)
+    assert np.all(y == output)
+
+
+def test_cluster_bounds():
+    x = [1, 2, 2, 2, 3, np.nan, 3, 4, 4]
+    size, start, end = constant_cluster(x)
+
+    assert np.all(start == [0, 1, 1, 1, 4, -1, 4, 7, 7])
+    assert np.all(end == [0, 3, 3, 3, 6, -1, 6, 8, 8])
+
+
+def test_tolerance():
+    """With tol the cluster is centered on each value"""
+    x = [0, 0.1, 0.2, 0.3, 1, 1.1]
+    assert np.all(constant_cluster_size(x, tol=0.1) == [1, 2, 2, 1, 1, 1])
+    assert np.all(constant_cluster_size(x, tol=0.2) == [2, 3, 3, 2, 1, 1])
+
+
+def test_random_series():
+    np.random.seed(42)
+    for tol in (0, 0.1, 0.5):
+        x = np.round(np.random.randn(300), 1)
+        x[np.random.randint(0, 300, 20)] = np.nan
+        x = ma.masked_array(x, mask=np.random.rand(300) < 0.05)
+        y = constant_cluster_size(x, tol=tol)
+        assert np.all(y[~ma.getmaskarray(ma.fix_invalid(x))] == _pairwise(x, tol))
+
+
+def test_empty():
+    assert constant_cluster_size([]).size == 0
+    assert constant_cluster_size([], tol=1).size == 0
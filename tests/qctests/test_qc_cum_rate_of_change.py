@@ -5,6 +5,8 @@
 """
 
 import numpy as np
+from numpy import ma
+
 from cotede.qctests import CumRateOfChange, cum_rate_of_change
 from ..data import DummyData
 
@@ -20,6 +22,31 @@ def test_cum_rate_of_change():
     assert np.allclose(y, output, equal_nan=True)
 
 
+def test_chunks():
+    """Processing in chunks gives exactly the same of a single pass"""
+    np.random.seed(42)
+    x = np.random.randn(1000).cumsum()
+    x[[100, 101, 500]] = np.nan
+    y = cum_rate_of_change(x, 0.8)
+
+    state = None
+    output = []
+    for chunk in np.array_split(x, [0, 1, 100, 101, 357, 500, 501, 999]):
+        z, state = cum_rate_of_change(chunk, 0.8, state, return_state=True)
+        assert z.size == chunk.size
+        output.append(z)
+    assert np.array_equal(np.concatenate(output), y, equal_nan=True)
+
+
+def test_masked_input():
+    x = ma.masked_array([1, -1, 2, 2, 3, 2, 4], mask=[0, 0, 0, 1, 0, 0, 0])
+    y = cum_rate_of_change(x, 0.8)
+
+    output = [np.nan, 2.0, 3.0, np.nan, np.nan, 1.0, 2.0]
+    assert np.allclose(y, output, equal_nan=True)
+    assert x.mask[3]
+
+
 def test_standard_dataset():
     """Test CumRateOfChange with a standard dataset
     """
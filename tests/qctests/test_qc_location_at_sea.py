@@ -217,6 +217,13 @@ def test_nonelocation():
     assert location_at_sea(data) == 0
 
 
+def test_attrs_are_not_modified():
+    data = DummyData()
+    data.attrs = {"latitude": 91, "longitude": -30}
+    assert location_at_sea(data) == 3
+    assert data.attrs == {"latitude": 91, "longitude": -30}
+
+
 def test_LocationAtSea_attrs():
     """Test standard with single location
 
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Verify the Monotonic Z QC test
+"""
+
+import numpy as np
+from numpy import ma
+
+from cotede.qctests import MonotonicZ
+
+
+def _flags(z, cfg=None):
+    data = {"TEMP": np.zeros(len(z)), "depth": z}
+    return MonotonicZ(data, "TEMP", cfg={} if cfg is None else cfg).flags[
+        "monotonic_depth"
+    ]
+
+
+def test_increasing():
+    flag = _flags(np.arange(10.0))
+    assert np.all(flag == 1)
+
+
+def test_reversal():
+    """Constant or reversed z, until deeper than before, is bad"""
+    z = np.array([1, 2, 3, 3, 2.5, 2.9, 3.1, 4, 5, 4.5, 6])
+    flag = _flags(z)
+    assert np.all(flag == [1, 1, 1, 4, 4, 4, 1, 1, 1, 4, 1])
+
+
+def test_masked_z():
+    z = ma.masked_array([1, 2, 3, 10, 2.5, 4], mask=[0, 0, 0, 1, 0, 0])
+    flag = _flags(z)
+    assert np.all(flag == [1, 1, 1, 9, 4, 1])
+
+    z = ma.masked_array([5, 1, 2, 3], mask=[1, 0, 0, 0])
+    flag = _flags(z)
+    assert np.all(flag == [9, 1, 1, 1])
+
+
+def test_tolerance():
+    z = np.array([1, 2, 3, 3, 2.5, 2.9, 3.1, 4, 5, 4.5, 6])
+    flag = _flags(z, {"tolerance": 0.2})
+    assert np.all(flag == [1, 1, 1, 1, 4, 1, 1, 1, 1, 4, 1])
+
+    flag = _flags(z, {"tolerance": 0.6})
+    assert np.all(flag == 1)
@@ -24,6 +24,16 @@ def test_rate_of_change():
     assert np.allclose(y, output, equal_nan=True)
 
 
+def test_masked_input_is_not_modified():
+    x = ma.masked_array([1, -1, 2, 2, 3, 2, 4], mask=[0, 0, 0, 1, 0, 0, 0])
+    x.flags.writeable = False
+    y = rate_of_change(x)
+
+    assert np.allclose(y, [np.nan, -2, 3, np.nan, np.nan, -1, 2], equal_nan=True)
+    assert x.data[3] == 2
+    assert x.mask[3]
+
+
 def test_feature_input_types():
     x = np.array([1, -1, 2, 2, 3, 2, 4])
     compare_feature_input_types(rate_of_change, x)
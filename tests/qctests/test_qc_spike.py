@@ -24,6 +24,24 @@ def test_spike():
     assert np.allclose(y, output, equal_nan=True)
 
 
+def test_masked_input_is_not_modified():
+    x = ma.masked_array([1, -1, 2, 2, 3, 2, 4], mask=[0, 0, 0, 1, 0, 0, 0], dtype="f")
+    y = spike(x)
+
+    assert np.isnan(y[2:5]).all()
+    assert x.data[3] == 2
+    assert x.mask[3]
+
+
+def test_masked_integer():
+    x = ma.masked_array([1, -1, 2, 2, 3, 2, 4], mask=[0, 0, 0, 1, 0, 0, 0])
+    x.flags.writeable = False
+    y = spike(x)
+    expected = spike(ma.filled(x.astype("f8"), np.nan))
+    assert np.allclose(y, expected, equal_nan=True)
+    assert np.isnan(y[2:5]).all()
+
+
 def test_feature_input_types():
     x = np.array([1, -1, 2, 2, 3, 2, 4])
     compare_feature_input_types(spike, x)
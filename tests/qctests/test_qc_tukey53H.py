@@ -5,8 +5,10 @@
 """
 
 import numpy as np
+from numpy import ma
 
 from cotede.qctests import tukey53H, Tukey53H
+from cotede.qctests.tukey53H import _tukey53H_numpy
 from ..data import DummyData
 
 from .compare import compare_feature_input_types, compare_input_types
@@ -23,6 +25,55 @@ def test_tukey53H():
     assert np.allclose(y, output, equal_nan=True)
 
 
+def test_masked_input_is_not_modified():
+    x = ma.masked_array(
+        [0, 1, -1, 2, -2, 3, 2, 4, 0, 1], mask=[0, 0, 0, 0, 0, 1, 0, 0, 0, 0], dtype="f"
+    )
+    for f in (tukey53H, _tukey53H_numpy):
+        f(x)
+        assert x.data[5] == 3
+        assert x.mask[5]
+
+
+def _reference(x, normalize=False):
+    """Straightforward Tukey 53H with a median per window"""
+    x = np.asarray(x, dtype="f8")
+    N = len(x)
+    u1 = np.nan * np.ones(N)
+    for n in range(N - 4):
+        u1[n + 2] = np.median(x[n : n + 5])
+    u2 = np.nan * np.ones(N)
+    for n in range(N - 2):
+        u2[n + 1] = np.median(u1[n : n + 3])
+    delta = np.nan * np.ones(N)
+    delta[1:-1] = x[1:-1] - 0.25 * (u2[:-2] + 2 * u2[1:-1] + u2[2:])
+    if normalize:
+        delta /= np.std(u1[~np.isnan(u1)], ddof=1)
+    return delta
+
+
+def test_median_network():
+    """Vectorized Tukey53H is equivalent to median by window"""
+    np.random.seed(42)
+    x = np.random.randn(500)
+    x[np.random.randint(0, 500, 25)] = np.nan
+    for normalize in (False, True):
+        assert np.allclose(
+            tukey53H(x, normalize=normalize),
+            _reference(x, normalize=normalize),
+            equal_nan=True,
+        )
+
+
+def test_short_input():
+    for N in range(7):
+        x = np.arange(N, dtype="f8")
+        y = tukey53H(x)
+        assert y.shape == (N,)
+        assert np.allclose(y, _reference(x), equal_nan=True)
+        assert np.isnan(tukey53H(x, normalize=True)).all()
+
+
 def test_feature_input_types():
     x = np.array([0, 1, -1, 2, -2, 3, 2, 4, 0, np.nan])
     compare_feature_input_types(tukey53H, x)
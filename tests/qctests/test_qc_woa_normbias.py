@@ -8,7 +8,14 @@ from datetime import datetime
 import numpy as np
 from numpy import ma
 
-from cotede.qctests import WOA_NormBias, woa_normbias
+from cotede.qctests import WOA_NormBias, woa_normbias, woa_normbias_many
+from cotede.qctests.woa_normbias import (
+    _climatology_request,
+    MAX_CACHED_LEVELS,
+    _invalid_levels,
+    _invalid_levels_cache,
+    _standard_error_bias,
+)
 from cotede.qc import ProfileQC
 from ..data import DummyData
 
@@ -168,6 +175,18 @@ def test_track():
     )
 
 
+def test_standard_error_bias():
+    """Only the bias beyond the standard error, without modifying the std"""
+    bias = np.array([0.5, -0.5, 2.0, -2.0, 2.0, np.nan])
+    std = np.array([2.0, 2.0, 2.0, 2.0, 2.0, 2.0])
+    nsamples = np.array([4, 4, 4, 4, -1, 4])
+    y = _standard_error_bias(bias, std, nsamples)
+
+    assert np.allclose(y, [0, 0, 1, -1, 2, np.nan], equal_nan=True)
+    assert np.all(std == 2)
+    assert bias[2] == 2
+
+
 def test_standard_error():
     """I need to improve this!!
     """
@@ -196,3 +215,46 @@ def test_standard_error():
     assert "woa_normbias" in pqc.flags["TEMP"]
     assert pqc.flags["TEMP"]["woa_normbias"].shape == profile.data["TEMP"].shape
     assert (pqc.flags["TEMP"]["woa_normbias"] == [1, 1, 1, 1, 1, 1, 3, 0]).all()
+
+
+def test_woa_normbias_many():
+    """Same as one profile at a time, including invalid depths"""
+    profiles = [DummyData() for i in range(4)]
+    profiles[1].attrs["LATITUDE"] += 0.1
+    profiles[2].attrs["LONGITUDE"] += 3
+    del profiles[3].attrs["datetime"]
+    profiles.append(DummyData())
+    profiles[-1].data["PRES"][[2, 5]] = -1
+
+    output = woa_normbias_many(profiles, "TEMP")
+    assert len(output) == len(profiles)
+    assert output[3] is None
+    for p, features in zip(profiles, output):
+        if features is None:
+            continue
+        expected = woa_normbias(p, "TEMP")
+        for v in expected:
+            assert np.allclose(features[v], expected[v], equal_nan=True)
+    assert np.isnan(output[-1]["woa_mean"][[2, 5]]).all()
+
+
+def test_repeated_levels():
+    """Profiles on the same levels share the depth validation"""
+    profile = DummyData()
+    profile.data["PRES"][[2, 5]] = -1
+    mode, kwargs, idx = _climatology_request(profile)
+    assert mode == "profile"
+    assert np.all(~idx[[2, 5]])
+    assert np.all(kwargs["depth"] == profile["PRES"][idx])
+
+    hits = _invalid_levels_cache.cache_info()["hits"]
+    mode, kwargs, idx2 = _climatology_request(profile)
+    assert _invalid_levels_cache.cache_info()["hits"] == hits + 1
+    assert np.all(idx2 == idx)
+
+    # Long level vectors are validated without the cache
+    size = len(_invalid_levels_cache)
+    depth = np.arange(MAX_CACHED_LEVELS + 1.0)
+    depth[3] = np.nan
+    assert np.all(_invalid_levels(depth) == [3])
+    assert len(_invalid_levels_cache) == size
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Verify the rolling window statistics
+"""
+
+import numpy as np
+from numpy import ma
+import pytest
+
+from cotede.qctests import rolling
+from cotede.qctests.rolling import Rolling
+
+
+def _reference(x, window, statistic, t=None, center=True, min_periods=None):
+    """Statistic evaluated window by window"""
+    x = ma.filled(ma.masked_invalid(x).astype("f8"), np.nan)
+    N = len(x)
+    if min_periods is None:
+        min_periods = window if t is None else 1
+    output = np.full(N, np.nan)
+    for i in range(N):
+        if t is None:
+            start = i - window // 2 if center else i - window + 1
+            idx = np.arange(max(0, start), min(N, start + window))
+        elif center:
+            idx = np.nonzero(np.abs(t - t[i]) <= window / 2)[0]
+        else:
+            idx = np.nonzero((t > t[i] - window) & (t <= t[i]))[0]
+        w = x[idx]
+        w = w[np.isfinite(w)]
+        if (w.size > 0) and (w.size >= min_periods):
+            output[i] = statistic(w)
+    return output
+
+
+STATISTICS = {
+    "median": np.median,
+    "mean": np.mean,
+    "std": lambda w: np.std(w, ddof=1) if w.size > 1 else np.nan,
+    "mad": lambda w: np.median(np.abs(w - np.median(w))),
+    "sum": np.sum,
+    "count": np.size,
+}
+
+
+def _series(N=300, seed=42):
+    np.random.seed(seed)
+    x = np.round(np.random.randn(N).cumsum(), 1)
+    x[np.random.randint(0, N, N // 20)] = np.nan
+    return ma.masked_array(x, mask=np.random.rand(N) < 0.05)
+
+
+@pytest.mark.parametrize("window", [1, 2, 3, 4, 5, 8, 15, 16, 17, 40])
+@pytest.mark.parametrize("min_periods", [None, 1, 3])
+@pytest.mark.parametrize("center", [True, False])
+def test_count_window(window, min_periods, center):
+    x = _series()
+    r = Rolling(x, window, center=center, min_periods=min_periods)
+    for name, f in STATISTICS.items():
+        if name == "count":
+            expected = np.nan_to_num(_reference(x, window, f, min_periods=0, center=center))
+        else:
+            expected = _reference(x, window, f, center=center, min_periods=min_periods)
+        assert np.allclose(getattr(r, name)(), expected, equal_nan=True), name
+
+
+@pytest.mark.parametrize("window", [0.5, 2, 7.5, 20])
+@pytest.mark.parametrize("center", [True, False])
+def test_coordinate_window(window, center):
+    x = _series()
+    np.random.seed(0)
+    t = np.cumsum(np.random.exponential(0.5, x.size))
+    r = Rolling(x, window, t=t, center=center)
+    for name in ("median", "mean", "std", "mad"):
+        expected = _reference(x, window, STATISTICS[name], t=t, center=center)
+        assert np.allclose(getattr(r, name)(), expected, equal_nan=True), name
+
+
+def test_time_window():
+    x = np.arange(6.0)
+    t = np.datetime64("2020-01-01T00:00") + np.array(
+        [0, 1, 2, 10, 11, 30], dtype="timedelta64[m]"
+    )
+    r = Rolling(x, np.timedelta64(5, "m"), t=t)
+    assert np.all(r.count() == [3, 3, 3, 2, 2, 1])
+    assert np.allclose(r.median(), [1, 1, 1, 3.5, 3.5, 5])
+
+
+def test_quantile():
+    x = _series()
+    for window in (5, 40):
+        r = Rolling(x, window, min_periods=3)
+        qs = [0, 0.1, 0.5, 0.9, 1]
+        y = r.quantile(qs)
+        assert y.shape == (len(qs), x.size)
+        for q, yq in zip(qs, y):
+            expected = _reference(
+                x, window, lambda w: np.quantile(w, q), min_periods=3
+            )
+            assert np.allclose(yq, expected, equal_nan=True)
+            assert np.allclose(r.quantile(q), expected, equal_nan=True)
+
+
+def test_without_pandas(monkeypatch):
+    """Sorting the windows is equivalent to pandas"""
+    x = _series()
+    r = Rolling(x, 40, min_periods=3)
+    expected = r.median(), r.quantile(0.1)
+    monkeypatch.setattr(rolling, "PANDAS_AVAILABLE", False)
+    assert np.allclose(r.median(), expected[0], equal_nan=True)
+    assert np.allclose(r.quantile(0.1), expected[1], equal_nan=True)
+
+
+def test_median_network():
+    """Median of 3 and 5 are NaN if any value in the window is invalid"""
+    x = _series()
+    for window in (3, 5):
+        expected = _reference(x, window, np.median)
+        assert np.allclose(Rolling(x, window).median(), expected, equal_nan=True)
+
+
+def test_input_is_not_modified():
+    x = ma.masked_array([1.0, 2, 3, 4, 5, 6], mask=[0, 0, 1, 0, 0, 0])
+    r = Rolling(x, 3, min_periods=1)
+    r.median()
+    r.std()
+    assert x.data[2] == 3
+    assert x.mask[2]
+
+
+def test_short_input():
+    for N in range(4):
+        x = np.arange(N, dtype="f8")
+        r = Rolling(x, 5)
+        for name in ("median", "mean", "std", "mad", "quantile"):
+            args = (0.5,) if name == "quantile" else ()
+            y = getattr(r, name)(*args)
+            assert y.shape == (N,)
+            assert np.isnan(y).all()
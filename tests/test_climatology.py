@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Verify the shared climatology handles and their cache
+"""
+
+import numpy as np
+from numpy import ma
+import pytest
+
+from cotede.utils import climatology
+from cotede.utils.climatology import CropCache, get_db, _CachedCrop
+
+
+def _subset(n=10):
+    return {"mean": ma.masked_array(np.arange(n, dtype="f8"), mask=np.zeros(n))}
+
+
+def test_lru_eviction():
+    nbytes = climatology._nbytes(_subset())
+    cache = CropCache(maxbytes=2 * nbytes)
+    cache.put("a", _subset(), {})
+    cache.put("b", _subset(), {})
+    assert cache.get("a") is not None
+    cache.put("c", _subset(), {})
+    # "b" was the least recently used
+    assert "b" not in cache
+    assert ("a" in cache) and ("c" in cache)
+    info = cache.info()
+    assert info["hits"] == 1
+    assert info["evictions"] == 1
+    assert info["entries"] == 2
+    assert info["nbytes"] <= info["maxbytes"]
+
+    assert cache.get("b") is None
+    assert cache.info()["misses"] == 1
+
+    cache.resize(0)
+    assert len(cache) == 0
+    cache.put("a", _subset(), {})
+    assert len(cache) == 0
+
+
+def test_copy_on_get():
+    """Modifying a returned crop does not modify the cache"""
+    cache = CropCache(maxbytes=2 ** 20)
+    subset = _subset()
+    cache.put("a", subset, {"lat": np.arange(3.0)})
+    subset["mean"][0] = ma.masked
+
+    subset, dims = cache.get("a")
+    subset["mean"][1] = ma.masked
+    dims["time"] = np.array([15.0])
+
+    subset, dims = cache.get("a")
+    assert not subset["mean"].mask.any()
+    assert "time" not in dims
+
+
+class DummyVar(object):
+    """Mimics an OceansDB variable, WOA like or, without time, CARS like"""
+
+    def __init__(self, time=True):
+        self.dims = {
+            "lat": np.arange(-89.5, 90),
+            "lon": np.arange(-179.5, 180),
+            "depth": np.array([0.0, 10, 20, 50, 100, 200]),
+        }
+        if time:
+            self.dims["time"] = np.arange(15.0, 365, 30.5)
+        self.ncrops = 0
+
+    def crop(self, doy, depth, lat, lon, var):
+        from oceansdb.common import cropIndices
+
+        self.ncrops += 1
+        if "time" in self.dims:
+            dims, idx = cropIndices(self.dims, lat, lon, depth, doy)
+            t = dims["time"]
+        else:
+            dims, idx = cropIndices(self.dims, lat, lon, depth)
+            t = dims["time"] = np.atleast_1d(doy)
+        z = self.dims["depth"][idx["zn"]]
+        value = (
+            t[:, None, None, None] * 1e6
+            + z[None, :, None, None] * 1e3
+            + dims["lat"][None, None, :, None]
+            + dims["lon"][None, None, None, :] * 1e-3
+        )
+        return {v: ma.masked_array(value) for v in var}, dims
+
+
+@pytest.fixture
+def cache():
+    climatology.clear_cache()
+    yield climatology._cache
+    climatology.clear_cache()
+
+
+def test_cached_crop(cache):
+    var_nc = DummyVar()
+    crop = _CachedCrop(("WOA", "TEMP"), var_nc)
+
+    def request(lat, lon, depth, doy):
+        return crop(
+            np.array([doy]), np.array(depth), np.array([lat]), np.array([lon]), ["mean"]
+        )
+
+    request(10.2, -38.1, [5, 15], 100)
+    # Same grid cells and time bin
+    request(10.4, -38.3, [5, 15], 101)
+    assert var_nc.ncrops == 1
+    assert cache.info()["hits"] == 1
+    # Another grid cell, another time bin, or other depth levels
+    request(12.4, -38.3, [5, 15], 100)
+    request(10.2, -38.1, [5, 15], 200)
+    request(10.2, -38.1, [5, 75], 100)
+    assert var_nc.ncrops == 4
+    assert cache.info()["misses"] == 4
+
+    maxbytes = cache.maxbytes
+    climatology.set_cache_limit(0)
+    try:
+        request(10.2, -38.1, [5, 15], 100)
+        assert var_nc.ncrops == 5
+    finally:
+        climatology.set_cache_limit(maxbytes)
+
+
+def test_pool():
+    db = get_db("WOA")
+    assert get_db("WOA") is db
+    assert get_db("ETOPO", resolution="5min") is not get_db("ETOPO")
+
+
+@pytest.mark.parametrize("time", [True, False])
+def test_prefetch(cache, time):
+    var_nc = DummyVar(time)
+    crop = _CachedCrop(("WOA", "TEMP"), var_nc)
+    requests = [
+        {"doy": 100, "depth": [5, 15], "lat": 10.2, "lon": -38.1},
+        {"doy": 101, "depth": [0, 5, 60], "lat": 10.4, "lon": -38.3},
+        {"doy": 100, "depth": [150], "lat": 10.4, "lon": -38.3},
+        {"doy": 100, "depth": [5, 15], "lat": 12.4, "lon": -38.3},
+    ]
+    assert crop.prefetch(requests, ["mean"]) == 2
+    assert var_nc.ncrops == 2
+
+    reference = DummyVar(time)
+    for r in requests:
+        r = {k: np.atleast_1d(r[k]) for k in r}
+        subset, dims = crop(r["doy"], r["depth"], r["lat"], r["lon"], ["mean"])
+        expected, expected_dims = reference.crop(
+            r["doy"], r["depth"], r["lat"], r["lon"], ["mean"]
+        )
+        assert np.all(subset["mean"] == expected["mean"])
+        for d in expected_dims:
+            assert np.all(dims[d] == expected_dims[d])
+    # All sliced from the blocks
+    assert var_nc.ncrops == 2
+
+
+class DummyTopography(object):
+    """Mimics the OceansDB ETOPO variable"""
+
+    def __init__(self):
+        self.dims = {
+            "lat": np.arange(-90, 90.1, 0.5),
+            "lon": np.arange(-180, 180, 0.5),
+        }
+        self.ncrops = 0
+
+    def crop(self, lat, lon, var):
+        from oceansdb.common import cropIndices
+
+        self.ncrops += 1
+        dims, idx = cropIndices(self.dims, lat, lon)
+        value = 100 * dims["lat"][:, None] + np.round(10 * dims["lon"][None, :])
+        return {v: ma.masked_array(value.astype("i4")) for v in var}, dims
+
+
+@pytest.mark.parametrize("time", [True, False])
+def test_track(time):
+    var_nc = DummyVar(time)
+    N = 5000
+    lat = np.linspace(10.6, 10.9, N)
+    lon = np.linspace(-38.9, -36.1, N)
+    doy = np.linspace(100, 101, N)
+    output = climatology.track(var_nc, ["mean"], lat, lon, doy=doy, depth=5)
+    # One read for each of the 4 grid cells crossed
+    assert var_nc.ncrops == 4
+    y = output["mean"]
+    assert y.shape == (N,)
+    # Linear on all coordinates, including the time
+    assert np.allclose(y, doy * 1e6 + 5e3 + lat + lon * 1e-3)
+
+
+def test_track_invalid_positions():
+    var_nc = DummyVar()
+    lat = np.array([10.2, np.nan, 10.4, 10.3])
+    lon = np.array([-38.2, -38.2, -38.2, 321.8])
+    depth = ma.masked_array([5, 5, 5, 5], mask=[0, 0, 1, 0])
+    y = climatology.track(var_nc, "mean", lat, lon, doy=100, depth=depth)["mean"]
+    assert np.all(y.mask == [False, True, True, False])
+    # Same position on a different longitude reference
+    assert np.allclose(y[3], y[0] + 0.1)
+
+
+def test_track_topography():
+    var_nc = DummyTopography()
+    lat = np.linspace(-10.2, -10.3, 100)
+    lon = np.full(100, 25.2)
+    y = climatology.track(var_nc, "height", lat=lat, lon=lon)["height"]
+    assert var_nc.ncrops == 1
+    assert y.dtype == "i4"
+    assert np.all(y == np.round(100 * lat + 10 * 25.2))
+
+    y = climatology.track(var_nc, "height", lat=-10.2, lon=25.2)["height"]
+    assert y.shape == (1,)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Check the QC of one dataset with multiple cfgs
+"""
+
+import sys
+
+import numpy as np
+
+from cotede import compare_cfgs
+from cotede.qc import ProfileQC
+from .data import DummyData
+
+
+CFGS = [
+    {
+        "sea_water_temperature": {
+            "spike": {"threshold": 6.0},
+            "gradient": {"threshold": 9.0},
+        }
+    },
+    {
+        "sea_water_temperature": {
+            "spike": {"threshold": 2.0},
+            "tukey53H": {"threshold": 6.0, "l": 5},
+        },
+        "sea_water_salinity": {"spike": {"threshold": 0.3}},
+    },
+    {
+        "sea_water_temperature": {
+            "spike_depthconditional": {
+                "pressure_threshold": 500,
+                "shallow_max": 6.0,
+                "deep_max": 2.0,
+            },
+            "gradient": {"threshold": 3.0},
+        }
+    },
+]
+
+
+def test_same_flags():
+    profile = DummyData()
+    output = compare_cfgs(profile, CFGS)
+
+    assert len(output) == len(CFGS)
+    for cfg, pqc in zip(CFGS, output):
+        expected = ProfileQC(profile, cfg=cfg)
+        assert sorted(pqc.flags) == sorted(expected.flags)
+        for v in expected.flags:
+            for f in expected.flags[v]:
+                assert np.all(pqc.flags[v][f] == expected.flags[v][f])
+
+
+def test_features_once(monkeypatch):
+    module = sys.modules["cotede.qctests.spike"]
+    spike = module.spike
+    calls = []
+
+    def counter(x):
+        calls.append(x)
+        return spike(x)
+
+    monkeypatch.setattr(module, "spike", counter)
+    compare_cfgs(DummyData(), CFGS)
+    # Once for TEMP and once for PSAL, instead of four times
+    assert len(calls) == 2
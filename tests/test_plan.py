@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Check the compiled QC plan
+"""
+
+import pytest
+
+from cotede import compile_cfg
+from cotede import plan as plan_module
+from cotede.plan import QCPlan
+from cotede.qc import ProfileQC
+from cotede.utils import load_cfg
+from .data import DummyData
+
+
+CFG = {
+    "sea_water_temperature": {
+        "global_range": {"minval": -2.5, "maxval": 45},
+        "spike": {"threshold": 6.0},
+        "gradient": {"threshold": 9.0},
+    },
+    "sea_water_salinity": {"spike": {"threshold": 0.3}},
+}
+
+
+def test_cached():
+    plan = compile_cfg(CFG)
+    assert isinstance(plan, QCPlan)
+    assert compile_cfg(CFG) is plan
+    assert compile_cfg(plan) is plan
+    # The resolved cfg leads to the same plan
+    assert compile_cfg(load_cfg(CFG)) is plan
+
+
+def test_steps():
+    plan = compile_cfg(CFG)
+    steps = plan.steps("sea_water_temperature")
+    assert [s.name for s in steps] == ["global_range", "spike", "gradient"]
+    assert steps[1].Procedure.__name__ == "Spike"
+
+
+def test_bind():
+    plan = compile_cfg(CFG)
+    assert plan.bind(["PRES", "TEMP", "PSAL", "sea_water_temperature2"]) == (
+        ("TEMP", "sea_water_temperature"),
+        ("PSAL", "sea_water_salinity"),
+        ("sea_water_temperature2", "sea_water_temperature"),
+    )
+
+
+@pytest.mark.parametrize(
+    "cfg",
+    [
+        {"spike": {"threshold": None}},
+        {"gradient": {"threshold": [1, 2]}},
+        {"global_range": {"minval": 45, "maxval": -2}},
+        {"global_range": {"minval": 45}},
+    ],
+)
+def test_invalid(cfg):
+    """Invalid parameters are caught while compiling, before any profile"""
+    with pytest.raises(AssertionError):
+        compile_cfg({"sea_water_temperature": cfg})
+
+
+def test_same_result():
+    profile = DummyData()
+    plan = compile_cfg(CFG)
+    pqc = ProfileQC(profile, cfg=plan)
+    assert pqc.plan is plan
+    pqc2 = ProfileQC(profile, cfg=load_cfg(CFG))
+    for v in pqc2.flags:
+        for f in pqc2.flags[v]:
+            assert (pqc.flags[v][f] == pqc2.flags[v][f]).all()
+
+
+def test_bounded_cache():
+    """A sweep over many cfg variants doesn't keep every plan"""
+    plan = compile_cfg(CFG)
+    for threshold in range(1, 2 * plan_module._PLANS.maxsize):
+        compile_cfg({"sea_water_temperature": {"spike": {"threshold": threshold}}})
+    assert len(plan_module._PLANS) <= plan_module._PLANS.maxsize
+    # Recompiled, as an equivalent plan
+    assert compile_cfg(CFG) is not plan
+    assert compile_cfg(CFG).key == plan.key
+
+
+def test_cfg_is_a_copy():
+    """Modifying the cfg of a ProfileQC doesn't affect the cached plan"""
+    profile = DummyData()
+    pqc = ProfileQC(profile, cfg=CFG)
+    pqc.cfg["variables"]["sea_water_temperature"]["spike"]["threshold"] = -1
+    assert pqc.cfg["variables"]["sea_water_temperature"]["spike"]["threshold"] == -1
+
+    plan = compile_cfg(CFG)
+    assert plan.cfg["variables"]["sea_water_temperature"]["spike"]["threshold"] == 6
+    pqc2 = ProfileQC(profile, cfg=CFG)
+    assert (pqc2.flags["TEMP"]["spike"] == pqc.flags["TEMP"]["spike"]).all()
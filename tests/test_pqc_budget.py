@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Check the latency budget of ProfileQC
+"""
+
+import numpy as np
+
+from cotede import qc_many
+from cotede import scheduler
+from cotede.qc import ProfileQC
+from cotede.qctests import Tukey53H
+from .data import DummyData
+
+
+CFG = {
+    "sea_water_temperature": {
+        "global_range": {"minval": -2.5, "maxval": 45},
+        "tukey53H": {"threshold": 6.0, "l": 5},
+        "spike": {"threshold": 6.0},
+    }
+}
+
+
+def test_no_budget():
+    pqc = ProfileQC(DummyData(), cfg=CFG, budget=60)
+    assert pqc.skipped == {}
+    assert set(pqc.timing["TEMP"]) == set(CFG["sea_water_temperature"])
+
+
+def test_out_of_time():
+    """Only the optional procedures are skipped"""
+    pqc = ProfileQC(DummyData(), cfg=CFG, budget=0)
+    assert pqc.skipped == {"TEMP": ["tukey53H"]}
+    assert (pqc.flags["TEMP"]["tukey53H"] == 0).all()
+    assert (pqc.flags["TEMP"]["spike"] != 0).any()
+
+
+def test_not_optional():
+    """The cfg can require a procedure that would be optional"""
+    cfg = {
+        "sea_water_temperature": {
+            "tukey53H": {"threshold": 6.0, "l": 5, "optional": False}
+        }
+    }
+    pqc = ProfileQC(DummyData(), cfg=cfg, budget=0)
+    assert pqc.skipped == {}
+
+
+def test_expected_time(monkeypatch):
+    """Skip if it is not expected to finish in time"""
+    monkeypatch.setitem(scheduler._TIMING, Tukey53H, (10, 1e3))
+    pqc = ProfileQC(DummyData(), cfg=CFG, budget=60)
+    assert pqc.skipped == {"TEMP": ["tukey53H"]}
+
+
+def test_first_run(monkeypatch):
+    """Before any run, the time is guessed from the cost"""
+    monkeypatch.setattr(scheduler, "_TIMING", {})
+    guess = scheduler.expected_time(Tukey53H)
+    assert guess == Tukey53H.cost * scheduler.SECONDS_PER_COST
+    assert guess > 0
+
+
+def test_prior_timing(monkeypatch):
+    """qc_many() can start from the timing of earlier runs"""
+    monkeypatch.setattr(scheduler, "_TIMING", {})
+    profiles = [DummyData() for i in range(2)]
+    output = qc_many(
+        profiles, cfg=CFG, workers=1, budget=60, timing={Tukey53H: (10, 1e3)}
+    )
+    assert output["skipped"] == {n: {"TEMP": ["tukey53H"]} for n in range(2)}
+    assert scheduler.timing_stats()[Tukey53H] == (10, 1e3)
+
+
+def test_qc_many():
+    profiles = [DummyData() for i in range(3)]
+    output = qc_many(profiles, cfg=CFG, workers=1, budget=0)
+    assert output["skipped"] == {n: {"TEMP": ["tukey53H"]} for n in range(3)}
+    assert np.all(output["flags"]["TEMP"]["tukey53H"] == 0)
+
+    output = qc_many(profiles, cfg=CFG, workers=1)
+    assert output["skipped"] == {}
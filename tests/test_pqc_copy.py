@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Check ProfileQC without copying the input
+"""
+
+from copy import deepcopy
+
+import numpy as np
+from numpy import ma
+import pytest
+
+from cotede.qc import ProfileQC
+from .data import DummyData
+
+
+CFG = {
+    "sea_water_temperature": {
+        "global_range": {"minval": -2.5, "maxval": 45},
+        "gradient": {"threshold": 9.0},
+        "spike": {"threshold": 6.0},
+        "tukey53H": {"threshold": 6.0, "l": 5},
+        "rate_of_change": {"threshold": 4},
+        "cum_rate_of_change": {"memory": 0.8, "threshold": 4},
+        "profile_envelop": [
+            ["> 0", "<= 25", -2, 37],
+            ["> 25", "<= 50", -2, 36],
+            ["> 50", "<= 5000", -2, 33],
+        ],
+    },
+    "sea_water_salinity": {"spike": {"threshold": 0.3}},
+}
+
+
+def test_same_result():
+    profile = DummyData()
+
+    pqc = ProfileQC(profile, cfg=CFG)
+    pqc2 = ProfileQC(profile, cfg=CFG, copy=False)
+
+    for v in pqc.flags:
+        assert pqc.flags[v].keys() == pqc2.flags[v].keys()
+        for f in pqc.flags[v]:
+            assert np.all(pqc.flags[v][f] == pqc2.flags[v][f])
+    for v in pqc.features:
+        for f in pqc.features[v]:
+            assert np.allclose(
+                pqc.features[v][f], pqc2.features[v][f], equal_nan=True
+            )
+
+
+def test_input_is_not_copied_nor_modified():
+    profile = DummyData()
+    original = deepcopy(profile)
+
+    pqc = ProfileQC(profile, cfg=CFG, copy=False, attributes={"id": 42})
+
+    for v in profile.keys():
+        assert np.shares_memory(pqc[v], profile[v])
+        assert np.all(profile[v].data == original[v].data)
+        assert np.all(profile[v].mask == original[v].mask)
+    assert "id" not in profile.attrs
+    assert pqc.attrs["id"] == 42
+
+
+def test_readonly_view():
+    profile = DummyData()
+    pqc = ProfileQC(profile, cfg=CFG, copy=False)
+
+    with pytest.raises(ValueError):
+        pqc["TEMP"][0] = 0
+    with pytest.raises(ValueError):
+        pqc["TEMP"][0] = ma.masked
+    assert not profile["TEMP"].mask[0]
+    # The caller's array is still writeable
+    profile["TEMP"][0] = 0
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Procedures that don't depend on the variable are evaluated only once
+"""
+
+import sys
+
+import numpy as np
+import pytest
+
+from cotede.qc import ProfileQC
+from cotede.qctests import DeepestPressure, DensityInversion, MonotonicZ, Spike
+from .data import DummyData
+
+
+CFG = {
+    "sea_water_temperature": {
+        "valid_geolocation": None,
+        "deepest_pressure": {"threshold": 2000},
+        "pressure_increasing": {"procedure": "MonotonicZ", "coord": "PRES"},
+        "density_inversion": {"threshold": -0.03},
+        "spike": {"threshold": 6.0},
+    },
+    "sea_water_salinity": {
+        "valid_geolocation": None,
+        "deepest_pressure": {"threshold": 2000},
+        "pressure_increasing": {"procedure": "MonotonicZ", "coord": "PRES"},
+        "density_inversion": {"threshold": -0.03},
+        "spike": {"threshold": 0.3},
+    },
+}
+
+
+def test_inputs():
+    assert Spike.inputs("TEMP") == ("TEMP",)
+    assert MonotonicZ.inputs("TEMP", {"coord": "PRES"}) == ("PRES",)
+    assert DensityInversion.inputs("TEMP") == DensityInversion.inputs("PSAL")
+    assert DeepestPressure.inputs("TEMP") != DeepestPressure.inputs("PSAL")
+
+
+def test_shared_results():
+    pytest.importorskip("gsw")
+
+    pqc = ProfileQC(DummyData(), cfg=CFG)
+
+    for f in ("monotonic_pres", "density_inversion"):
+        assert pqc.flags["TEMP"][f] is pqc.flags["PSAL"][f]
+    for f in ("deepest_pressure", "spike"):
+        assert pqc.flags["TEMP"][f] is not pqc.flags["PSAL"][f]
+    assert np.all(pqc.flags["TEMP"]["valid_geolocation"] == 1)
+    assert np.shape(pqc.flags["PSAL"]["valid_geolocation"]) == (15,)
+
+
+def test_density_once(monkeypatch):
+    gsw = pytest.importorskip("gsw")
+    calls = []
+    pot_rho_t_exact = gsw.pot_rho_t_exact
+
+    def counting(*args, **kwargs):
+        calls.append(1)
+        return pot_rho_t_exact(*args, **kwargs)
+
+    monkeypatch.setattr(
+        sys.modules["cotede.qctests.density_inversion"].gsw,
+        "pot_rho_t_exact",
+        counting,
+    )
+    ProfileQC(DummyData(), cfg=CFG)
+    assert len(calls) == 1
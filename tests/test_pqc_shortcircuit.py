@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Check the short-circuit evaluation of ProfileQC
+"""
+
+import numpy as np
+
+from cotede.qc import ProfileQC
+from .data import DummyData
+
+
+def cfg(minval, maxval):
+    return {
+        "sea_water_temperature": {
+            "tukey53H": {"threshold": 6.0, "l": 5},
+            "spike": {"threshold": 6.0},
+            "global_range": {"minval": minval, "maxval": maxval},
+            "density_inversion": {"threshold": -0.03},
+        },
+        "sea_water_salinity": {
+            "global_range": {"minval": 2, "maxval": 41},
+            "density_inversion": {"threshold": -0.03},
+        },
+    }
+
+
+def test_default():
+    """Without shortcircuit everything is applied"""
+    pqc = ProfileQC(DummyData(), cfg=cfg(100, 200))
+    assert pqc.skipped == {}
+
+
+def test_nothing_to_skip():
+    profile = DummyData()
+    pqc = ProfileQC(profile, cfg=cfg(-2.5, 45))
+    pqc2 = ProfileQC(profile, cfg=cfg(-2.5, 45), shortcircuit=True)
+
+    assert pqc2.skipped == {}
+    for v in pqc.flags:
+        for f in pqc.flags[v]:
+            assert np.all(pqc.flags[v][f] == pqc2.flags[v][f])
+
+
+def test_skip():
+    """Everything is out of range, no reason to run tukey53H"""
+    profile = DummyData()
+    pqc = ProfileQC(profile, cfg=cfg(100, 200))
+    pqc2 = ProfileQC(profile, cfg=cfg(100, 200), shortcircuit=True)
+
+    # The cheapest ones were applied first
+    assert "global_range" not in pqc2.skipped["TEMP"]
+    assert "tukey53H" in pqc2.skipped["TEMP"]
+    assert (pqc2.flags["TEMP"]["tukey53H"] == 0).all()
+    # density_inversion is also used by PSAL, thus it can't be skipped
+    assert "density_inversion" not in pqc2.skipped["TEMP"]
+    assert "PSAL" not in pqc2.skipped
+
+    for v in pqc.flags:
+        assert np.all(pqc.flags[v]["overall"] == pqc2.flags[v]["overall"])
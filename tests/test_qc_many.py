@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Check the batch QC of multiple profiles
+"""
+
+import numpy as np
+from numpy import ma
+
+from cotede import qc_many
+from cotede.qc import ProfileQC
+from .data import DummyData
+
+
+CFG = {
+    "common": {"valid_datetime": None},
+    "sea_water_temperature": {
+        "global_range": {"minval": -2.5, "maxval": 45},
+        "gradient": {"threshold": 9.0},
+        "spike": {"threshold": 6.0},
+        "tukey53H": {"threshold": 6.0, "l": 5},
+    },
+    "sea_water_salinity": {
+        "global_range": {"minval": 2, "maxval": 41},
+        "spike": {"threshold": 0.3},
+    },
+}
+
+
+def dataset(n=7):
+    """A collection of profiles with different sizes"""
+    profiles = []
+    for i in range(n):
+        p = DummyData()
+        N = 15 - (i % 4)
+        for v in p.data:
+            p.data[v] = p.data[v][:N] + 0.1 * i
+        profiles.append(p)
+    return profiles
+
+
+def test_serial():
+    profiles = dataset()
+    output = qc_many(profiles, cfg=CFG, workers=1)
+
+    assert sorted(output["flags"].keys()) == ["PSAL", "TEMP", "common"]
+    for v in ("TEMP", "PSAL"):
+        idx = output["profile"][v]
+        assert idx.size == sum([len(p[v]) for p in profiles])
+        for n, p in enumerate(profiles):
+            pqc = ProfileQC(p, cfg=CFG)
+            for f in pqc.flags[v]:
+                assert np.all(output["flags"][v][f][idx == n] == pqc.flags[v][f])
+
+
+def test_parallel_keeps_order():
+    """Workers can complete out of order, but output follows the input"""
+    profiles = dataset(11)
+    serial = qc_many(profiles, cfg=CFG, workers=1)
+    parallel = qc_many(iter(profiles), cfg=CFG, workers=2, chunksize=2)
+
+    for v in serial["profile"]:
+        assert np.all(serial["profile"][v] == parallel["profile"][v])
+        for f in serial["flags"][v]:
+            assert parallel["flags"][v][f].dtype == "i1"
+            assert np.all(serial["flags"][v][f] == parallel["flags"][v][f])
+
+
+def test_features():
+    profiles = dataset(3)
+    output = qc_many(profiles, cfg=CFG, workers=2, saveauxiliary=True)
+
+    idx = output["profile"]["TEMP"]
+    for n, p in enumerate(profiles):
+        pqc = ProfileQC(p, cfg=CFG)
+        for f in pqc.features["TEMP"]:
+            assert np.allclose(
+                output["features"]["TEMP"][f][idx == n],
+                ma.filled(pqc.features["TEMP"][f], np.nan),
+                equal_nan=True,
+            )
+
+
+def test_missing_variable():
+    """A procedure missing in one profile is filled with flag 0"""
+    profiles = dataset(3)
+    del profiles[1].data["PSAL"]
+    output = qc_many(profiles, cfg=CFG, workers=1)
+
+    assert 1 not in output["profile"]["PSAL"]
+    assert output["profile"]["PSAL"].size == len(profiles[0]["PSAL"]) + len(
+        profiles[2]["PSAL"]
+    )
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Check re-flagging with a new cfg, reusing the features
+"""
+
+import copy
+import sys
+
+import numpy as np
+
+from cotede import reflag
+from cotede.qc import ProfileQC
+from .data import DummyData
+
+
+CFG = {
+    "sea_water_temperature": {
+        "global_range": {"minval": -2.5, "maxval": 45},
+        "spike": {"threshold": 6.0},
+        "tukey53H": {"threshold": 6.0, "l": 5},
+        "cum_rate_of_change": {"memory": 0.8, "threshold": 4},
+    }
+}
+
+
+def tuned_cfg():
+    cfg = copy.deepcopy(CFG)
+    cfg["sea_water_temperature"]["global_range"]["maxval"] = 10
+    cfg["sea_water_temperature"]["spike"]["threshold"] = 0.1
+    cfg["sea_water_temperature"]["tukey53H"]["l"] = 7
+    cfg["sea_water_temperature"]["cum_rate_of_change"]["threshold"] = 0.5
+    return cfg
+
+
+def test_reflag():
+    profile = DummyData()
+    pqc = ProfileQC(profile, cfg=CFG)
+    cfg = tuned_cfg()
+    pqc2 = reflag(profile, pqc.features, cfg, CFG)
+
+    assert sorted(pqc2.reused["TEMP"]) == [
+        "cum_rate_of_change", "global_range", "spike"]
+
+    expected = ProfileQC(profile, cfg=cfg)
+    for f in expected.flags["TEMP"]:
+        assert np.all(expected.flags["TEMP"][f] == pqc2.flags["TEMP"][f])
+
+
+def test_features_not_recomputed(monkeypatch):
+    profile = DummyData()
+    pqc = ProfileQC(profile, cfg=CFG)
+
+    def fail(x):
+        raise AssertionError("spike shouldn't be estimated again")
+
+    monkeypatch.setattr(sys.modules["cotede.qctests.spike"], "spike", fail)
+    pqc2 = reflag(profile, pqc.features, tuned_cfg(), CFG)
+    assert (pqc2.flags["TEMP"]["spike"] != pqc.flags["TEMP"]["spike"]).any()
+
+
+def test_missing_features():
+    """Without saved features everything is estimated again"""
+    pqc2 = reflag(DummyData(), {}, tuned_cfg(), CFG)
+    assert pqc2.reused == {}
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+""" Check the scheduler of QC procedures
+"""
+
+import numpy as np
+import pytest
+
+from cotede import compile_cfg
+from cotede.qc import ProfileQC
+from cotede.scheduler import Node, build_dag, run_dag
+from .data import DummyData
+
+
+FUZZY = {
+    "output": {
+        "low": {"type": "trimf", "params": [0.0, 0.225, 0.45]},
+        "medium": {"type": "trimf", "params": [0.275, 0.5, 0.725]},
+        "high": {"type": "smf", "params": [0.55, 0.775]},
+    },
+    "features": {
+        "spike": {
+            "weight": 1,
+            "low": {"type": "zmf", "params": [0.07, 0.2]},
+            "medium": {"type": "trapmf", "params": [0.07, 0.2, 2, 6]},
+            "high": {"type": "smf", "params": [2, 6]},
+        },
+        "gradient": {
+            "weight": 1,
+            "low": {"type": "zmf", "params": [0.5, 1.5]},
+            "medium": {"type": "trapmf", "params": [0.5, 1.5, 3, 4]},
+            "high": {"type": "smf", "params": [3, 4]},
+        },
+    },
+}
+
+ANOMALY = {
+    "threshold": -20.0,
+    "features": {
+        "spike": {
+            "model": "exponweib",
+            "qlimit": 0.0004,
+            "param": [1.078231, 0.512053, 0.0004, 0.002574],
+        },
+        "gradient": {
+            "model": "exponweib",
+            "qlimit": 0.0135,
+            "param": [1.431385, 0.605537, 0.0135, 0.015567],
+        },
+    },
+}
+
+CFG = {
+    "revision": 0.22,
+    "variables": {
+        "sea_water_temperature": {
+            # Listed before the procedures that produce its features
+            "fuzzylogic": FUZZY,
+            "global_range": {"minval": -2.5, "maxval": 45},
+            "spike": {"threshold": 6.0},
+            "gradient": {"threshold": 9.0},
+            "tukey53H": {"threshold": 6.0, "l": 5},
+            "density_inversion": {"threshold": -0.03},
+            "anomaly_detection": ANOMALY,
+        },
+        "sea_water_salinity": {
+            "spike": {"threshold": 0.3},
+            "density_inversion": {"threshold": -0.03},
+        },
+    },
+}
+
+
+def bindings():
+    plan = compile_cfg(CFG)
+    return [
+        ("TEMP", plan.steps("sea_water_temperature")),
+        ("PSAL", plan.steps("sea_water_salinity")),
+    ]
+
+
+def test_duplicated_nodes():
+    """density_inversion is a single node for TEMP & PSAL"""
+    nodes, index = build_dag(bindings())
+    assert index[("TEMP", "density_inversion")] == index[("PSAL", "density_inversion")]
+    assert index[("TEMP", "spike")] != index[("PSAL", "spike")]
+    assert len(nodes) == len(set(index.values())) == 8
+
+
+def test_dependencies():
+    nodes, index = build_dag(bindings())
+    for name in ("fuzzylogic", "anomaly_detection"):
+        requires = nodes[index[("TEMP", name)]].requires
+        assert requires == {index[("TEMP", "spike")], index[("TEMP", "gradient")]}
+    assert len(nodes[index[("TEMP", "spike")]].requires) == 0
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_order(threads):
+    nodes, index = build_dag(bindings())
+    sequence = []
+
+    def apply(node, upstream):
+        sequence.append(node.key)
+        return node.key
+
+    results, timing = run_dag(nodes, apply, threads=threads)
+    assert sorted(results, key=str) == sorted(nodes, key=str)
+    assert set(timing) == set(nodes)
+    for key in nodes:
+        for r in nodes[key].requires:
+            assert sequence.index(r) < sequence.index(key)
+
+
+def test_circular():
+    a = Node("a", object, "TEMP", {})
+    b = Node("b", object, "TEMP", {})
+    a.requires.add("b")
+    b.requires.add("a")
+    with pytest.raises(AssertionError):
+        run_dag({"a": a, "b": b}, lambda node, upstream: None)
+
+
+def test_threads():
+    """Same result, one or many threads"""
+    profile = DummyData()
+    pqc = ProfileQC(profile, cfg=CFG)
+    pqc2 = ProfileQC(profile, cfg=CFG, threads=4)
+
+    assert "fuzzylogic" in pqc.flags["TEMP"]
+    assert "anomaly_detection" in pqc.flags["TEMP"]
+    for v in pqc.flags:
+        assert list(pqc.flags[v]) == list(pqc2.flags[v])
+        for f in pqc.flags[v]:
+            assert np.all(pqc.flags[v][f] == pqc2.flags[v][f])
+    for v in ("TEMP", "PSAL"):
+        assert set(pqc2.timing[v]) == set(CFG["variables"][
+            "sea_water_temperature" if v == "TEMP" else "sea_water_salinity"])
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Verify the memory-mapped climatology
+"""
+
+import numpy as np
+from numpy import ma
+
+from cotede.qc import ProfileQC
+from cotede.qctests import WOA_NormBias, woa_normbias
+from cotede.utils import load_cfg
+from cotede.utils.tilestore import (
+    FIELDS,
+    TileStore,
+    MAX_CACHED_LEVELS,
+    _axis_weights,
+    _weights_cache,
+    depth_weights,
+    write_tilestore,
+)
+from .data import DummyData
+
+
+DIMS = {
+    "time": np.arange(15.0, 365, 30.5),
+    "depth": np.array([0.0, 10, 20, 50, 100]),
+    "lat": np.arange(-89.5, 90, 1.0),
+    "lon": np.arange(-179.5, 180, 1.0),
+}
+
+
+def _field(tn, zn):
+    """Linear on depth, lat & lon, so exactly interpolated"""
+    lat, lon = np.meshgrid(DIMS["lat"], DIMS["lon"], indexing="ij")
+    return tn * 100 + DIMS["depth"][zn] + 0.1 * lat + 0.01 * lon
+
+
+def _store(tmp_path, fields=None, dims=DIMS):
+    if fields is None:
+        fields = {"mean": _field}
+    return TileStore(write_tilestore(str(tmp_path), dims, fields))
+
+
+def test_profile(tmp_path):
+    db = _store(tmp_path)
+    assert isinstance(db.data["mean"], np.memmap)
+
+    depth = np.array([0, 5, 15, 100, 150])
+    # Exactly on the time bin 3
+    y = db.interpolate("mean", DIMS["time"][3], depth, 10.3, -38.2)["mean"]
+    assert y.shape == depth.shape
+    expected = 300 + depth + 0.1 * 10.3 + 0.01 * -38.2
+    assert np.allclose(y[:4], expected[:4], atol=1e-4)
+    # Beyond the deepest level
+    assert y.mask[4]
+
+
+def test_time_interpolation(tmp_path):
+    db = _store(tmp_path)
+    t = DIMS["time"]
+    y = db.interpolate("mean", [(t[3] + t[4]) / 2, 1, 364], 0, 0.5, 0.5)["mean"]
+    assert np.allclose(y[0], 350 + 0.05 + 0.005)
+    # Between December and January
+    w = (t[0] + 365.25 - 364) / (t[0] + 365.25 - t[-1])
+    expected = w * 1100 + (1 - w) * 0 + 0.055
+    assert np.allclose(y[2], expected, atol=1e-4)
+
+
+def test_longitude_wrap(tmp_path):
+    db = _store(tmp_path)
+    y = db.interpolate("mean", DIMS["time"][0], 0, 0.5, [-170.2, 189.8, 549.8])
+    assert np.allclose(y["mean"], y["mean"][0])
+
+    y = db.interpolate("mean", DIMS["time"][0], 0, 0.5, 179.9)["mean"]
+    # Between 179.5 and -179.5
+    expected = 0.05 + 0.01 * (0.6 * 179.5 + 0.4 * -179.5)
+    assert np.allclose(y, expected, atol=1e-4)
+
+
+def test_track(tmp_path):
+    db = _store(tmp_path)
+    N = 20
+    lat = np.linspace(10, 12, N)
+    lon = np.linspace(-40, -35, N)
+    depth = np.full(N, 5.0)
+    y = db.interpolate("mean", DIMS["time"][2], depth, lat, lon)["mean"]
+    assert np.allclose(y, 200 + 5 + 0.1 * lat + 0.01 * lon, atol=1e-4)
+
+
+def test_invalid_grid_points(tmp_path):
+    """Only the valid grid points are used on the horizontal"""
+
+    def field(tn, zn):
+        value = ma.masked_array(np.ones((DIMS["lat"].size, DIMS["lon"].size)))
+        value[100, 100] = 5
+        value[100, 101] = ma.masked
+        value[:, 200] = np.nan
+        return value
+
+    db = _store(tmp_path, {"mean": field})
+    lat, lon = DIMS["lat"][100], DIMS["lon"][100]
+    y = db.interpolate("mean", DIMS["time"][0], 0, lat + 0.5, lon + 0.5)["mean"]
+    assert np.allclose(y, (5 + 1 + 1) / 3)
+    # All surrounding points invalid
+    lon = DIMS["lon"][200]
+    y = db.interpolate("mean", DIMS["time"][0], 0, lat, lon)["mean"]
+    assert y.mask.all()
+
+
+def test_without_time(tmp_path):
+    dims = {d: DIMS[d] for d in ("depth", "lat", "lon")}
+    db = _store(tmp_path, dims=dims)
+    assert db.data["mean"].shape[0] == 1
+    y = db.interpolate("mean", [1, 180], 10, 0.5, 0.5)["mean"]
+    assert np.allclose(y, 10 + 0.055, atol=1e-4)
+
+
+def _woa_tilestore(tmp_path):
+    """A constant WOA temperature at cotederc('climatology')"""
+
+    def field(v):
+        values = {
+            "mean": 20.0,
+            "standard_deviation": 2.0,
+            "standard_error": 0.1,
+            "number_of_observations": 10,
+        }
+        shape = (DIMS["lat"].size, DIMS["lon"].size)
+        return lambda tn, zn: np.full(shape, values[v])
+
+    write_tilestore(
+        str(tmp_path / "climatology" / "WOA" / "sea_water_temperature"),
+        DIMS,
+        {v: field(v) for v in FIELDS["WOA"]},
+    )
+
+
+def test_woa_normbias_backend(tmp_path, monkeypatch):
+    """WOA_NormBias from a tile store, without OceansDB"""
+    monkeypatch.setenv("COTEDE_DIR", str(tmp_path))
+    _woa_tilestore(tmp_path)
+
+    profile = DummyData()
+    features = woa_normbias(profile, "TEMP", backend="tiles")
+    assert np.allclose(features["woa_mean"][np.isfinite(features["woa_mean"])], 20)
+    expected = ma.filled((profile["TEMP"] - 20) / 2, np.nan)
+    # Deeper than the climatology
+    expected[profile["PRES"] > DIMS["depth"][-1]] = np.nan
+    assert np.allclose(features["woa_normbias"], expected, equal_nan=True)
+
+    y = WOA_NormBias(profile, "TEMP", cfg={"threshold": 3, "backend": "tiles"})
+    assert np.allclose(y.features["woa_normbias"], expected, equal_nan=True)
+
+
+def test_fuzzylogic_backend(tmp_path, monkeypatch):
+    """The fuzzy procedures share the climatology of WOA_NormBias"""
+    monkeypatch.setenv("COTEDE_DIR", str(tmp_path))
+    _woa_tilestore(tmp_path)
+
+    cfg = load_cfg("fuzzylogic")["variables"]["sea_water_temperature"]
+    cfg["woa_normbias"]["backend"] = "tiles"
+    cfg["fuzzylogic"]["backend"] = "tiles"
+    cfg["morello2014"] = dict(cfg["fuzzylogic"], procedure="Morello2014")
+    cfg["anomaly_detection"] = {
+        "procedure": "AnomalyDetection",
+        "backend": "tiles",
+        "threshold": -20,
+        "features": {
+            "woa_normbias": {
+                "model": "exponweib",
+                "qlimit": 1.707276,
+                "param": [5.960434, 0.336008, 1.705502, 0.04268],
+            }
+        },
+    }
+
+    profile = DummyData()
+    pqc = ProfileQC(profile, cfg={"sea_water_temperature": cfg})
+    # The WOA climatology was read only once, from the tile store
+    assert [k for k in pqc.store._features if k[1] == "woa_normbias"] == [
+        ("TEMP", "woa_normbias", (("backend", "tiles"),))
+    ]
+    for f in ("woa_normbias", "fuzzylogic", "morello2014", "anomaly_detection"):
+        assert f in pqc.flags["TEMP"]
+
+
+def test_depth_weights():
+    """Repeated levels reuse the same weights"""
+    grid = DIMS["depth"]
+    levels = np.array([0, 5, 10, 25, 75, 150, np.nan])
+    hits = _weights_cache.cache_info()["hits"]
+    k, w = depth_weights(grid, levels)
+    expected = _axis_weights(grid, levels)
+    assert np.all(k[:-1] == expected[0][:-1])
+    assert np.allclose(w, expected[1], equal_nan=True)
+
+    k2, w2 = depth_weights(grid, levels.copy())
+    assert _weights_cache.cache_info()["hits"] == hits + 1
+    assert np.all(k2 == k)
+    assert np.allclose(w2, w, equal_nan=True)
+
+    # A track at a constant depth is a single level
+    k, w = depth_weights(grid, np.full(1000, 5.0))
+    assert k.shape == (1000, 2)
+    assert np.allclose(w, [0.5, 0.5])
+
+    # A long track is not cached
+    size = len(_weights_cache)
+    k, w = depth_weights(grid, np.full(MAX_CACHED_LEVELS + 1, 5.0))
+    assert len(_weights_cache) == size
+    assert k.shape == (MAX_CACHED_LEVELS + 1, 2)
+    assert np.allclose(w, [0.5, 0.5])